@@ -0,0 +1,91 @@
+"""
+This module generates synthetic cohorts for benchmarking Verticall. It builds on the sequence
+functions in sample_data/generate_sample_data.py, but instead of that script's fixed five-isolate
+tree, the genome size, sample count, divergence and amount of recombination are all parameters.
+
+Because the genomes only differ by substitutions (and then a random rotation and strand), the true
+alignment of any two assemblies is known. The rotation and strand of each assembly are saved in
+cohort.json, which the minimap2 stand-in (fake_minimap2.py) uses to produce alignments.
+
+Copyright 2022 Ryan Wick (rrwick@gmail.com)
+https://github.com/rrwick/Verticall
+
+This file is part of Verticall. Verticall is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by the Free Software Foundation,
+either version 3 of the License, or (at your option) any later version. Verticall is distributed
+in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+details. You should have received a copy of the GNU General Public License along with Verticall.
+If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import importlib.util
+import json
+import pathlib
+import random
+
+
+def load_sample_data_module():
+    filename = pathlib.Path(__file__).resolve().parent.parent / 'sample_data' / \
+        'generate_sample_data.py'
+    spec = importlib.util.spec_from_file_location('generate_sample_data', filename)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+sample_data = load_sample_data_module()
+
+
+def generate_cohort(out_dir, genome_size, sample_count, divergence, recombination, seed=0):
+    """
+    Makes a cohort in out_dir: an assemblies directory (one rotated/flipped FASTA per sample), a
+    reference.fasta (the root sequence), an alignment.fasta (all samples and the reference,
+    unrotated, for Verticall mask) and cohort.json (parameters and each assembly's rotation).
+
+    The tree is made by repeatedly splitting a random tip into two children, each mutated from
+    their parent by about the given divergence. Recombination is the number of events where a
+    sample gets a sixteenth of its genome from another sample (plus some extra mutation).
+    """
+    random.seed(seed)
+    out_dir = pathlib.Path(out_dir)
+    (out_dir / 'assemblies').mkdir(parents=True, exist_ok=True)
+
+    root = sample_data.get_random_seq(genome_size)
+    tips = [root]
+    while len(tips) < sample_count:
+        parent = tips.pop(random.randrange(len(tips)))
+        for _ in range(2):
+            tips.append(sample_data.mutate_seq(parent, divergence * random.uniform(0.5, 1.5)))
+    tips = tips[:sample_count]
+    names = [f'sample_{i+1:04d}' for i in range(len(tips))]
+
+    events = []
+    for _ in range(recombination if len(tips) > 1 else 0):
+        recipient, donor = random.sample(range(len(tips)), 2)
+        start = random.randint(0, genome_size - genome_size // 16)
+        end = start + genome_size // 16
+        donated = sample_data.mutate_seq(tips[donor][start:end], divergence)
+        tips[recipient] = tips[recipient][:start] + donated + tips[recipient][end:]
+        events.append({'recipient': names[recipient], 'donor': names[donor],
+                       'start': start, 'end': end})
+
+    sample_data.save_to_fasta(out_dir / 'reference.fasta', [('reference', root)])
+    sample_data.save_to_fasta(out_dir / 'alignment.fasta',
+                              [('reference', root)] + list(zip(names, tips)))
+    assemblies = {}
+    for name, seq in zip(names, tips):
+        strand = random.choice(['+', '-'])
+        if strand == '-':
+            seq = sample_data.reverse_complement(seq)
+        offset = random.randint(0, len(seq) - 1)
+        sample_data.save_to_fasta(out_dir / 'assemblies' / f'{name}.fasta',
+                                  [(name, seq[offset:] + seq[:offset])])
+        assemblies[name] = {'strand': strand, 'offset': offset}
+
+    cohort = {'genome_size': genome_size, 'sample_count': sample_count,
+              'divergence': divergence, 'recombination': recombination, 'seed': seed,
+              'assemblies': assemblies, 'recombination_events': events}
+    with open(out_dir / 'cohort.json', 'wt') as f:
+        json.dump(cohort, f, indent=2)
+    return cohort
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+This is a deterministic stand-in for minimap2, so Verticall can be benchmarked reproducibly and
+offline. It supports the two ways Verticall runs minimap2:
+  * indexing: `minimap2 [options] -d sample.mmi sample.fasta` saves the FASTA's path in the .mmi
+  * aligning: `minimap2 [options] target.mmi query.fasta` prints PAF lines with =/X CIGARs
+
+Alignments are replayed from a PAF cache directory ($VERTICALL_PAF_CACHE) when possible. Otherwise
+they are made from the cohort's known rotations and strands ($VERTICALL_COHORT, the cohort.json
+made by cohort.py) and saved to the cache, so every run sees exactly the same alignments. Since
+cohort genomes only differ by substitutions, each pair aligns end-to-end, split only where the
+assemblies' rotations break the alignment.
+
+Copyright 2022 Ryan Wick (rrwick@gmail.com)
+https://github.com/rrwick/Verticall
+
+This file is part of Verticall. Verticall is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by the Free Software Foundation,
+either version 3 of the License, or (at your option) any later version. Verticall is distributed
+in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+details. You should have received a copy of the GNU General Public License along with Verticall.
+If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import json
+import numpy as np
+import os
+import pathlib
+import sys
+
+
+# Alignment pieces shorter than this (made when a rotation point is near another) are left out,
+# like minimap2 would.
+MIN_ALIGNMENT_LENGTH = 500
+
+COMPLEMENT = np.zeros(256, dtype=np.uint8)
+for a, b in zip(b'ACGT', b'TGCA'):
+    COMPLEMENT[a] = b
+
+
+def main():
+    args = sys.argv[1:]
+    if '-d' in args:
+        index_filename = pathlib.Path(args[args.index('-d') + 1])
+        fasta_filename = pathlib.Path(args[-1]).resolve()
+        index_filename.write_text(f'{fasta_filename}\n')
+        return
+    target_index, query_fasta = pathlib.Path(args[-2]), pathlib.Path(args[-1])
+    target_fasta = pathlib.Path(target_index.read_text().strip())
+    sys.stdout.write(get_paf(target_fasta, query_fasta, os.environ.get('VERTICALL_PAF_CACHE')))
+
+
+def get_paf(target_fasta, query_fasta, cache_dir=None):
+    """
+    Returns the PAF text for aligning the query to the target, replaying it from the cache
+    directory if it's there and saving it there if not.
+    """
+    if cache_dir is None:
+        return ''.join(get_paf_lines(target_fasta, query_fasta))
+    cache_file = pathlib.Path(cache_dir) / f'{target_fasta.stem}__{query_fasta.stem}.paf'
+    if cache_file.is_file():
+        return cache_file.read_text()
+    paf = ''.join(get_paf_lines(target_fasta, query_fasta))
+    cache_file.parent.mkdir(parents=True, exist_ok=True)
+    temp_file = cache_file.with_suffix(f'.{os.getpid()}.tmp')
+    temp_file.write_text(paf)
+    temp_file.replace(cache_file)  # atomic, in case parallel alignments make the same file
+    return paf
+
+
+def load_rotations():
+    with open(os.environ['VERTICALL_COHORT'], 'rt') as f:
+        return json.load(f)['assemblies']
+
+
+def load_one_seq(fasta_filename):
+    with open(fasta_filename, 'rt') as f:
+        name = f.readline()[1:].split()[0]
+        seq = ''.join(line.strip() for line in f)
+    return name, np.frombuffer(seq.encode(), dtype=np.uint8)
+
+
+def get_colinear_positions(length, rotation):
+    """
+    Returns each assembly position's position in the unrotated forward-strand genome.
+    """
+    positions = (np.arange(length) + rotation['offset']) % length
+    return positions if rotation['strand'] == '+' else length - 1 - positions
+
+
+def get_unrotated_seq(seq, rotation):
+    unrotated = np.empty_like(seq)
+    if rotation['strand'] == '+':
+        unrotated[get_colinear_positions(len(seq), rotation)] = seq
+    else:
+        unrotated[get_colinear_positions(len(seq), rotation)] = COMPLEMENT[seq]
+    return unrotated
+
+
+def get_paf_lines(target_fasta, query_fasta):
+    rotations = load_rotations()
+    unrotated = {'strand': '+', 'offset': 0}  # e.g. the reference
+    target_name, target_seq = load_one_seq(target_fasta)
+    query_name, query_seq = load_one_seq(query_fasta)
+    target_rotation = rotations.get(target_fasta.stem, unrotated)
+    query_rotation = rotations.get(query_fasta.stem, unrotated)
+    length = len(query_seq)
+    assert len(target_seq) == length
+
+    # Where each query position lands in the target, via the genomes' shared coordinates.
+    colinear = get_colinear_positions(length, query_rotation)
+    target_positions = np.empty(length, dtype=np.int64)
+    target_positions[get_colinear_positions(length, target_rotation)] = np.arange(length)
+    target_positions = target_positions[colinear]
+    same = get_unrotated_seq(query_seq, query_rotation)[colinear] == \
+        get_unrotated_seq(target_seq, target_rotation)[colinear]
+
+    strand = '+' if query_rotation['strand'] == target_rotation['strand'] else '-'
+    step = 1 if strand == '+' else -1
+    breaks = np.flatnonzero(np.diff(target_positions) != step) + 1
+    lines = []
+    for q_start, q_end in zip(np.concatenate([[0], breaks]), np.append(breaks, length)):
+        if q_end - q_start < MIN_ALIGNMENT_LENGTH:
+            continue
+        t_start = int(target_positions[q_start:q_end].min())
+        t_end = int(target_positions[q_start:q_end].max()) + 1
+        piece_same = same[q_start:q_end] if strand == '+' else same[q_start:q_end][::-1]
+        matches = int(np.count_nonzero(piece_same))
+        mismatches = int(q_end - q_start) - matches
+        lines.append(f'{query_name}\t{length}\t{q_start}\t{q_end}\t{strand}\t'
+                     f'{target_name}\t{length}\t{t_start}\t{t_end}\t{matches}\t'
+                     f'{q_end - q_start}\t60\ttp:A:P\tNM:i:{mismatches}\t'
+                     f'AS:i:{2 * matches - 4 * mismatches}\tcg:Z:{get_cigar(piece_same)}\n')
+    return lines
+
+
+def get_cigar(same):
+    """
+    Returns an =/X CIGAR string from a boolean array of matches.
+    """
+    run_starts = np.flatnonzero(np.concatenate([[True], same[1:] != same[:-1]]))
+    run_lengths = np.diff(np.append(run_starts, len(same)))
+    return ''.join(f'{n}{"=" if s else "X"}'
+                   for n, s in zip(run_lengths.tolist(), same[run_starts].tolist()))
+
+
+if __name__ == '__main__':
+    main()
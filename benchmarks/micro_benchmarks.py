@@ -0,0 +1,319 @@
+#!/usr/bin/env python3
+"""
+This script micro-benchmarks the functions which run for every assembly pair in Verticall
+pairwise: PAF/CIGAR parsing, sliding windows, smoothing, peak finding and painting. The input is a
+synthetic --eqx alignment with a configurable length, divergence, indel rate and fraction of
+horizontal (more divergent) sequence, so each function can be timed in isolation on realistic
+data without minimap2.
+
+Each benchmark's time is the fastest of several repeats, and its peak memory is measured with
+tracemalloc in a separate run. Reports can be saved as JSON and compared with --compare, which
+exits with an error if any benchmark has slowed by more than --max_slowdown.
+
+Copyright 2022 Ryan Wick (rrwick@gmail.com)
+https://github.com/rrwick/Verticall
+
+This file is part of Verticall. Verticall is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by the Free Software Foundation,
+either version 3 of the License, or (at your option) any later version. Verticall is distributed
+in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+details. You should have received a copy of the GNU General Public License along with Verticall.
+If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import argparse
+import collections
+import json
+import numpy as np
+import pathlib
+import re
+import sys
+import time
+import timeit
+import tracemalloc
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+
+from verticall.alignment import Alignment, remove_ambiguous  # noqa: E402
+from verticall.distance import choose_window_size_and_step, smooth_distribution, \
+    get_peak_distance  # noqa: E402
+from verticall.paint import PaintedContig, AlignmentRole  # noqa: E402
+from verticall.intervals import IntervalSet, format_interval_sets  # noqa: E402
+from verticall.tsv import parse_regions  # noqa: E402
+
+
+def get_arguments():
+    parser = argparse.ArgumentParser(description='Micro-benchmark Verticall\'s per-pair functions')
+
+    alignment_args = parser.add_argument_group('Synthetic alignment')
+    alignment_args.add_argument('--length', type=int, default=1000000,
+                                help='Length of the alignment in bp')
+    alignment_args.add_argument('--divergence', type=float, default=0.005,
+                                help='Substitution rate in vertical regions')
+    alignment_args.add_argument('--indel_rate', type=float, default=0.0002,
+                                help='Rate of indel events (each 1 bp or longer) per position')
+    alignment_args.add_argument('--horizontal', type=float, default=0.1,
+                                help='Fraction of the alignment in horizontal regions (which '
+                                     'have five times the divergence)')
+    alignment_args.add_argument('--strand', type=str, default='+', choices=['+', '-'],
+                                help='Strand of the alignment')
+    alignment_args.add_argument('--seed', type=int, default=0,
+                                help='Random seed for the synthetic alignment')
+
+    settings_args = parser.add_argument_group('Verticall settings')
+    settings_args.add_argument('--window_count', type=int, default=50000,
+                               help='Target sliding window count (as in Verticall pairwise)')
+    settings_args.add_argument('--smoothing_factor', type=float, default=0.8,
+                               help='Smoothing factor (as in Verticall pairwise)')
+    settings_args.add_argument('--secondary', type=float, default=0.7,
+                               help='Secondary peak ratio (as in Verticall pairwise)')
+
+    run_args = parser.add_argument_group('Running')
+    run_args.add_argument('--repeats', type=int, default=5,
+                          help='Number of timed repeats (the fastest is used)')
+    run_args.add_argument('--only', type=str,
+                          help='Comma-delimited names of benchmarks to run (default: all)')
+
+    report_args = parser.add_argument_group('Report')
+    report_args.add_argument('-o', '--out_file', type=pathlib.Path,
+                             help='Save the JSON report to this file')
+    report_args.add_argument('--compare', type=pathlib.Path,
+                             help='JSON report from an earlier run to compare against')
+    report_args.add_argument('--max_slowdown', type=float, default=1.25,
+                             help='With --compare, fail if any benchmark is this many times '
+                                  'slower than before')
+
+    args = parser.parse_args()
+    if args.repeats < 1:
+        sys.exit('Error: --repeats must be at least 1')
+    return args
+
+
+def main():
+    args = get_arguments()
+    parameters = {'length': args.length, 'divergence': args.divergence,
+                  'indel_rate': args.indel_rate, 'horizontal': args.horizontal,
+                  'strand': args.strand, 'seed': args.seed, 'window_count': args.window_count,
+                  'smoothing_factor': args.smoothing_factor, 'secondary': args.secondary}
+    benchmarks = get_benchmarks(args)
+    if args.only is not None:
+        names = args.only.split(',')
+        for name in names:
+            if name not in benchmarks:
+                sys.exit(f'Error: no benchmark named {name}')
+        benchmarks = {n: benchmarks[n] for n in names}
+
+    report = {'parameters': parameters, 'benchmarks': {}}
+    print(f'{"benchmark":<36} {"time (ms)":>12} {"peak memory (MB)":>18}', file=sys.stderr)
+    for name, (setup, run) in benchmarks.items():
+        result = run_benchmark(setup, run, args.repeats)
+        report['benchmarks'][name] = result
+        print(f'{name:<36} {1000.0 * result["seconds"]:12.3f} '
+              f'{result["peak_memory_bytes"] / 2**20:18.2f}', file=sys.stderr)
+
+    if args.out_file is not None:
+        with open(args.out_file, 'wt') as f:
+            json.dump(report, f, indent=2)
+            f.write('\n')
+    if args.compare is not None:
+        with open(args.compare, 'rt') as f:
+            slower = print_comparison(json.load(f), report, args.max_slowdown)
+        if slower:
+            sys.exit(f'Error: slower than --max_slowdown {args.max_slowdown}: {", ".join(slower)}')
+
+
+def get_synthetic_cigar(length, divergence, indel_rate, horizontal, seed):
+    """
+    Returns a random expanded --eqx CIGAR (e.g. ===X==I===) of the given length (not counting
+    indels). Horizontal regions (each 5 kbp) have five times the vertical divergence. Indel lengths
+    are geometrically distributed with a mean of 2 bp, and no indels are at the alignment's ends.
+    """
+    rng = np.random.default_rng(seed)
+    rates = np.full(length, divergence)
+    region_size = 5000
+    region_count = int(round(horizontal * length / region_size))
+    for start in rng.integers(0, max(1, length - region_size), region_count):
+        rates[start:start + region_size] = min(1.0, 5.0 * divergence)
+    ops = np.where(rng.random(length) < rates, ord('X'), ord('='))
+    cigar = ops.astype(np.uint8).tobytes().decode()
+
+    indel_count = rng.binomial(max(0, length - 2), indel_rate)
+    positions = np.unique(rng.integers(1, max(2, length - 1), indel_count))
+    indel_lengths = rng.geometric(0.5, len(positions))
+    indel_types = rng.choice(['I', 'D'], len(positions))
+    pieces, prev = [], 0
+    for pos, indel_length, indel_type in zip(positions.tolist(), indel_lengths.tolist(),
+                                             indel_types.tolist()):
+        pieces += [cigar[prev:pos], indel_type * indel_length]
+        prev = pos
+    pieces.append(cigar[prev:])
+    return ''.join(pieces)
+
+
+def get_synthetic_paf_line(expanded_cigar, strand='+'):
+    """
+    Returns a minimap2-style PAF line (with a cg:Z: tag) for an expanded CIGAR, where the alignment
+    covers all of both the query and target sequences.
+    """
+    query_length = sum(expanded_cigar.count(c) for c in '=XI')
+    target_length = sum(expanded_cigar.count(c) for c in '=XD')
+    matches = expanded_cigar.count('=')
+    mismatches = expanded_cigar.count('X')
+    cigar = ''.join(f'{len(m.group())}{m.group()[0]}'
+                    for m in re.finditer(r'=+|X+|I+|D+', expanded_cigar))
+    return (f'query\t{query_length}\t0\t{query_length}\t{strand}\t'
+            f'target\t{target_length}\t0\t{target_length}\t{matches}\t{len(expanded_cigar)}\t60\t'
+            f'tp:A:P\tAS:i:{2 * matches - 4 * mismatches}\tcg:Z:{cigar}')
+
+
+def get_thresholds(window_differences):
+    """
+    Returns painting thresholds around the most common window distance, similar to those which
+    Verticall would find for a distribution with one big peak.
+    """
+    peak = collections.Counter(window_differences).most_common(1)[0][0]
+    return {'very_low': 0.5 * peak, 'low': 0.75 * peak, 'high': 1.5 * peak, 'very_high': 2 * peak}
+
+
+def get_benchmarks(args):
+    """
+    Returns a dictionary of benchmark name to (setup, run) functions. Each setup function returns
+    the state its run function needs, so only the run function is timed.
+    """
+    expanded_cigar = get_synthetic_cigar(args.length, args.divergence, args.indel_rate,
+                                         args.horizontal, args.seed)
+    paf_line = get_synthetic_paf_line(expanded_cigar, args.strand)
+
+    def get_windowed_alignment():
+        a = Alignment(paf_line)
+        window_size, window_step = choose_window_size_and_step([a.simplified_cigar],
+                                                               args.window_count, None)
+        a.set_up_sliding_windows(window_size, window_step)
+        return a, window_size, window_step
+
+    def get_painted_alignment():
+        a, window_size, _ = get_windowed_alignment()
+        a.paint_sliding_windows(get_thresholds(a.window_differences))
+        return a, window_size
+
+    def get_masses():
+        a, window_size = get_painted_alignment()
+        counts = collections.Counter(a.window_differences)
+        total = len(a.window_differences)
+        return [counts[i] / total for i in range(max(a.window_differences) + 1)], window_size
+
+    def get_unpainted_alignment():
+        a, _, _ = get_windowed_alignment()
+        return a, get_thresholds(a.window_differences)
+
+    def get_smoothed_masses():
+        masses, window_size = get_masses()
+        return smooth_distribution(masses, args.smoothing_factor), window_size
+
+    def reset_windows(state):
+        a, window_size, window_step = state
+        a.windows, a.windows_no_overlap, a.window_differences = [], [], []
+        a.set_up_sliding_windows(window_size, window_step)
+
+    def get_paint():
+        a, _ = get_painted_alignment()
+        paint = np.zeros(a.query_length, dtype=np.int64)
+        for classification in (1, 2):
+            for start, end in a.get_blocks(classification):
+                paint[a.cigar_to_query[start]:a.cigar_to_query[end-1]+1] = classification
+        return paint
+
+    return {
+        'Alignment.__init__':
+            (lambda: paf_line, lambda line: Alignment(line)),
+        'Alignment.__init__ (ignore_indels)':
+            (lambda: paf_line, lambda line: Alignment(line, ignore_indels=True)),
+        'set_up_sliding_windows':
+            (get_windowed_alignment, reset_windows),
+        'paint_sliding_windows':
+            (get_unpainted_alignment, lambda state: state[0].paint_sliding_windows(state[1])),
+        'remove_ambiguous':
+            (lambda: get_painted_alignment()[0].window_class_with_amb, remove_ambiguous),
+        'smooth_distribution':
+            (lambda: get_masses()[0],
+             lambda masses: smooth_distribution(masses, args.smoothing_factor)),
+        'get_peak_distance':
+            (get_smoothed_masses,
+             lambda state: get_peak_distance(state[0], state[1], args.secondary)),
+        'Alignment.get_blocks':
+            (lambda: get_painted_alignment()[0], lambda a: a.get_vertical_blocks()),
+        'PaintedContig.add_alignment':
+            (lambda: get_painted_alignment()[0],
+             lambda a: PaintedContig('N' * a.query_length).add_alignment(a, AlignmentRole.QUERY)),
+        'PaintedContig.get_*_intervals':
+            (lambda: get_painted_alignment()[0], get_painted_contig_intervals),
+        'IntervalSet.from_mask':
+            (get_paint,
+             lambda paint: (IntervalSet.from_mask(paint == 1), IntervalSet.from_mask(paint == 2))),
+        'parse_regions':
+            (lambda: get_region_str(get_painted_alignment()[0]), parse_regions),
+    }
+
+
+def get_region_str(a, contig_count=40):
+    """
+    Returns a vertical region string (as in a pairwise TSV's region columns) for an assembly with
+    contig_count contigs, each painted like the alignment.
+    """
+    contig = PaintedContig('N' * a.query_length)
+    contig.add_alignment(a, AlignmentRole.QUERY)
+    intervals = contig.get_vertical_intervals()
+    return format_interval_sets({f'contig_{i+1}': intervals for i in range(contig_count)})
+
+
+def get_painted_contig_intervals(a):
+    contig = PaintedContig('N' * a.query_length)
+    contig.add_alignment(a, AlignmentRole.QUERY)
+    return contig.get_unaligned_intervals()
+
+
+def run_benchmark(setup, run, repeats):
+    """
+    Times the run function on the setup function's state: the function is called enough times per
+    repeat to take at least 0.2 seconds (like timeit's command-line interface) and the fastest
+    repeat is used. Then the function is run once more with tracemalloc to get its peak memory.
+    """
+    state = setup()
+    timer = timeit.Timer(lambda: run(state), timer=time.perf_counter)
+    number, _ = timer.autorange()
+    times = [t / number for t in timer.repeat(repeat=repeats, number=number)]
+
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    run(state)
+    peak = tracemalloc.get_traced_memory()[1] - baseline
+    tracemalloc.stop()
+    return {'seconds': min(times), 'all_seconds': times, 'calls_per_repeat': number,
+            'peak_memory_bytes': peak}
+
+
+def print_comparison(old, new, max_slowdown):
+    """
+    Prints each benchmark's time in the old and new reports, and returns the names of any which
+    are more than max_slowdown times slower.
+    """
+    if old.get('parameters') != new.get('parameters'):
+        print('Warning: the reports were made with different parameters', file=sys.stderr)
+    print(f'\n{"benchmark":<36} {"old (ms)":>10} {"new (ms)":>10} {"ratio":>8}')
+    slower = []
+    for name, new_result in new['benchmarks'].items():
+        old_result = old['benchmarks'].get(name)
+        if old_result is None:
+            print(f'{name:<36} {"-":>10} {1000.0 * new_result["seconds"]:10.3f}')
+            continue
+        ratio = new_result['seconds'] / old_result['seconds']
+        print(f'{name:<36} {1000.0 * old_result["seconds"]:10.3f} '
+              f'{1000.0 * new_result["seconds"]:10.3f} {ratio:8.2f}')
+        if ratio > max_slowdown:
+            slower.append(name)
+    return slower
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+"""
+This script benchmarks Verticall on a synthetic cohort. It generates the cohort (see cohort.py),
+then times each stage of a normal analysis (pairwise, matrix, mask and summary) as a separate
+Verticall command, and saves the timings, peak memory and output checksums to a JSON report.
+
+minimap2 is replaced by a deterministic stand-in (see fake_minimap2.py) whose alignments are
+computed before any stage is timed, so pairwise's timings are of Verticall itself, the results are
+reproducible and no minimap2 installation is needed. Reports made with the same parameters on
+different versions of Verticall can be compared with --compare.
+
+Copyright 2022 Ryan Wick (rrwick@gmail.com)
+https://github.com/rrwick/Verticall
+
+This file is part of Verticall. Verticall is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by the Free Software Foundation,
+either version 3 of the License, or (at your option) any later version. Verticall is distributed
+in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+details. You should have received a copy of the GNU General Public License along with Verticall.
+If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import argparse
+import datetime
+import hashlib
+import json
+import os
+import pathlib
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCHMARK_DIR = pathlib.Path(__file__).resolve().parent
+sys.path.insert(0, str(BENCHMARK_DIR))
+
+import cohort  # noqa: E402
+import fake_minimap2  # noqa: E402
+
+RUNNER = BENCHMARK_DIR.parent / 'verticall-runner.py'
+
+
+def get_arguments():
+    parser = argparse.ArgumentParser(description='Benchmark Verticall on a synthetic cohort')
+
+    cohort_args = parser.add_argument_group('Cohort')
+    cohort_args.add_argument('--genome_size', type=int, default=200000,
+                             help='Length of each genome in bp')
+    cohort_args.add_argument('--samples', type=int, default=10,
+                             help='Number of samples (assemblies) in the cohort')
+    cohort_args.add_argument('--divergence', type=float, default=0.002,
+                             help='Approximate substitution rate along each branch of the tree')
+    cohort_args.add_argument('--recombination', type=int, default=5,
+                             help='Number of recombination events between samples')
+    cohort_args.add_argument('--seed', type=int, default=0,
+                             help='Random seed for generating the cohort')
+
+    run_args = parser.add_argument_group('Running')
+    run_args.add_argument('-t', '--threads', type=int, default=4,
+                          help='CPU threads for pairwise and mask')
+    run_args.add_argument('--repeats', type=int, default=1,
+                          help='Number of times to run each stage (the fastest time is used)')
+    run_args.add_argument('--work_dir', type=pathlib.Path,
+                          help='Directory for the cohort and outputs (default: a temporary '
+                               'directory which is deleted afterwards)')
+
+    report_args = parser.add_argument_group('Report')
+    report_args.add_argument('-o', '--out_file', type=pathlib.Path,
+                             help='Save the JSON report to this file')
+    report_args.add_argument('--compare', type=pathlib.Path,
+                             help='JSON report from an earlier run to compare against')
+
+    args = parser.parse_args()
+    if args.samples < 3:
+        sys.exit('Error: --samples must be at least 3')
+    if args.repeats < 1:
+        sys.exit('Error: --repeats must be at least 1')
+    return args
+
+
+def main():
+    args = get_arguments()
+    if args.work_dir is None:
+        with tempfile.TemporaryDirectory() as work_dir:
+            report = run_benchmarks(args, pathlib.Path(work_dir))
+    else:
+        args.work_dir.mkdir(parents=True, exist_ok=True)
+        report = run_benchmarks(args, args.work_dir)
+    if args.out_file is not None:
+        with open(args.out_file, 'wt') as f:
+            json.dump(report, f, indent=2)
+            f.write('\n')
+        print(f'\nReport saved to {args.out_file}', file=sys.stderr)
+    if args.compare is not None:
+        with open(args.compare, 'rt') as f:
+            print_comparison(json.load(f), report)
+
+
+def run_benchmarks(args, work_dir):
+    work_dir = work_dir.resolve()
+    env = get_environment(work_dir)
+    parameters = {'genome_size': args.genome_size, 'samples': args.samples,
+                  'divergence': args.divergence, 'recombination': args.recombination,
+                  'seed': args.seed, 'threads': args.threads}
+    report = {'date': datetime.datetime.now().isoformat(timespec='seconds'),
+              'verticall_version': get_verticall_version(), 'git_commit': get_git_commit(),
+              'python': platform.python_version(), 'platform': platform.platform(),
+              'cpu_count': os.cpu_count(), 'parameters': parameters, 'stages': {}}
+
+    start = time.perf_counter()
+    cohort.generate_cohort(work_dir / 'cohort', args.genome_size, args.samples,
+                           args.divergence, args.recombination, args.seed)
+    report['stages']['generate'] = {'seconds': round(time.perf_counter() - start, 4)}
+    log_stage('generate', report['stages']['generate'])
+    prepare_alignments(work_dir, env)
+
+    threads = str(args.threads)
+    assemblies = work_dir / 'cohort' / 'assemblies'
+    for name, command, outputs in [
+            ('pairwise_index', ['pairwise', '-i', assemblies, '-o', work_dir / 'unused.tsv',
+                                '--index_only'], []),
+            ('pairwise', ['pairwise', '-i', assemblies, '-o', work_dir / 'pairwise.tsv',
+                          '-t', threads, '--skip_check'], ['pairwise.tsv']),
+            ('matrix', ['matrix', '-i', work_dir / 'pairwise.tsv', '-o',
+                        work_dir / 'matrix.phylip'], ['matrix.phylip']),
+            ('pairwise_reference', ['pairwise', '-i', assemblies, '-o', work_dir / 'reference.tsv',
+                                    '-r', work_dir / 'cohort' / 'reference.fasta', '-t', threads,
+                                    '--skip_check'], ['reference.tsv']),
+            ('mask', ['mask', '-i', work_dir / 'reference.tsv',
+                      '-a', work_dir / 'cohort' / 'alignment.fasta',
+                      '-o', work_dir / 'masked.fasta', '--reference', 'reference',
+                      '-t', threads], ['masked.fasta']),
+            ('summary', ['summary', '-i', work_dir / 'pairwise.tsv', '--assembly_dir', assemblies,
+                         '--out_dir', work_dir / 'summaries'], ['summaries'])]:
+        report['stages'][name] = run_stage(command, env, args.repeats, work_dir, outputs)
+        log_stage(name, report['stages'][name])
+    report['total_seconds'] = round(sum(s['seconds'] for s in report['stages'].values()), 4)
+    return report
+
+
+def get_environment(work_dir):
+    """
+    Returns environment variables for running Verticall with the minimap2 stand-in: a directory
+    with a minimap2 wrapper script goes first on the PATH.
+    """
+    bin_dir = work_dir / 'bin'
+    bin_dir.mkdir(parents=True, exist_ok=True)
+    wrapper = bin_dir / 'minimap2'
+    wrapper.write_text(f'#!/bin/sh\n'
+                       f'exec "{sys.executable}" "{BENCHMARK_DIR / "fake_minimap2.py"}" "$@"\n')
+    wrapper.chmod(0o755)
+    env = dict(os.environ)
+    env['PATH'] = f'{bin_dir}{os.pathsep}{env.get("PATH", "")}'
+    env['VERTICALL_COHORT'] = str(work_dir / 'cohort' / 'cohort.json')
+    env['VERTICALL_PAF_CACHE'] = str(work_dir / 'paf_cache')
+    return env
+
+
+def prepare_alignments(work_dir, env):
+    """
+    Makes the stand-in's alignments for every pair (in both directions, and to the reference) up
+    front, so during the timed stages it only replays them.
+    """
+    start = time.perf_counter()
+    os.environ['VERTICALL_COHORT'] = env['VERTICALL_COHORT']
+    fastas = sorted((work_dir / 'cohort' / 'assemblies').glob('*.fasta'))
+    fastas.append(work_dir / 'cohort' / 'reference.fasta')
+    for target in fastas:
+        for query in fastas:
+            if target != query:
+                fake_minimap2.get_paf(target, query, env['VERTICALL_PAF_CACHE'])
+    print(f'{"alignments":<20} {time.perf_counter() - start:10.3f} s  (untimed preparation)',
+          file=sys.stderr)
+
+
+def run_stage(command, env, repeats, work_dir, outputs):
+    """
+    Runs a Verticall command (repeats times) and returns its fastest wall time, its peak memory
+    (largest resident set size of the command or any of its worker processes) and checksums of its
+    output files.
+    """
+    command = [sys.executable, str(RUNNER)] + [str(c) for c in command]
+    times, max_rss = [], 0
+    for _ in range(repeats):
+        with tempfile.TemporaryFile('w+t') as stderr:
+            start = time.perf_counter()
+            p = subprocess.Popen(command, env=env, stdout=subprocess.DEVNULL, stderr=stderr)
+            _, status, usage = os.wait4(p.pid, 0)  # unlike p.wait, this gives resource usage
+            times.append(time.perf_counter() - start)
+            p.returncode = -os.WTERMSIG(status) if os.WIFSIGNALED(status) else \
+                os.WEXITSTATUS(status)
+            if p.returncode != 0:
+                stderr.seek(0)
+                sys.exit(f'Error: command failed: {" ".join(command)}\n{stderr.read()}')
+        max_rss = max(max_rss, usage.ru_maxrss)  # kB on Linux, includes waited-for workers
+    return {'seconds': round(min(times), 4), 'all_seconds': [round(t, 4) for t in times],
+            'max_rss_kb': max_rss,
+            'outputs': {o: get_checksum(work_dir / o) for o in outputs}}
+
+
+def get_checksum(path):
+    """
+    Returns a SHA-256 checksum of a file, or of all files in a directory (in name order).
+    """
+    sha = hashlib.sha256()
+    files = sorted(path.iterdir()) if path.is_dir() else [path]
+    for filename in files:
+        sha.update(filename.name.encode() if path.is_dir() else b'')
+        with open(filename, 'rb') as f:
+            for chunk in iter(lambda: f.read(2**20), b''):
+                sha.update(chunk)
+    return sha.hexdigest()
+
+
+def get_verticall_version():
+    p = subprocess.run([sys.executable, str(RUNNER), '--version'], capture_output=True, text=True)
+    return p.stdout.strip()
+
+
+def get_git_commit():
+    p = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BENCHMARK_DIR,
+                       capture_output=True, text=True)
+    return p.stdout.strip() if p.returncode == 0 else None
+
+
+def log_stage(name, stage):
+    memory = f'  {stage["max_rss_kb"] / 1024:8.1f} MB' if 'max_rss_kb' in stage else ''
+    print(f'{name:<20} {stage["seconds"]:10.3f} s{memory}', file=sys.stderr)
+
+
+def print_comparison(old, new):
+    """
+    Prints each stage's time in the old and new reports, and flags stages whose outputs changed.
+    """
+    print(f'\n{"stage":<20} {"old (s)":>10} {"new (s)":>10} {"ratio":>8}  outputs')
+    if old.get('parameters') != new.get('parameters'):
+        print('Warning: the reports were made with different parameters', file=sys.stderr)
+    for name, new_stage in new['stages'].items():
+        old_stage = old['stages'].get(name)
+        if old_stage is None:
+            print(f'{name:<20} {"-":>10} {new_stage["seconds"]:10.3f}')
+            continue
+        ratio = new_stage['seconds'] / old_stage['seconds'] if old_stage['seconds'] > 0 else 0.0
+        outputs = 'same' if old_stage.get('outputs') == new_stage.get('outputs') else 'CHANGED'
+        print(f'{name:<20} {old_stage["seconds"]:10.3f} {new_stage["seconds"]:10.3f} '
+              f'{ratio:8.2f}  {outputs if new_stage.get("outputs") else ""}')
+
+
+if __name__ == '__main__':
+    main()
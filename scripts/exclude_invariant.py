@@ -18,6 +18,7 @@ If not, see <https://www.gnu.org/licenses/>.
 
 import argparse
 import gzip
+import numpy as np
 import sys
 
 
@@ -32,84 +33,75 @@ def get_arguments():
 
 def main():
     args = get_arguments()
-    alignment = {name: seq for name, seq in iterate_fasta(args.alignment, preserve_case=True)}
-    alignment = drop_invariant_positions(alignment)
-    for name, seq in alignment.items():
-        print(f'>{name}\n{seq}')
+    names, matrix, column_bits = load_alignment(args.alignment)
+    variant_columns = get_variant_columns(column_bits)
+    matrix = matrix[:, variant_columns]
+    for i, name in enumerate(names):
+        print(f'>{name}\n{matrix[i].tobytes().decode()}')
     print(file=sys.stderr)
 
 
-def drop_invariant_positions(sequences):
+def load_alignment(filename):
     """
-    Returns an alignment where any columns that lack variation are removed.
+    Loads the alignment into a 2D uint8 matrix (one row per sequence), also returning the A/C/G/T
+    bits for each column (see get_base_bits).
     """
-    alignment_length = get_alignment_length(sequences)
-    positions_to_remove = set()
-    a, c, g, t, n = 0, 0, 0, 0, 0
-    print(f'0 / {alignment_length:,}', file=sys.stderr, end='', flush=True)
-    for i in range(alignment_length):
-        if (i+1) % 1000 == 0:
-            print(f'\r{i+1:,} / {alignment_length:,}', file=sys.stderr, end='', flush=True)
-        bases_at_pos = {seq[i] for seq in sequences.values()}
-        real_base_count = count_real_bases(bases_at_pos)
-        if real_base_count == 1:
-            positions_to_remove.add(i)
-            if 'A' in bases_at_pos or 'a' in bases_at_pos:
-                a += 1
-            elif 'C' in bases_at_pos or 'c' in bases_at_pos:
-                c += 1
-            elif 'G' in bases_at_pos or 'g' in bases_at_pos:
-                g += 1
-            elif 'T' in bases_at_pos or 't' in bases_at_pos:
-                t += 1
-            else:
-                assert False
-        elif real_base_count == 0:
-            positions_to_remove.add(i)
-            n += 1
-    print(f'\r{alignment_length:,} / {alignment_length:,}', file=sys.stderr, end='\n\n', flush=True)
-    assert a + c + g + t + n == len(positions_to_remove)
-    if not positions_to_remove:
+    names, rows = [], []
+    column_bits = None
+    print(f'0 sequences loaded', file=sys.stderr, end='', flush=True)
+    for name, seq in iterate_fasta(filename, preserve_case=True):
+        row = np.frombuffer(seq.encode(), dtype=np.uint8)
+        if column_bits is None:
+            column_bits = np.zeros(len(row), dtype=np.uint8)
+        if len(row) != len(column_bits):
+            sys.exit('\nError: all sequences in the alignment must be the same length')
+        column_bits |= BASE_BITS[row]
+        names.append(name)
+        rows.append(row)
+        print(f'\r{len(names):,} sequences loaded', file=sys.stderr, end='', flush=True)
+    print('\n', file=sys.stderr, flush=True)
+    if not rows:
+        sys.exit('Error: no sequences could be loaded from the alignment')
+    return names, np.vstack(rows), column_bits
+
+
+def get_variant_columns(column_bits):
+    """
+    Returns a boolean array which is True for the columns with more than one real base.
+    """
+    base_counts = BIT_COUNTS[column_bits]
+    variant_columns = base_counts > 1
+    a, c, g, t = (int(np.count_nonzero(column_bits == b)) for b in (1, 2, 4, 8))
+    n = int(np.count_nonzero(base_counts == 0))
+    removed_count = a + c + g + t + n
+    if removed_count == 0:
         print(f'no invariant positions removed from pseudo-alignment', file=sys.stderr)
     else:
-        percentage = 100.0 * len(positions_to_remove)/alignment_length
-        print(f'{len(positions_to_remove):,} invariant positions ({percentage:.3}%) removed from '
+        percentage = 100.0 * removed_count/len(column_bits)
+        print(f'{removed_count:,} invariant positions ({percentage:.3}%) removed from '
               f'pseudo-alignment:', file=sys.stderr)
         print(f'  {a:9,} × A', file=sys.stderr)
         print(f'  {c:9,} × C', file=sys.stderr)
         print(f'  {g:9,} × G', file=sys.stderr)
         print(f'  {t:9,} × T', file=sys.stderr)
         print(f'  {n:9,} × other', file=sys.stderr)
-    return drop_positions(sequences, positions_to_remove)
-
-
-def get_alignment_length(sequences):
-    alignment_lengths = {len(seq) for seq in sequences.values()}
-    assert len(alignment_lengths) == 1
-    return list(alignment_lengths)[0]
-
-
-def drop_positions(sequences, positions_to_remove):
-    if len(positions_to_remove) == 0:
-        return sequences
-    new_sequences = {}
-    for name, seq in sequences.items():
-        new_seq = ''.join(b for i, b in enumerate(seq) if i not in positions_to_remove)
-        new_sequences[name] = new_seq
-    return new_sequences
-
-
-def count_real_bases(base_set):
-    count = 0
-    if 'A' in base_set or 'a' in base_set:
-        count += 1
-    if 'C' in base_set or 'c' in base_set:
-        count += 1
-    if 'G' in base_set or 'g' in base_set:
-        count += 1
-    if 'T' in base_set or 't' in base_set:
-        count += 1
-    return count
+    return variant_columns
+
+
+def get_base_bits():
+    """
+    Returns a lookup table which converts a sequence character (as a uint8) to a bit flag for its
+    base: A=1, C=2, G=4, T=8 (case insensitive) and 0 for anything else (gaps, N, etc).
+    """
+    base_bits = np.zeros(256, dtype=np.uint8)
+    for i, base in enumerate('ACGT'):
+        base_bits[ord(base)] = 1 << i
+        base_bits[ord(base.lower())] = 1 << i
+    return base_bits
+
+
+BASE_BITS = get_base_bits()
+BIT_COUNTS = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
 
 
 def get_compression_type(filename):
@@ -0,0 +1,121 @@
+"""
+This module contains some tests for Verticall. To run them, execute `pytest` from the root
+Verticall directory.
+
+Copyright 2022 Ryan Wick (rrwick@gmail.com)
+https://github.com/rrwick/Verticall
+
+This file is part of Verticall. Verticall is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by the Free Software Foundation,
+either version 3 of the License, or (at your option) any later version. Verticall is distributed
+in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+details. You should have received a copy of the GNU General Public License along with Verticall.
+If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import numpy as np
+import pathlib
+import pytest
+import tempfile
+
+import verticall.database
+import verticall.mask
+import verticall.matrix
+import verticall.summary
+import verticall.tsv
+
+
+def make_database(tsv, db):
+    with open(tsv, 'rt') as f:
+        header = f.readline()
+        with verticall.database.ResultsDatabase(db, header) as database:
+            for line in f:
+                database.write(line)
+
+
+def test_is_results_database():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        db = pathlib.Path(temp_dir) / 'pairwise.db'
+        assert not verticall.database.is_results_database(db)
+        make_database('test/test_mask/pairwise.tsv', db)
+        assert verticall.database.is_results_database(db)
+        tsv = pathlib.Path('test/test_mask/pairwise.tsv')
+        assert not verticall.database.is_results_database(tsv)
+
+
+def test_connect_not_a_database():
+    # An existing file which isn't an SQLite database (e.g. a TSV) gives a clear error.
+    tsv = pathlib.Path('test/test_mask/pairwise.tsv')
+    with pytest.raises(SystemExit) as e:
+        verticall.database.connect(tsv)
+    assert 'could not open' in str(e.value)
+    with pytest.raises(SystemExit) as e:
+        verticall.database.ResultsDatabase(tsv, 'assembly_a\tassembly_b\n')
+    assert 'could not open' in str(e.value)
+
+
+def test_iterate_database_lines():
+    # Lines from the database should match those from the TSV.
+    tsv = pathlib.Path('test/test_mask/pairwise.tsv')
+    with tempfile.TemporaryDirectory() as temp_dir:
+        db = pathlib.Path(temp_dir) / 'pairwise.db'
+        make_database(tsv, db)
+        for names in [None, {'ref'}, {'not_ref'}, {'ref', 'not_ref'}, {'missing'}]:
+            assert list(verticall.tsv.iterate_tsv_lines(db, names)) == \
+                list(verticall.tsv.iterate_tsv_lines(tsv, names))
+        assert verticall.tsv.get_indexed_assembly_a_names(db) == ['not_ref', 'ref']
+
+
+def test_results_database_replace():
+    # Writing a pair again replaces its rows instead of adding to them.
+    tsv = pathlib.Path('test/test_mask/pairwise.tsv')
+    with tempfile.TemporaryDirectory() as temp_dir:
+        db = pathlib.Path(temp_dir) / 'pairwise.db'
+        make_database(tsv, db)
+        with open(tsv, 'rt') as f:
+            header = f.readline()
+        with verticall.database.ResultsDatabase(db, header) as database:
+            database.write('ref\t4\tprimary\t0.07\t1:0-30\t\t\n')
+        lines = list(verticall.tsv.iterate_tsv_lines(db, {'ref'}))
+        assert len(lines) == 5
+        assert lines[-1] == 'ref\t4\tprimary\t0.07\t1:0-30\t\t\n'
+        with pytest.raises(SystemExit) as e:
+            verticall.database.ResultsDatabase(db, 'assembly_a\tassembly_b\tresult_level\n')
+        assert 'different columns' in str(e.value)
+        with pytest.raises(SystemExit) as e:
+            verticall.tsv.build_tsv_index(db)
+        assert 'results database' in str(e.value)
+
+
+def test_database_input():
+    # matrix, mask and summary should get the same results from a database as from the TSV.
+    with tempfile.TemporaryDirectory() as temp_dir:
+        tsv = pathlib.Path('test/test_matrix/pairwise.tsv')
+        db = pathlib.Path(temp_dir) / 'matrix.db'
+        make_database(tsv, db)
+        from_tsv = verticall.matrix.load_distances(tsv, ['mean'])
+        from_db = verticall.matrix.load_distances(db, ['mean'])
+        assert from_db[1] == from_tsv[1]
+        for i in range(2):
+            assert np.array_equal(from_db[0][i], from_tsv[0][i])
+        assert np.array_equal(from_db[0][2]['mean'], from_tsv[0][2]['mean'], equal_nan=True)
+
+        tsv = pathlib.Path('test/test_mask/pairwise.tsv')
+        db = pathlib.Path(temp_dir) / 'mask.db'
+        make_database(tsv, db)
+        for multi in ['first', 'exclude', 'low', 'high']:
+            from_tsv = verticall.mask.load_regions(tsv, 'ref', multi)
+            from_db = verticall.mask.load_regions(db, 'ref', multi)
+            assert from_db[1:] == from_tsv[1:]
+            for name in from_tsv[3]:
+                for r_db, r_tsv in zip(from_db[0][name], from_tsv[0][name]):
+                    assert np.array_equal(r_db, r_tsv)
+
+        for sample_name in ['ref', 'not_ref']:
+            from_tsv = verticall.summary.RegionCoverage({'1': 30})
+            verticall.summary.load_data(tsv, {sample_name: from_tsv})
+            from_db = verticall.summary.RegionCoverage({'1': 30})
+            verticall.summary.load_data(db, {sample_name: from_db})
+            assert verticall.summary.summarise_data(from_db, True) == \
+                verticall.summary.summarise_data(from_tsv, True)
@@ -0,0 +1,70 @@
+"""
+This module contains some tests for Verticall. To run them, execute `pytest` from the root
+Verticall directory.
+
+Copyright 2022 Ryan Wick (rrwick@gmail.com)
+https://github.com/rrwick/Verticall
+
+This file is part of Verticall. Verticall is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by the Free Software Foundation,
+either version 3 of the License, or (at your option) any later version. Verticall is distributed
+in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+details. You should have received a copy of the GNU General Public License along with Verticall.
+If not, see <https://www.gnu.org/licenses/>.
+"""
+
+
+import json
+import time
+
+import verticall.instrument
+
+
+def test_pair_stats():
+    stats = verticall.instrument.PairStats('a', 'b')
+    with stats.stage('alignment'):
+        time.sleep(0.01)
+    with stats.stage('painting'):
+        pass
+    with stats.stage('painting'):  # times add up for repeated stages
+        time.sleep(0.01)
+    stats.count('windows', 123)
+    record = stats.finish()
+    assert record['assembly_a'] == 'a'
+    assert record['assembly_b'] == 'b'
+    assert list(record['seconds']) == verticall.instrument.STAGES + ['total']
+    assert record['seconds']['alignment'] >= 0.01
+    assert record['seconds']['painting'] >= 0.01
+    assert record['seconds']['smoothing'] == 0.0
+    assert record['seconds']['total'] >= 0.02
+    assert record['counts'] == {'windows': 123}
+    assert record['max_rss_kb'] > 0
+    assert isinstance(record['pid'], int)
+
+
+def test_pair_stats_exception():
+    stats = verticall.instrument.PairStats('a', 'b')
+    try:
+        with stats.stage('culling'):
+            raise ValueError
+    except ValueError:
+        pass
+    assert 'culling' in stats.record['seconds']
+
+
+def test_time_stage():
+    with verticall.instrument.time_stage(None, 'alignment'):
+        pass
+    stats = verticall.instrument.PairStats('a', 'b')
+    with verticall.instrument.time_stage(stats, 'alignment'):
+        pass
+    assert 'alignment' in stats.record['seconds']
+
+
+def test_format_record():
+    stats = verticall.instrument.PairStats('a', 'b')
+    line = verticall.instrument.format_record(stats.finish())
+    assert line.endswith('\n')
+    assert line.count('\n') == 1
+    assert json.loads(line)['assembly_b'] == 'b'
@@ -0,0 +1,156 @@
+"""
+This module contains some tests for Verticall. To run them, execute `pytest` from the root
+Verticall directory.
+
+Copyright 2022 Ryan Wick (rrwick@gmail.com)
+https://github.com/rrwick/Verticall
+
+This file is part of Verticall. Verticall is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by the Free Software Foundation,
+either version 3 of the License, or (at your option) any later version. Verticall is distributed
+in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+details. You should have received a copy of the GNU General Public License along with Verticall.
+If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import numpy as np
+import random
+
+import verticall.intervals
+from verticall.intervals import IntervalSet
+
+
+def get_random_set(length):
+    regions = []
+    for _ in range(random.randint(0, 6)):
+        start = random.randint(0, length - 1)
+        regions.append((start, random.randint(start, length)))
+    return IntervalSet.from_array(regions)
+
+
+def get_positions(interval_set):
+    return {p for start, end in interval_set for p in range(start, end)}
+
+
+def check_normalised(interval_set):
+    assert np.all(interval_set.ends > interval_set.starts)
+    assert np.all(interval_set.starts[1:] > interval_set.ends[:-1])
+
+
+def test_interval_set_1():
+    s = IntervalSet.from_array([(20, 30), (0, 5), (5, 10), (12, 15), (40, 40), (25, 28)])
+    assert s.to_list() == [(0, 10), (12, 15), (20, 30)]
+    assert s.total_length() == 23
+    assert len(s) == 3
+    assert np.array_equal(s.to_array(), [[0, 10], [12, 15], [20, 30]])
+    assert str(s) == '[(0, 10), (12, 15), (20, 30)]'
+    assert s.contains([0, 9, 10, 11, 12, 29, 30]).tolist() == \
+        [True, True, False, False, True, True, False]
+
+
+def test_interval_set_2():
+    a = IntervalSet([0, 20], [10, 30])
+    b = IntervalSet([5], [25])
+    assert a.union(b).to_list() == [(0, 30)]
+    assert a.intersection(b).to_list() == [(5, 10), (20, 25)]
+    assert a.difference(b).to_list() == [(0, 5), (25, 30)]
+    assert b.difference(a).to_list() == [(10, 20)]
+    assert a.complement(40).to_list() == [(10, 20), (30, 40)]
+    assert IntervalSet().complement(5).to_list() == [(0, 5)]
+    assert IntervalSet().union(IntervalSet()).to_list() == []
+    assert IntervalSet().intersection(a).to_list() == []
+
+
+def test_from_mask():
+    assert IntervalSet.from_mask(np.array([0, 1, 1, 0, 1], dtype=bool)).to_list() == \
+        [(1, 3), (4, 5)]
+    assert IntervalSet.from_mask(np.array([], dtype=bool)).to_list() == []
+    assert IntervalSet.from_mask(np.ones(4, dtype=bool)).to_list() == [(0, 4)]
+
+
+def test_from_mask_paint():
+    # The runs of one classification in a per-position paint array.
+    def get_blocks(paint, classification):
+        return IntervalSet.from_mask(np.array(paint) == classification).to_list()
+
+    paint = [0, 1, 1, 1, 0, 0, 0, 1, 0, 1, 1, 0]
+    assert get_blocks(paint, 0) == [(0, 1), (4, 7), (8, 9), (11, 12)]
+    assert get_blocks(paint, 1) == [(1, 4), (7, 8), (9, 11)]
+    assert get_blocks(paint, 2) == []
+
+    paint = [0, 0, 0, 0, 0, 0, 1, 1, 1, 1, 1, 1]
+    assert get_blocks(paint, 0) == [(0, 6)]
+    assert get_blocks(paint, 1) == [(6, 12)]
+
+    paint = [0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0]
+    assert get_blocks(paint, 0) == [(0, 12)]
+    assert get_blocks(paint, 1) == []
+
+    paint = []
+    assert get_blocks(paint, 0) == []
+    assert get_blocks(paint, 1) == []
+
+    paint = ['A', 'A', 'B', 'C', 'C', 'A']
+    assert get_blocks(paint, 'A') == [(0, 2), (5, 6)]
+    assert get_blocks(paint, 'B') == [(2, 3)]
+    assert get_blocks(paint, 'C') == [(3, 5)]
+
+
+def test_random_operations():
+    # Set operations should match Python sets of positions.
+    random.seed(0)
+    for _ in range(500):
+        length = random.randint(1, 50)
+        a, b, c = get_random_set(length), get_random_set(length), get_random_set(length)
+        all_positions = set(range(length))
+        for result, expected in [(a.union(b, c), get_positions(a) | get_positions(b) |
+                                  get_positions(c)),
+                                 (a.intersection(b), get_positions(a) & get_positions(b)),
+                                 (a.difference(b), get_positions(a) - get_positions(b)),
+                                 (a.complement(length), all_positions - get_positions(a))]:
+            check_normalised(result)
+            assert get_positions(result) == expected
+        assert a.union(b) == b.union(a)
+
+
+def test_get_depth_runs():
+    random.seed(1)
+    for _ in range(200):
+        length = random.randint(1, 50)
+        sets = [get_random_set(length) for _ in range(random.randint(0, 5))]
+        starts, ends, depths = verticall.intervals.get_depth_runs(sets, length)
+        assert starts[0] == 0 and ends[-1] == length
+        assert np.array_equal(starts[1:], ends[:-1])
+        assert np.all(depths[1:] != depths[:-1])
+        per_position = np.repeat(depths, ends - starts)
+        for p in range(length):
+            assert per_position[p] == sum(p in get_positions(s) for s in sets)
+
+
+def test_get_layered_depth_runs():
+    random.seed(2)
+    for _ in range(200):
+        length = random.randint(1, 50)
+        layers = [[get_random_set(length) for _ in range(random.randint(0, 3))]
+                  for _ in range(3)]
+        breakpoint_lists = [[verticall.intervals.get_breakpoints(s) for s in layer]
+                            for layer in layers]
+        starts, ends, depths = \
+            verticall.intervals.get_layered_depth_runs(breakpoint_lists, length)
+        assert depths.shape == (3, len(starts))
+        assert starts[0] == 0 and ends[-1] == length
+        assert np.array_equal(starts[1:], ends[:-1])
+        assert np.all(np.any(depths[:, 1:] != depths[:, :-1], axis=0))
+        for i, layer in enumerate(layers):
+            per_position = np.repeat(depths[i], ends - starts)
+            for p in range(length):
+                assert per_position[p] == sum(p in get_positions(s) for s in layer)
+
+
+def test_format_interval_sets():
+    sets = {'A': IntervalSet([0, 10, 30], [10, 20, 40]), 'B': IntervalSet([5], [6])}
+    assert verticall.intervals.format_interval_sets(sets) == 'A:0-20,A:30-40,B:5-6'
+    sets['C'] = IntervalSet()
+    assert verticall.intervals.format_interval_sets(sets) == 'A:0-20,A:30-40,B:5-6'
+    assert verticall.intervals.format_interval_sets({}) == ''
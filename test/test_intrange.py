@@ -14,6 +14,8 @@ details. You should have received a copy of the GNU General Public License along
 If not, see <https://www.gnu.org/licenses/>.
 """
 
+import random
+
 import verticall.intrange
 
 
@@ -76,3 +78,55 @@ def test_overlaps_2():
     r2 = verticall.intrange.IntRange([(5, 15)])
     assert r1.overlaps(r2)
     assert r2.overlaps(r1)
+
+
+def test_overlaps_3():
+    r1 = verticall.intrange.IntRange([(0, 10)])
+    r2 = verticall.intrange.IntRange([(10, 20)])
+    r3 = verticall.intrange.IntRange([(2, 3), (30, 40)])
+    assert not r1.overlaps(r2)
+    assert not r2.overlaps(r1)
+    assert r1.overlaps(r3)
+    assert r3.overlaps(r1)
+
+
+def test_range_7():
+    r = verticall.intrange.IntRange([(20, 30), (0, 5), (5, 10), (15, 12), (40, 40)])
+    assert r.total_length() == 23
+    assert str(r) == '[(0, 10), (12, 15), (20, 30)]'
+    r.add_range(9, 21)
+    assert str(r) == '[(0, 30)]'
+
+
+def get_naive_ranges(ranges):
+    covered = set()
+    for start, end in ranges:
+        covered.update(range(min(start, end), max(start, end)))
+    merged = []
+    for pos in sorted(covered):
+        if merged and merged[-1][1] == pos:
+            merged[-1] = (merged[-1][0], pos + 1)
+        else:
+            merged.append((pos, pos + 1))
+    return merged
+
+
+def test_random_ranges():
+    # Adding ranges one at a time or all at once should match a naive per-integer approach.
+    random.seed(0)
+    for _ in range(200):
+        ranges = [(random.randint(0, 100), random.randint(0, 100))
+                  for _ in range(random.randint(0, 20))]
+        one_at_a_time = verticall.intrange.IntRange()
+        for start, end in ranges:
+            one_at_a_time.add_range(start, end)
+        all_at_once = verticall.intrange.IntRange(ranges)
+        naive = get_naive_ranges(ranges)
+        assert one_at_a_time.ranges == naive
+        assert all_at_once.ranges == naive
+        assert all_at_once.total_length() == sum(e - s for s, e in naive)
+        other_ranges = [(random.randint(0, 100), random.randint(0, 100)) for _ in range(3)]
+        other = verticall.intrange.IntRange(other_ranges)
+        naive_overlap = bool(set(p for s, e in naive for p in range(s, e)) &
+                             set(p for s, e in other.ranges for p in range(s, e)))
+        assert all_at_once.overlaps(other) == naive_overlap
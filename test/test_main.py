@@ -0,0 +1,47 @@
+"""
+This module contains some tests for Verticall. To run them, execute `pytest` from the root
+Verticall directory.
+
+Copyright 2022 Ryan Wick (rrwick@gmail.com)
+https://github.com/rrwick/Verticall
+
+This file is part of Verticall. Verticall is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by the Free Software Foundation,
+either version 3 of the License, or (at your option) any later version. Verticall is distributed
+in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+details. You should have received a copy of the GNU General Public License along with Verticall.
+If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import subprocess
+import sys
+
+
+HEAVY_MODULES = ['matplotlib', 'pandas', 'plotnine', 'verticall.view', 'verticall.summary']
+
+
+def get_imported_modules(code):
+    """
+    Runs the code in a fresh Python process (so nothing is already imported) and returns which of
+    the heavy modules it imported.
+    """
+    code += f'\nimport sys\nprint(",".join(m for m in {HEAVY_MODULES} if m in sys.modules))'
+    result = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True,
+                            check=True)
+    return [m for m in result.stdout.strip().split(',') if m]
+
+
+def test_main_import():
+    # Importing the CLI and parsing arguments shouldn't import any plotting modules.
+    assert get_imported_modules('import verticall.__main__') == []
+    assert get_imported_modules('import verticall.__main__ as m\n'
+                                'args = m.parse_args(["summary", "-i", "in.tsv", '
+                                '"-a", "a.fasta"])\n'
+                                'm.check_summary_args(args)') == []
+
+
+def test_non_plotting_commands():
+    # The modules for pairwise, matrix, mask and repair shouldn't import any plotting modules.
+    for module in ['pairwise', 'matrix', 'mask', 'repair']:
+        assert get_imported_modules(f'import verticall.{module}') == []
@@ -15,10 +15,14 @@ If not, see <https://www.gnu.org/licenses/>.
 """
 
 import collections
+import numpy as np
 import pathlib
 import pytest
+import shutil
+import tempfile
 
 import verticall.mask
+import verticall.tsv
 
 
 def test_welcome_message(capsys):
@@ -36,29 +40,30 @@ def test_finished_message(capsys):
     assert 'Finished' in err
 
 
-def test_get_start_end():
-    assert verticall.mask.get_start_end('a:1-2') == (1, 2)
-    assert verticall.mask.get_start_end('b:10-20') == (10, 20)
-
-
 def test_get_alignment_positions():
     #   aligned positions: 01234567
     #         aligned seq: ACGATCGA
     # unaligned positions: 01234567
-    assert verticall.mask.get_alignment_positions('ACGATCGA', 8) == \
-           {0: 0, 1: 1, 2: 2, 3: 3, 4: 4, 5: 5, 6: 6, 7: 7, 8: 8}
+    assert verticall.mask.get_alignment_positions('ACGATCGA', 8).tolist() == \
+           [0, 1, 2, 3, 4, 5, 6, 7, 8]
 
     #   aligned positions: 012345678
     #         aligned seq: ACGA-TCGA
     # unaligned positions: 0123 4567
-    assert verticall.mask.get_alignment_positions('ACGA-TCGA', 8) == \
-           {0: 0, 1: 1, 2: 2, 3: 3, 4: 5, 5: 6, 6: 7, 7: 8, 8: 9}
+    assert verticall.mask.get_alignment_positions('ACGA-TCGA', 8).tolist() == \
+           [0, 1, 2, 3, 5, 6, 7, 8, 9]
 
     #   aligned positions: 0123456789
     #         aligned seq: A-CGA-TCGA
     # unaligned positions: 0 123 4567
-    assert verticall.mask.get_alignment_positions('A-CGA-TCGA', 8) == \
-           {0: 0, 1: 2, 2: 3, 3: 4, 4: 6, 5: 7, 6: 8, 7: 9, 8: 10}
+    assert verticall.mask.get_alignment_positions('A-CGA-TCGA', 8).tolist() == \
+           [0, 2, 3, 4, 6, 7, 8, 9, 10]
+
+    #   aligned positions: 0123456789
+    #         aligned seq: --ACGATCGA
+    # unaligned positions:   01234567
+    assert verticall.mask.get_alignment_positions('--ACGATCGA', 8).tolist() == \
+           [2, 3, 4, 5, 6, 7, 8, 9, 10]
 
     with pytest.raises(SystemExit) as e:
         verticall.mask.get_alignment_positions('A--GA--CGA', 8)
@@ -117,34 +122,66 @@ def test_finalise():
                                                                    'C': 'T'}
 
 
+def count_real_bases(bases):
+    column_bits = np.bitwise_or.reduce(verticall.mask.BASE_BITS[[ord(b) for b in bases]])
+    return verticall.mask.BIT_COUNTS[column_bits]
+
+
 def test_count_real_bases():
-    assert verticall.mask.count_real_bases({'N'}) == 0
-    assert verticall.mask.count_real_bases({'A'}) == 1
-    assert verticall.mask.count_real_bases({'A', 'T'}) == 2
-    assert verticall.mask.count_real_bases({'A', 'N'}) == 1
-    assert verticall.mask.count_real_bases({'-', 'N'}) == 0
-    assert verticall.mask.count_real_bases({'A', 'N', 'C', '-', 'G', 'X', 'T'}) == 4
+    assert count_real_bases('N') == 0
+    assert count_real_bases('A') == 1
+    assert count_real_bases('AT') == 2
+    assert count_real_bases('aT') == 2
+    assert count_real_bases('At') == 2
+    assert count_real_bases('Aa') == 1
+    assert count_real_bases('AN') == 1
+    assert count_real_bases('-N') == 0
+    assert count_real_bases('ANC-GXT') == 4
+
 
+def as_tuples(regions):
+    """
+    Converts a tuple of vertical/horizontal/unaligned region arrays to lists of tuples.
+    """
+    return tuple([tuple(r) for r in a.tolist()] for a in regions)
 
-def test_check_tsv_file_1():
+
+def as_arrays(*regions):
+    return tuple(np.array(r, dtype=np.int64).reshape(-1, 2) for r in regions)
+
+
+def as_strings(sequences):
+    return {name: verticall.mask.get_seq_str(seq) for name, seq in sequences.items()}
+
+
+def test_auto_ref_name_1():
     in_tsv = pathlib.Path('test/test_mask/pairwise.tsv')
-    ref_name = verticall.mask.check_tsv_file(in_tsv, 'ref')
+    _, ref_name, _, _ = verticall.mask.load_regions(in_tsv, 'ref', 'first')
     assert ref_name == 'ref'
 
 
-def test_check_tsv_file_2():
+def test_auto_ref_name_2():
     # Fails to auto-determine reference name because there are two names in column 1.
     in_tsv = pathlib.Path('test/test_mask/pairwise.tsv')
     with pytest.raises(SystemExit) as e:
-        verticall.mask.check_tsv_file(in_tsv, None)
+        verticall.mask.load_regions(in_tsv, None, 'first')
     assert 'could not automatically determine the reference name' in str(e.value)
 
 
-def test_check_tsv_file_3():
+def test_auto_ref_name_3():
     # Succeeds in auto-determining reference name because there is only one name in column 1.
     in_tsv = pathlib.Path('test/test_mask/unambiguous_ref.tsv')
-    ref_name = verticall.mask.check_tsv_file(in_tsv, None)
+    data, ref_name, _, sample_names = verticall.mask.load_regions(in_tsv, None, 'first')
     assert ref_name == 'ref'
+    assert sample_names == ['1', '2', '3', '4']
+    assert as_tuples(data['4']) == ([(0, 10)], [(10, 30)], [])
+
+
+def test_auto_ref_name_4():
+    in_tsv = pathlib.Path('test/test_mask/unambiguous_ref.tsv')
+    data, ref_name, _, sample_names = verticall.mask.load_regions(in_tsv, None, 'exclude')
+    assert ref_name == 'ref'
+    assert sample_names == ['1', '2', '3']
 
 
 def test_load_regions_1():
@@ -153,10 +190,10 @@ def test_load_regions_1():
     assert ref_name == 'ref'
     assert ref_length == 30
     assert sample_names == ['1', '2', '3', '4']
-    assert data['1'] == ([(0, 10), (20, 30)], [(10, 20)], [])
-    assert data['2'] == ([(0, 11), (21, 30)], [(11, 20)], [(20, 21)])
-    assert data['3'] == ([(0, 12), (22, 30)], [(12, 20)], [(20, 22)])
-    assert data['4'] == ([(0, 10)], [(10, 30)], [])
+    assert as_tuples(data['1']) == ([(0, 10), (20, 30)], [(10, 20)], [])
+    assert as_tuples(data['2']) == ([(0, 11), (21, 30)], [(11, 20)], [(20, 21)])
+    assert as_tuples(data['3']) == ([(0, 12), (22, 30)], [(12, 20)], [(20, 22)])
+    assert as_tuples(data['4']) == ([(0, 10)], [(10, 30)], [])
 
 
 def test_load_regions_2():
@@ -165,9 +202,9 @@ def test_load_regions_2():
     assert ref_name == 'ref'
     assert ref_length == 30
     assert sample_names == ['1', '2', '3']
-    assert data['1'] == ([(0, 10), (20, 30)], [(10, 20)], [])
-    assert data['2'] == ([(0, 11), (21, 30)], [(11, 20)], [(20, 21)])
-    assert data['3'] == ([(0, 12), (22, 30)], [(12, 20)], [(20, 22)])
+    assert as_tuples(data['1']) == ([(0, 10), (20, 30)], [(10, 20)], [])
+    assert as_tuples(data['2']) == ([(0, 11), (21, 30)], [(11, 20)], [(20, 21)])
+    assert as_tuples(data['3']) == ([(0, 12), (22, 30)], [(12, 20)], [(20, 22)])
     assert '4' not in data
 
 
@@ -176,10 +213,10 @@ def test_load_regions_3():
     data, ref_name, ref_length, sample_names = verticall.mask.load_regions(in_tsv, 'ref', 'low')
     assert ref_name == 'ref'
     assert ref_length == 30
-    assert data['1'] == ([(0, 10), (20, 30)], [(10, 20)], [])
-    assert data['2'] == ([(0, 11), (21, 30)], [(11, 20)], [(20, 21)])
-    assert data['3'] == ([(0, 12), (22, 30)], [(12, 20)], [(20, 22)])
-    assert data['4'] == ([(10, 20)], [(0, 10), (20, 30)], [])
+    assert as_tuples(data['1']) == ([(0, 10), (20, 30)], [(10, 20)], [])
+    assert as_tuples(data['2']) == ([(0, 11), (21, 30)], [(11, 20)], [(20, 21)])
+    assert as_tuples(data['3']) == ([(0, 12), (22, 30)], [(12, 20)], [(20, 22)])
+    assert as_tuples(data['4']) == ([(10, 20)], [(0, 10), (20, 30)], [])
 
 
 def test_load_regions_4():
@@ -187,10 +224,10 @@ def test_load_regions_4():
     data, ref_name, ref_length, sample_names = verticall.mask.load_regions(in_tsv, 'ref', 'high')
     assert ref_name == 'ref'
     assert ref_length == 30
-    assert data['1'] == ([(0, 10), (20, 30)], [(10, 20)], [])
-    assert data['2'] == ([(0, 11), (21, 30)], [(11, 20)], [(20, 21)])
-    assert data['3'] == ([(0, 12), (22, 30)], [(12, 20)], [(20, 22)])
-    assert data['4'] == ([(20, 30)], [(0, 20)], [])
+    assert as_tuples(data['1']) == ([(0, 10), (20, 30)], [(10, 20)], [])
+    assert as_tuples(data['2']) == ([(0, 11), (21, 30)], [(11, 20)], [(20, 21)])
+    assert as_tuples(data['3']) == ([(0, 12), (22, 30)], [(12, 20)], [(20, 22)])
+    assert as_tuples(data['4']) == ([(20, 30)], [(0, 20)], [])
 
 
 def test_load_regions_5():
@@ -207,6 +244,48 @@ def test_load_regions_6():
     assert 'reference genome has more than one contig name' in str(e.value)
 
 
+def test_load_regions_indexed():
+    # Loading with a TSV index should give the same result, including automatic reference names.
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for tsv_name in ['pairwise.tsv', 'unambiguous_ref.tsv']:
+            in_tsv = pathlib.Path(temp_dir) / tsv_name
+            shutil.copyfile(pathlib.Path('test/test_mask') / tsv_name, in_tsv)
+            ref_name = 'ref' if tsv_name == 'pairwise.tsv' else None
+            for multi in ['first', 'exclude', 'low', 'high']:
+                unindexed = verticall.mask.load_regions(in_tsv, ref_name, multi)
+                verticall.tsv.build_tsv_index(in_tsv)
+                indexed = verticall.mask.load_regions(in_tsv, ref_name, multi)
+                verticall.tsv.get_index_filename(in_tsv).unlink()
+                assert indexed[1:] == unindexed[1:]
+                for name in unindexed[3]:
+                    assert as_tuples(indexed[0][name]) == as_tuples(unindexed[0][name])
+        in_tsv = pathlib.Path(temp_dir) / 'pairwise.tsv'
+        verticall.tsv.build_tsv_index(in_tsv)
+        with pytest.raises(SystemExit) as e:
+            verticall.mask.load_regions(in_tsv, None, 'first')
+        assert 'could not automatically determine the reference name' in str(e.value)
+
+
+def test_load_regions_store():
+    # Loading from a results store should give the same result as loading from the TSV.
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for tsv_name in ['pairwise.tsv', 'unambiguous_ref.tsv']:
+            in_tsv = pathlib.Path(temp_dir) / tsv_name
+            shutil.copyfile(pathlib.Path('test/test_mask') / tsv_name, in_tsv)
+            ref_name = 'ref' if tsv_name == 'pairwise.tsv' else None
+            from_tsv = {m: verticall.mask.load_regions(in_tsv, ref_name, m)
+                        for m in ['first', 'exclude', 'low', 'high']}
+            verticall.tsv.build_results_store(in_tsv)
+            for multi, unstored in from_tsv.items():
+                stored = verticall.mask.load_regions(in_tsv, ref_name, multi)
+                assert stored[1:] == unstored[1:]
+                for name in unstored[3]:
+                    assert as_tuples(stored[0][name]) == as_tuples(unstored[0][name])
+        with pytest.raises(SystemExit) as e:
+            verticall.mask.load_regions(pathlib.Path(temp_dir) / 'pairwise.tsv', None, 'first')
+        assert 'could not automatically determine the reference name' in str(e.value)
+
+
 def test_load_pseudo_alignment_1():
     in_align = pathlib.Path('test/test_mask/alignment.fasta')
     sample_names = ['1', '2', '3', '4']
@@ -314,15 +393,131 @@ def test_mask_sequences_4():
     assert masked_sequences['4'] ==   'NNNNNNNNNNNNNNNNNNNNNNgcaatgagAT'
 
 
+@pytest.mark.parametrize('multi', ['first', 'exclude', 'low', 'high'])
+def test_mask_sequences_threads(multi):
+    in_tsv = pathlib.Path('test/test_mask/pairwise.tsv')
+    in_align = pathlib.Path('test/test_mask/alignment.fasta')
+    data, ref_name, ref_length, sample_names = verticall.mask.load_regions(in_tsv, 'ref', multi)
+    sequences, sample_names = verticall.mask.load_pseudo_alignment(in_align, ref_name, sample_names)
+    with tempfile.TemporaryDirectory() as temp_dir:
+        images = [pathlib.Path(temp_dir) / '1.svg', pathlib.Path(temp_dir) / '2.svg']
+        serial = verticall.mask.mask_sequences(data, sequences, ref_name, ref_length,
+                                               sample_names, 'N', '-', images[0], '#4859a0',
+                                               '#c47e7e', '#c9c9c9', threads=1)
+        parallel = verticall.mask.mask_sequences(data, sequences, ref_name, ref_length,
+                                                 sample_names, 'N', '-', images[1], '#4859a0',
+                                                 '#c47e7e', '#c9c9c9', threads=2)
+        assert images[0].read_text() == images[1].read_text()
+    assert serial == as_strings(parallel)
+    assert list(serial.keys()) == list(parallel.keys())
+    assert all(name not in sequences for name in sample_names)
+
+
+def test_mask_sequences_threads_no_regions():
+    # When no sample has any horizontal or unaligned regions, there's nothing to mask.
+    data = {'1': as_arrays([(0, 8)], [], []), '2': as_arrays([(0, 8)], [], [])}
+    sequences = {'ref': 'ACGTACGT', '1': 'ACGTACGT', '2': 'ACGAACGT'}
+    serial = verticall.mask.mask_sequences(data, sequences, 'ref', 8, ['1', '2'], 'N', '-',
+                                           None, '#4859a0', '#c47e7e', '#c9c9c9', threads=1)
+    parallel = verticall.mask.mask_sequences(data, sequences, 'ref', 8, ['1', '2'], 'N', '-',
+                                             None, '#4859a0', '#c47e7e', '#c9c9c9', threads=2)
+    assert serial == as_strings(parallel)
+    assert as_strings(parallel)['2'] == 'ACGAACGT'
+
+
+def test_save_to_file_arrays():
+    # Masked sequences from the parallel path are uint8 arrays, which are decoded when saved.
+    sequences = {'A': 'ACGT', 'B': np.frombuffer(b'ACNT', dtype=np.uint8),
+                 'C': np.empty(0, dtype=np.uint8)}
+    with tempfile.TemporaryDirectory() as temp_dir:
+        out_file = pathlib.Path(temp_dir) / 'out.fasta'
+        verticall.mask.save_to_file(sequences, out_file)
+        assert out_file.read_text() == '>A\nACGT\n>B\nACNT\n'
+
+
+def test_drop_invariant_positions_arrays():
+    # Sequences can be uint8 arrays (from the parallel path) as well as strings.
+    sequences = {'A': 'ACGT', 'B': np.frombuffer(b'ACNT', dtype=np.uint8)}
+    assert verticall.mask.drop_invariant_positions({**sequences, 'C': 'AAGT'}) == \
+        {'A': 'C', 'B': 'C', 'C': 'A'}
+
+
+def test_load_regions_one_assembly():
+    def get_regions(vertical, horizontal, unaligned):
+        return tuple({} if len(r) == 0 else {'ref': np.array(r, dtype=np.int64)}
+                     for r in (vertical, horizontal, unaligned))
+
+    v, h, u = verticall.mask.load_regions_one_assembly(
+        get_regions([(0, 10), (10, 20), (30, 40)], [(20, 30)], []))
+    assert v.tolist() == [[0, 20], [30, 40]]
+    assert h.tolist() == [[20, 30]]
+    assert u.shape == (0, 2)
+
+    # Overlapping regions (in the same or different classifications) or gaps are not allowed.
+    for bad_regions in [([(0, 20), (10, 30)], [(30, 40)], []),
+                        ([(0, 20)], [(10, 40)], []),
+                        ([(0, 10)], [(20, 30)], []),
+                        ([(5, 10)], [], [])]:
+        with pytest.raises(AssertionError):
+            verticall.mask.load_regions_one_assembly(get_regions(*bad_regions))
+
+
 def test_get_ref_length():
-    data = {'1': ([(0, 1000), (2000, 5000)], [(1000, 2000)], []),
-            '2': ([(0, 5000)], [], []),
-            '3': ([], [], [(0, 5000)])}
+    data = {'1': as_arrays([(0, 1000), (2000, 5000)], [(1000, 2000)], []),
+            '2': as_arrays([(0, 5000)], [], []),
+            '3': as_arrays([], [], [(0, 5000)])}
     assert verticall.mask.get_ref_length(data) == 5000
 
-    data = {'1': ([(0, 1000), (2000, 5000)], [(1000, 2000)], []),
-            '2': ([(0, 6000)], [], []),
-            '3': ([], [], [(0, 5000)])}
+    data = {'1': as_arrays([(0, 1000), (2000, 5000)], [(1000, 2000)], []),
+            '2': as_arrays([(0, 6000)], [], []),
+            '3': as_arrays([], [], [(0, 5000)])}
     with pytest.raises(SystemExit) as e:
         verticall.mask.get_ref_length(data)
     assert 'inconsistent' in str(e.value)
+
+
+def test_get_variant_columns():
+    sequences = ['AGCTACGAcctA', 'aGCaACGACGtA', 'AGCTACGCcCtA', 'NNNnnCG-cCtA']
+    column_bits = verticall.mask.BASE_BITS[0]
+    for seq in sequences:
+        column_bits = column_bits | verticall.mask.BASE_BITS[np.frombuffer(seq.encode(),
+                                                                             dtype=np.uint8)]
+    assert verticall.mask.get_variant_columns(column_bits).tolist() == \
+        [False, False, False, True, False, False, False, True, False, True, False, False]
+    column_bits = verticall.mask.BASE_BITS[np.frombuffer(b'ACGTN-', dtype=np.uint8)]
+    assert column_bits.tolist() == [1, 2, 4, 8, 0, 0]
+    assert not any(verticall.mask.get_variant_columns(column_bits))
+
+
+def get_mask_args(out_alignment, exclude_reference, exclude_invariant, streaming):
+    Args = collections.namedtuple('Args', ['in_tsv', 'in_alignment', 'out_alignment', 'image',
+                                           'vertical_colour', 'horizontal_colour',
+                                           'unaligned_colour', 'reference', 'multi', 'h_char',
+                                           'u_char', 'exclude_invariant', 'exclude_reference',
+                                           'streaming', 'threads'])
+    return Args(in_tsv=pathlib.Path('test/test_mask/pairwise.tsv'),
+                in_alignment=pathlib.Path('test/test_mask/alignment.fasta'),
+                out_alignment=out_alignment, image=None, vertical_colour='#4859a0',
+                horizontal_colour='#c47e7e', unaligned_colour='#c9c9c9', reference='ref',
+                multi='first', h_char='N', u_char='-', exclude_invariant=exclude_invariant,
+                exclude_reference=exclude_reference, streaming=streaming, threads=1)
+
+
+@pytest.mark.parametrize('exclude_reference', [False, True])
+@pytest.mark.parametrize('exclude_invariant', [False, True])
+def test_mask_streaming(exclude_reference, exclude_invariant):
+    with tempfile.TemporaryDirectory() as temp_dir:
+        in_memory_alignment = pathlib.Path(temp_dir) / 'in_memory.fasta'
+        streaming_alignment = pathlib.Path(temp_dir) / 'streaming.fasta'
+        verticall.mask.mask(get_mask_args(in_memory_alignment, exclude_reference,
+                                          exclude_invariant, False))
+        verticall.mask.mask(get_mask_args(streaming_alignment, exclude_reference,
+                                          exclude_invariant, True))
+        with open(in_memory_alignment, 'rt') as f:
+            in_memory_result = f.read()
+        with open(streaming_alignment, 'rt') as f:
+            streaming_result = f.read()
+    assert in_memory_result == streaming_result
+    if not exclude_invariant:
+        assert ('>ref\n' in streaming_result) != exclude_reference
+        assert '>1\nGTAcnnatCTNNNNNNNNNNNNGCAATGAGAT\n' in streaming_result
@@ -14,11 +14,36 @@ details. You should have received a copy of the GNU General Public License along
 If not, see <https://www.gnu.org/licenses/>.
 """
 
+import collections
+import numpy as np
 import pathlib
 import pytest
+import random
+import shutil
 import tempfile
 
 import verticall.matrix
+import verticall.tsv
+
+
+def get_matrix(distances, sample_names):
+    """
+    Builds a DistanceMatrix from a dictionary of distances (missing pairs are left as NaN).
+    """
+    matrix = verticall.matrix.DistanceMatrix(sample_names)
+    for pair, distance in distances.items():
+        matrix[pair] = distance
+    return matrix
+
+
+def get_distance_lists(pairs, sample_names):
+    """
+    Converts the arrays from load_tsv_file into a dictionary of distance lists.
+    """
+    distances = collections.defaultdict(list)
+    for a, b, d in zip(*pairs):
+        distances[(sample_names[a], sample_names[b])].append(float(d))
+    return distances
 
 
 def test_welcome_message(capsys):
@@ -43,7 +68,8 @@ def test_jukes_cantor_correction_1():
     sample_names = ['a', 'b']
     distances = {('a', 'a'): 0.0, ('a', 'b'): 0.2,
                  ('b', 'a'): 0.1, ('b', 'b'): 0.0}
-    verticall.matrix.jukes_cantor_correction(distances, sample_names)
+    distances = get_matrix(distances, sample_names)
+    verticall.matrix.jukes_cantor_correction(distances)
     assert distances[('a', 'a')] == pytest.approx(0.0)
     assert distances[('a', 'b')] == pytest.approx(0.23261619622788)
     assert distances[('b', 'a')] == pytest.approx(0.107325632730505)
@@ -54,7 +80,8 @@ def test_jukes_cantor_correction_2():
     sample_names = ['a', 'b']
     distances = {('a', 'a'): 0.0, ('a', 'b'): 0.2,
                  ('b', 'a'): 0.1}
-    verticall.matrix.jukes_cantor_correction(distances, sample_names)
+    distances = get_matrix(distances, sample_names)
+    verticall.matrix.jukes_cantor_correction(distances)
     assert distances[('a', 'a')] == pytest.approx(0.0)
     assert distances[('a', 'b')] == pytest.approx(0.23261619622788)
     assert distances[('b', 'a')] == pytest.approx(0.107325632730505)
@@ -64,7 +91,8 @@ def test_make_symmetrical_1():
     sample_names = ['a', 'b']
     distances = {('a', 'a'): 0.0, ('a', 'b'): 0.2,
                  ('b', 'a'): 0.1, ('b', 'b'): 0.0}
-    verticall.matrix.make_symmetrical(distances, sample_names)
+    distances = get_matrix(distances, sample_names)
+    verticall.matrix.make_symmetrical(distances)
     assert distances[('a', 'a')] == pytest.approx(0.0)
     assert distances[('a', 'b')] == pytest.approx(0.15)
     assert distances[('b', 'a')] == pytest.approx(0.15)
@@ -75,7 +103,8 @@ def test_make_symmetrical_2():
     sample_names = ['a', 'b']
     distances = {('a', 'a'): 0.0, ('a', 'b'): None,
                  ('b', 'a'): 0.1, ('b', 'b'): 0.0}
-    verticall.matrix.make_symmetrical(distances, sample_names)
+    distances = get_matrix(distances, sample_names)
+    verticall.matrix.make_symmetrical(distances)
     assert distances[('a', 'a')] == pytest.approx(0.0)
     assert distances[('a', 'b')] == pytest.approx(0.1)
     assert distances[('b', 'a')] == pytest.approx(0.1)
@@ -86,7 +115,8 @@ def test_make_symmetrical_3():
     sample_names = ['a', 'b']
     distances = {('a', 'a'): 0.0,  ('a', 'b'): 0.2,
                  ('b', 'a'): None, ('b', 'b'): 0.0}
-    verticall.matrix.make_symmetrical(distances, sample_names)
+    distances = get_matrix(distances, sample_names)
+    verticall.matrix.make_symmetrical(distances)
     assert distances[('a', 'a')] == pytest.approx(0.0)
     assert distances[('a', 'b')] == pytest.approx(0.2)
     assert distances[('b', 'a')] == pytest.approx(0.2)
@@ -97,7 +127,8 @@ def test_make_symmetrical_4():
     sample_names = ['a', 'b']
     distances = {('a', 'a'): 0.0,  ('a', 'b'): None,
                  ('b', 'a'): None, ('b', 'b'): 0.0}
-    verticall.matrix.make_symmetrical(distances, sample_names)
+    distances = get_matrix(distances, sample_names)
+    verticall.matrix.make_symmetrical(distances)
     assert distances[('a', 'a')] == pytest.approx(0.0)
     assert distances[('a', 'b')] is None
     assert distances[('b', 'a')] is None
@@ -108,7 +139,8 @@ def test_make_symmetrical_5():
     sample_names = ['a', 'b']
     distances = {('a', 'a'): 0.0,  ('a', 'b'): 0.2,
                  ('b', 'b'): 0.0}
-    verticall.matrix.make_symmetrical(distances, sample_names)
+    distances = get_matrix(distances, sample_names)
+    verticall.matrix.make_symmetrical(distances)
     assert distances[('a', 'a')] == pytest.approx(0.0)
     assert distances[('a', 'b')] == pytest.approx(0.2)
     assert distances[('b', 'a')] == pytest.approx(0.2)
@@ -120,7 +152,8 @@ def test_check_for_missing_distances():
     distances = {('a', 'a'): 0.0,
                  ('b', 'a'): 0.1, ('b', 'b'): 0.0, ('b', 'c'): 0.2,
                                   ('c', 'b'): 0.1, ('c', 'c'): 0.0}
-    verticall.matrix.check_for_missing_distances(distances, sample_names)
+    distances = get_matrix(distances, sample_names)
+    assert verticall.matrix.check_for_missing_distances(distances)
     assert distances[('a', 'a')] == 0.0
     assert distances[('a', 'b')] is None
     assert distances[('a', 'c')] is None
@@ -132,6 +165,30 @@ def test_check_for_missing_distances():
     assert distances[('c', 'c')] == 0.0
 
 
+def test_distance_matrix():
+    distances = get_matrix({('a', 'a'): 0.0, ('a', 'b'): 0.1, ('b', 'a'): None,
+                            ('b', 'c'): 0.3, ('c', 'a'): 0.2}, ['a', 'b', 'c'])
+    assert len(distances) == 3
+    assert distances[('a', 'b')] == pytest.approx(0.1)
+    assert distances[('b', 'a')] is None
+    assert distances[('c', 'c')] is None
+    assert distances.get_missing().tolist() == [[False, False, True],
+                                                [True, True, False],
+                                                [False, True, True]]
+    subset = distances.subset(['c', 'a'])
+    assert subset.sample_names == ['c', 'a']
+    assert subset[('c', 'a')] == pytest.approx(0.2)
+    assert subset[('a', 'c')] is None
+    assert subset[('a', 'a')] == 0.0
+    assert np.isnan(subset.values[0, 0])
+
+
+def test_check_for_missing_distances_complete():
+    distances = get_matrix({('a', 'a'): 0.0, ('a', 'b'): 0.1,
+                            ('b', 'a'): 0.1, ('b', 'b'): 0.0}, ['a', 'b'])
+    assert not verticall.matrix.check_for_missing_distances(distances)
+
+
 def test_include_names():
     all_names = ['a', 'b', 'c', 'd', 'e', 'f']
     assert verticall.matrix.include_names(all_names, 'b,c') == ['b', 'c']
@@ -156,19 +213,6 @@ def test_exclude_names():
     assert 'could not find sample' in str(e.value)
 
 
-def test_get_distance_from_line_parts():
-    parts = ['a', 'b', '0.0002', '', '0.0001', 'not_a_num']
-    assert verticall.matrix.get_distance_from_line_parts(parts, 2) == pytest.approx(0.0002)
-    assert verticall.matrix.get_distance_from_line_parts(parts, 3) is None
-    assert verticall.matrix.get_distance_from_line_parts(parts, 4) == pytest.approx(0.0001)
-    with pytest.raises(SystemExit) as e:
-        verticall.matrix.get_distance_from_line_parts(parts, 5)
-    assert 'could not convert' in str(e.value)
-    with pytest.raises(SystemExit) as e:
-        verticall.matrix.get_distance_from_line_parts(parts, 6)
-    assert 'column' in str(e.value)
-
-
 def get_truth_mean_distances():
     return {('INF001', 'INF001'): [0.0], ('INF002', 'INF002'): [0.0], ('INF003', 'INF003'): [0.0],
             ('INF004', 'INF004'): [0.0], ('INF005', 'INF005'): [0.0], ('INF013', 'INF013'): [0.0],
@@ -247,7 +291,8 @@ def get_truth_median_vertical_window_distances():
 
 def test_load_tsv_file_1():
     in_tsv = pathlib.Path('test/test_matrix/pairwise.tsv')
-    distances, sample_names = verticall.matrix.load_tsv_file(in_tsv, 'mean')
+    pairs, sample_names = verticall.matrix.load_tsv_file(in_tsv, 'mean')
+    distances = get_distance_lists(pairs, sample_names)
     truth = get_truth_mean_distances()
     for a in sample_names:
         for b in sample_names:
@@ -256,16 +301,33 @@ def test_load_tsv_file_1():
 
 def test_load_tsv_file_2():
     in_tsv = pathlib.Path('test/test_matrix/pairwise.tsv')
-    distances, sample_names = verticall.matrix.load_tsv_file(in_tsv, 'median_vertical_window')
+    pairs, sample_names = verticall.matrix.load_tsv_file(in_tsv, 'median_vertical_window')
+    distances = get_distance_lists(pairs, sample_names)
     truth = get_truth_median_vertical_window_distances()
     for a in sample_names:
         for b in sample_names:
             assert distances[(a, b)] == pytest.approx(truth[(a, b)])
 
 
+def test_load_tsv_file_store():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        in_tsv = pathlib.Path(temp_dir) / 'pairwise.tsv'
+        shutil.copyfile('test/test_matrix/pairwise.tsv', in_tsv)
+        unstored = verticall.matrix.load_distances(in_tsv, ['mean', 'median_vertical_window'])
+        verticall.tsv.build_results_store(in_tsv)
+        stored = verticall.matrix.load_distances(in_tsv, ['mean', 'median_vertical_window'])
+        assert stored[1] == unstored[1]
+        assert np.array_equal(stored[0][0], unstored[0][0])
+        assert np.array_equal(stored[0][1], unstored[0][1])
+        for distance_type in ['mean', 'median_vertical_window']:
+            assert np.array_equal(stored[0][2][distance_type],
+                                  unstored[0][2][distance_type], equal_nan=True)
+
+
 def test_load_tsv_file_3():
     in_tsv = pathlib.Path('test/test_matrix/pairwise.tsv.gz')
-    distances, sample_names = verticall.matrix.load_tsv_file(in_tsv, 'mean')
+    pairs, sample_names = verticall.matrix.load_tsv_file(in_tsv, 'mean')
+    distances = get_distance_lists(pairs, sample_names)
     truth = get_truth_mean_distances()
     for a in sample_names:
         for b in sample_names:
@@ -274,17 +336,34 @@ def test_load_tsv_file_3():
 
 def test_load_tsv_file_4():
     in_tsv = pathlib.Path('test/test_matrix/pairwise.tsv.gz')
-    distances, sample_names = verticall.matrix.load_tsv_file(in_tsv, 'median_vertical_window')
+    pairs, sample_names = verticall.matrix.load_tsv_file(in_tsv, 'median_vertical_window')
+    distances = get_distance_lists(pairs, sample_names)
     truth = get_truth_median_vertical_window_distances()
     for a in sample_names:
         for b in sample_names:
             assert distances[(a, b)] == pytest.approx(truth[(a, b)])
 
 
+def test_load_distances():
+    in_tsv = pathlib.Path('test/test_matrix/pairwise.tsv.gz')
+    pairs, sample_names = verticall.matrix.load_distances(in_tsv, ['mean',
+                                                                   'median_vertical_window'])
+    a_indices, b_indices, distances = pairs
+    assert sorted(distances) == ['mean', 'median_vertical_window']
+    for distance_type, truth in [('mean', get_truth_mean_distances()),
+                                 ('median_vertical_window',
+                                  get_truth_median_vertical_window_distances())]:
+        distance_lists = get_distance_lists((a_indices, b_indices, distances[distance_type]),
+                                            sample_names)
+        for a in sample_names:
+            for b in sample_names:
+                assert distance_lists[(a, b)] == pytest.approx(truth[(a, b)])
+
+
 def test_resolve_multi_distances_1():
     in_tsv = pathlib.Path('test/test_matrix/pairwise.tsv.gz')
-    distances, sample_names = verticall.matrix.load_tsv_file(in_tsv, 'median_vertical_window')
-    distances, sample_names = verticall.matrix.resolve_multi_distances(distances, sample_names,
+    pairs, sample_names = verticall.matrix.load_tsv_file(in_tsv, 'median_vertical_window')
+    distances, sample_names = verticall.matrix.resolve_multi_distances(pairs, sample_names,
                                                                        'first')
     assert sample_names == ['INF001', 'INF002', 'INF003', 'INF004',
                             'INF005', 'INF013', 'INF062', 'INF097']
@@ -297,8 +376,8 @@ def test_resolve_multi_distances_1():
 
 def test_resolve_multi_distances_2():
     in_tsv = pathlib.Path('test/test_matrix/pairwise.tsv.gz')
-    distances, sample_names = verticall.matrix.load_tsv_file(in_tsv, 'median_vertical_window')
-    distances, sample_names = verticall.matrix.resolve_multi_distances(distances, sample_names,
+    pairs, sample_names = verticall.matrix.load_tsv_file(in_tsv, 'median_vertical_window')
+    distances, sample_names = verticall.matrix.resolve_multi_distances(pairs, sample_names,
                                                                        'low')
     assert sample_names == ['INF001', 'INF002', 'INF003', 'INF004',
                             'INF005', 'INF013', 'INF062', 'INF097']
@@ -310,8 +389,8 @@ def test_resolve_multi_distances_2():
 
 def test_resolve_multi_distances_3():
     in_tsv = pathlib.Path('test/test_matrix/pairwise.tsv.gz')
-    distances, sample_names = verticall.matrix.load_tsv_file(in_tsv, 'median_vertical_window')
-    distances, sample_names = verticall.matrix.resolve_multi_distances(distances, sample_names,
+    pairs, sample_names = verticall.matrix.load_tsv_file(in_tsv, 'median_vertical_window')
+    distances, sample_names = verticall.matrix.resolve_multi_distances(pairs, sample_names,
                                                                        'high')
     assert sample_names == ['INF001', 'INF002', 'INF003', 'INF004',
                             'INF005', 'INF013', 'INF062', 'INF097']
@@ -323,8 +402,8 @@ def test_resolve_multi_distances_3():
 
 def test_resolve_multi_distances_4():
     in_tsv = pathlib.Path('test/test_matrix/pairwise.tsv.gz')
-    distances, sample_names = verticall.matrix.load_tsv_file(in_tsv, 'median_vertical_window')
-    distances, sample_names = verticall.matrix.resolve_multi_distances(distances, sample_names,
+    pairs, sample_names = verticall.matrix.load_tsv_file(in_tsv, 'median_vertical_window')
+    distances, sample_names = verticall.matrix.resolve_multi_distances(pairs, sample_names,
                                                                        'exclude')
     assert sample_names == ['INF001', 'INF002', 'INF003', 'INF004', 'INF005', 'INF097']
     truth = get_truth_median_vertical_window_distances()
@@ -335,29 +414,29 @@ def test_resolve_multi_distances_4():
 
 
 def test_resolve_multi_distances_5():
+    # Without the multi-distance pairs, no resolution is needed.
     in_tsv = pathlib.Path('test/test_matrix/pairwise.tsv.gz')
-    distances, sample_names = verticall.matrix.load_tsv_file(in_tsv, 'median_vertical_window')
-    sample_names = ['INF001', 'INF002', 'INF003', 'INF004', 'INF005']
-    del distances[('INF013', 'INF062')]
-    del distances[('INF013', 'INF097')]
-    del distances[('INF062', 'INF013')]
-    del distances[('INF062', 'INF097')]
-    del distances[('INF097', 'INF013')]
-    del distances[('INF097', 'INF062')]
-    distances, sample_names = verticall.matrix.resolve_multi_distances(distances, sample_names,
+    pairs, sample_names = verticall.matrix.load_tsv_file(in_tsv, 'median_vertical_window')
+    multi_names = {sample_names.index(n) for n in ['INF013', 'INF062', 'INF097']}
+    a_indices, b_indices, distances = pairs
+    keep = [a == b or a not in multi_names or b not in multi_names
+            for a, b in zip(a_indices, b_indices)]
+    pairs = a_indices[keep], b_indices[keep], distances[keep]
+    distances, sample_names = verticall.matrix.resolve_multi_distances(pairs, sample_names,
                                                                        'first')
     truth = get_truth_median_vertical_window_distances()
-    for a in sample_names:
-        for b in sample_names:
+    for a in ['INF001', 'INF002', 'INF003', 'INF004', 'INF005']:
+        for b in ['INF001', 'INF002', 'INF003', 'INF004', 'INF005']:
             assert len(truth[(a, b)]) == 1
             assert distances[(a, b)] == pytest.approx(truth[(a, b)][0])
+    assert distances[('INF013', 'INF062')] is None
 
 
 def test_resolve_multi_distances_6():
     in_tsv = pathlib.Path('test/test_matrix/pairwise.tsv.gz')
-    distances, sample_names = verticall.matrix.load_tsv_file(in_tsv, 'median_vertical_window')
+    pairs, sample_names = verticall.matrix.load_tsv_file(in_tsv, 'median_vertical_window')
     with pytest.raises(AssertionError):
-        verticall.matrix.resolve_multi_distances(distances, sample_names, 'not_an_option')
+        verticall.matrix.resolve_multi_distances(pairs, sample_names, 'not_an_option')
 
 
 def test_save_matrix_1():
@@ -367,7 +446,7 @@ def test_save_matrix_1():
                  ('c', 'a'): 0.2, ('c', 'b'): 0.3, ('c', 'c'): 0.0}
     with tempfile.TemporaryDirectory() as temp_dir:
         matrix_filename = pathlib.Path(temp_dir) / 'matrix.phylip'
-        verticall.matrix.save_matrix(matrix_filename, distances, sample_names)
+        verticall.matrix.save_matrix(matrix_filename, get_matrix(distances, sample_names))
         with open(matrix_filename, 'rt') as f:
             matrix = f.read()
             assert matrix == ('3\n'
@@ -383,7 +462,8 @@ def test_save_matrix_2():
                  ('c', 'a'): 0.2, ('c', 'b'): 0.3, ('c', 'c'): 0.0}
     with tempfile.TemporaryDirectory() as temp_dir:
         matrix_filename = pathlib.Path(temp_dir) / 'matrix.phylip'
-        verticall.matrix.save_matrix(matrix_filename, distances, sample_names, silent=True)
+        verticall.matrix.save_matrix(matrix_filename, get_matrix(distances, sample_names),
+                                     silent=True)
         with open(matrix_filename, 'rt') as f:
             matrix = f.read()
             assert matrix == ('3\n'
@@ -399,10 +479,157 @@ def test_save_matrix_3():
                  ('c', 'a'): None, ('c', 'b'): 0.3, ('c', 'c'): 0.0}
     with tempfile.TemporaryDirectory() as temp_dir:
         matrix_filename = pathlib.Path(temp_dir) / 'matrix.phylip'
-        verticall.matrix.save_matrix(matrix_filename, distances, sample_names)
+        verticall.matrix.save_matrix(matrix_filename, get_matrix(distances, sample_names))
         with open(matrix_filename, 'rt') as f:
             matrix = f.read()
             assert matrix == ('3\n'
                               'a\t0.000000000\t0.100000000\t0.200000000\n'
                               'b\t0.100000000\t0.000000000\t\n'
                               'c\t\t0.300000000\t0.000000000\n')
+
+
+def test_save_matrix_4():
+    sample_names = ['a', 'b', 'c']
+    distances = {('a', 'a'): 0.0, ('a', 'b'): 0.1, ('a', 'c'): 0.2,
+                 ('b', 'a'): 0.1, ('b', 'b'): 0.0, ('b', 'c'): 0.3,
+                 ('c', 'a'): 0.2, ('c', 'b'): 0.3, ('c', 'c'): 0.0}
+    with tempfile.TemporaryDirectory() as temp_dir:
+        matrix_filename = pathlib.Path(temp_dir) / 'matrix.phylip'
+        verticall.matrix.save_matrix(matrix_filename, get_matrix(distances, sample_names),
+                                     out_format='lower')
+        with open(matrix_filename, 'rt') as f:
+            matrix = f.read()
+            assert matrix == ('3\n'
+                              'a\n'
+                              'b\t0.100000000\n'
+                              'c\t0.200000000\t0.300000000\n')
+
+
+def test_save_matrix_5():
+    sample_names = ['a', 'b', 'c']
+    distances = {('a', 'a'): 0.0, ('a', 'b'): 0.1, ('a', 'c'): 0.2,
+                 ('b', 'a'): 0.1, ('b', 'b'): 0.0,
+                 ('c', 'a'): None, ('c', 'b'): 0.3, ('c', 'c'): 0.0}
+    with tempfile.TemporaryDirectory() as temp_dir:
+        matrix_filename = pathlib.Path(temp_dir) / 'matrix.npy'
+        verticall.matrix.save_matrix(matrix_filename, get_matrix(distances, sample_names),
+                                     out_format='npy')
+        values = np.load(matrix_filename)
+        assert values.shape == (3, 3)
+        assert values[0].tolist() == [0.0, 0.1, 0.2]
+        assert np.isnan(values[1, 2])
+        assert np.isnan(values[2, 0])
+        names_filename = pathlib.Path(temp_dir) / 'matrix.names.txt'
+        assert names_filename.read_text() == 'a\nb\nc\n'
+
+
+def test_format_matrix_row():
+    assert verticall.matrix.format_matrix_row(np.array([])) == ''
+    assert verticall.matrix.format_matrix_row(np.array([0.0, 0.123456789123])) == \
+        '\t0.000000000\t0.123456789'
+    assert verticall.matrix.format_matrix_row(np.array([np.nan, 0.5, np.nan])) == \
+        '\t\t0.500000000\t'
+
+
+def test_get_corrections():
+    assert verticall.matrix.get_corrections(pathlib.Path('out.phylip'), False) == \
+        ['jukes_cantor']
+    assert verticall.matrix.get_corrections(pathlib.Path('out.phylip'), True) == \
+        ['uncorrected']
+    assert verticall.matrix.get_corrections(pathlib.Path('out_{correction}.phylip'), False) == \
+        ['jukes_cantor', 'uncorrected']
+
+
+def test_get_out_filename():
+    assert verticall.matrix.get_out_filename(pathlib.Path('dir/out.phylip'),
+                                             'mean', 'uncorrected') == \
+        pathlib.Path('dir/out.phylip')
+    assert verticall.matrix.get_out_filename(pathlib.Path('dir/{distance_type}.phylip'),
+                                             'mean', 'uncorrected') == \
+        pathlib.Path('dir/mean.phylip')
+    assert verticall.matrix.get_out_filename(pathlib.Path('{distance_type}_{correction}.phylip'),
+                                             'mean_vertical', 'jukes_cantor') == \
+        pathlib.Path('mean_vertical_jukes_cantor.phylip')
+
+
+def get_matrix_args(in_file, out_file, distance_type, no_jukes_cantor=False,
+                    out_format='square', tree=None):
+    Args = collections.namedtuple('Args', ['in_file', 'out_file', 'distance_type',
+                                           'asymmetrical', 'no_jukes_cantor', 'multi',
+                                           'include_names', 'exclude_names', 'out_format', 'tree',
+                                           'tree_method'])
+    return Args(in_file=in_file, out_file=out_file, distance_type=distance_type,
+                asymmetrical=False, no_jukes_cantor=no_jukes_cantor, multi='first',
+                include_names=None, exclude_names=None, out_format=out_format, tree=tree,
+                tree_method='bionj')
+
+
+def test_matrix_multiple_outputs():
+    # One run with two distance types and both corrections should give the same matrices as
+    # four separate runs.
+    in_tsv = pathlib.Path('test/test_matrix/pairwise.tsv.gz')
+    distance_types = ['mean', 'median_vertical_window']
+    with tempfile.TemporaryDirectory() as temp_dir:
+        temp_dir = pathlib.Path(temp_dir)
+        verticall.matrix.matrix(get_matrix_args(
+            in_tsv, temp_dir / '{distance_type}_{correction}.phylip', distance_types))
+        for distance_type in distance_types:
+            for correction in ['jukes_cantor', 'uncorrected']:
+                single_file = temp_dir / 'single.phylip'
+                verticall.matrix.matrix(get_matrix_args(
+                    in_tsv, single_file, [distance_type],
+                    no_jukes_cantor=(correction == 'uncorrected')))
+                multi_file = temp_dir / f'{distance_type}_{correction}.phylip'
+                assert multi_file.read_text() == single_file.read_text()
+
+
+def test_exclude_multi_distances():
+    sample_names = ['a', 'b', 'c', 'd', 'e']
+    distances = get_matrix({(a, b): 0.1 for a in sample_names for b in sample_names},
+                           sample_names)
+
+    # 'c' is in the most pairs, so it goes first, then 'a' beats 'b' and 'e' on name.
+    multi_distance_pairs = {('a', 'b'), ('c', 'a'), ('c', 'd'), ('e', 'c'), ('b', 'e')}
+    distances, sample_names = \
+        verticall.matrix.exclude_multi_distances(distances, multi_distance_pairs)
+    assert sample_names == ['d', 'e']
+    assert distances.sample_names == ['d', 'e']
+    assert distances[('d', 'e')] == pytest.approx(0.1)
+
+
+def test_exclude_multi_distances_random():
+    # Compare to a simple version of the greedy exclusion.
+    random.seed(0)
+    for _ in range(100):
+        sample_names = [f's{i}' for i in range(random.randint(2, 15))]
+        multi_distance_pairs = {tuple(random.sample(sample_names, 2))
+                                for _ in range(random.randint(1, 20))}
+        counts = collections.defaultdict(int)
+        for a, b in multi_distance_pairs:
+            counts[a] += 1
+            counts[b] += 1
+        expected, remaining = [], set(multi_distance_pairs)
+        for assembly, _ in sorted(counts.items(), key=lambda x: (1.0/x[1], x[0])):
+            expected.append(assembly)
+            remaining = {p for p in remaining if assembly not in p}
+            if not remaining:
+                break
+        distances = verticall.matrix.DistanceMatrix(sample_names)
+        _, remaining_names = \
+            verticall.matrix.exclude_multi_distances(distances, multi_distance_pairs)
+        assert remaining_names == [s for s in sample_names if s not in expected]
+
+
+def test_matrix_tree():
+    in_tsv = pathlib.Path('test/test_matrix/pairwise.tsv.gz')
+    with tempfile.TemporaryDirectory() as temp_dir:
+        temp_dir = pathlib.Path(temp_dir)
+        verticall.matrix.matrix(get_matrix_args(in_tsv, temp_dir / '{distance_type}.phylip',
+                                                ['mean', 'mean_vertical'],
+                                                tree=temp_dir / '{distance_type}.newick'))
+        for distance_type in ['mean', 'mean_vertical']:
+            newick = (temp_dir / f'{distance_type}.newick').read_text()
+            assert newick.startswith('(') and newick.endswith(');\n')
+            for name in ['INF001', 'INF002', 'INF003', 'INF004',
+                         'INF005', 'INF013', 'INF062', 'INF097']:
+                assert newick.count(name) == 1
@@ -192,3 +192,13 @@ def test_list_differences():
     assert in_both == []
     assert in_a_not_b == [1, 2, 3]
     assert in_b_not_a == [4, 5, 6]
+
+
+def test_check_hex_colour():
+    assert verticall.misc.check_hex_colour('#000000')
+    assert verticall.misc.check_hex_colour('#123456')
+    assert verticall.misc.check_hex_colour('#abcdef')
+    assert not verticall.misc.check_hex_colour('123456')
+    assert not verticall.misc.check_hex_colour('1234567')
+    assert not verticall.misc.check_hex_colour('#abc')
+    assert not verticall.misc.check_hex_colour('#12q456')
@@ -17,25 +17,11 @@ If not, see <https://www.gnu.org/licenses/>.
 import verticall.paint
 
 
-def test_get_blocks():
-    paint = [0, 1, 1, 1, 0, 0, 0, 1, 0, 1, 1, 0]
-    assert verticall.paint.get_blocks(paint, 0) == [(0, 1), (4, 7), (8, 9), (11, 12)]
-    assert verticall.paint.get_blocks(paint, 1) == [(1, 4), (7, 8), (9, 11)]
-    assert verticall.paint.get_blocks(paint, 2) == []
-
-    paint = [0, 0, 0, 0, 0, 0, 1, 1, 1, 1, 1, 1]
-    assert verticall.paint.get_blocks(paint, 0) == [(0, 6)]
-    assert verticall.paint.get_blocks(paint, 1) == [(6, 12)]
-
-    paint = [0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0]
-    assert verticall.paint.get_blocks(paint, 0) == [(0, 12)]
-    assert verticall.paint.get_blocks(paint, 1) == []
-
-    paint = []
-    assert verticall.paint.get_blocks(paint, 0) == []
-    assert verticall.paint.get_blocks(paint, 1) == []
-
-    paint = ['A', 'A', 'B', 'C', 'C', 'A']
-    assert verticall.paint.get_blocks(paint, 'A') == [(0, 2), (5, 6)]
-    assert verticall.paint.get_blocks(paint, 'B') == [(2, 3)]
-    assert verticall.paint.get_blocks(paint, 'C') == [(3, 5)]
+def test_painted_contig_blocks():
+    # Vertical paints over horizontal, and both paint over unaligned.
+    contig = verticall.paint.PaintedContig('A' * 30)
+    contig.horizontal_ranges = [(0, 12), (20, 25)]
+    contig.vertical_ranges = [(5, 10), (10, 15), (22, 28)]
+    assert contig.get_vertical_blocks() == [(5, 15), (22, 28)]
+    assert contig.get_horizontal_blocks() == [(0, 5), (20, 22)]
+    assert contig.get_unaligned_blocks() == [(15, 20), (28, 30)]
@@ -15,9 +15,12 @@ If not, see <https://www.gnu.org/licenses/>.
 """
 
 import collections
+import io
 import pathlib
 import pytest
+import tempfile
 
+import verticall.database
 import verticall.pairwise
 
 
@@ -110,6 +113,96 @@ def test_get_arg_list_2():
     assert len(arg_list) == 8
 
 
+def test_get_arg_list_3():
+    # Pairs with existing results are left out: adding two assemblies to six only needs the pairs
+    # involving the new ones, and the parts still add up to the same list.
+    Args = collections.namedtuple('Args', ['part'])
+    old = [('a', 'a.fasta'), ('b', 'b.fasta'), ('c', 'c.fasta'), ('d', 'd.fasta'),
+           ('e', 'e.fasta'), ('f', 'f.fasta')]
+    new = [('g', 'g.fasta'), ('h', 'h.fasta')]
+    existing_pairs = {(a[1], a[2]) for a in
+                      verticall.pairwise.get_arg_list(Args(part='1/1'), old, None)}
+    assert len(existing_pairs) == 30
+    arg_list = verticall.pairwise.get_arg_list(Args(part='1/1'), old + new, None, existing_pairs)
+    assert len(arg_list) == 26
+    assert all(a[1] in {'g', 'h'} or a[2] in {'g', 'h'} for a in arg_list)
+    arg_list_parts = verticall.pairwise.get_arg_list(Args(part='1/2'), old + new, None,
+                                                     existing_pairs) + \
+        verticall.pairwise.get_arg_list(Args(part='2/2'), old + new, None, existing_pairs)
+    assert [a[1:] for a in arg_list_parts] == [a[1:] for a in arg_list]
+
+
+def test_get_arg_list_4():
+    # Parts run one after another on a shared database (each seeing the results of the parts
+    # before it) must still cover every pair between them.
+    Args = collections.namedtuple('Args', ['part'])
+    old = [('a', 'a.fasta'), ('b', 'b.fasta'), ('c', 'c.fasta'), ('d', 'd.fasta'),
+           ('e', 'e.fasta'), ('f', 'f.fasta')]
+    new = [('g', 'g.fasta'), ('h', 'h.fasta')]
+    header = verticall.pairwise.get_table_header()
+    for part_total in [1, 2, 3, 7]:
+        with tempfile.TemporaryDirectory() as temp_dir:
+            db = pathlib.Path(temp_dir) / 'pairwise.db'
+            with verticall.database.ResultsDatabase(db, header) as d:
+                for a in verticall.pairwise.get_arg_list(Args(part='1/1'), old, None):
+                    d.write(f'{a[1]}\t{a[2]}\t' + '\t'.join(['0'] * 9) + '\tprimary\n')
+            assert len(verticall.database.get_database_pairs(db)) == 30
+            for part_num in range(1, part_total + 1):
+                existing_pairs = verticall.database.get_database_pairs(db)
+                arg_list = verticall.pairwise.get_arg_list(Args(part=f'{part_num}/{part_total}'),
+                                                           old + new, None, existing_pairs)
+                with verticall.database.ResultsDatabase(db, header) as d:
+                    for a in arg_list:
+                        d.write(f'{a[1]}\t{a[2]}\t' + '\t'.join(['0'] * 9) + '\tprimary\n')
+            assert len(verticall.database.get_database_pairs(db)) == 56
+
+
+def test_load_existing_pairs():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        tsv = pathlib.Path(temp_dir) / 'pairwise.tsv'
+        with open(tsv, 'wt') as f:
+            f.write(verticall.pairwise.get_table_header())
+            f.write('a\tb\n')
+            f.write('b\ta\n')
+            f.write('a\tb\n')
+        assert verticall.pairwise.load_existing_pairs(tsv, False) == {('a', 'b'), ('b', 'a')}
+        with pytest.raises(SystemExit) as e:
+            verticall.pairwise.load_existing_pairs(tsv, True)
+        assert 'not a results database' in str(e.value)
+        with open(tsv, 'wt') as f:
+            f.write('assembly_a\tassembly_b\n')
+        with pytest.raises(SystemExit) as e:
+            verticall.pairwise.load_existing_pairs(tsv, False)
+        assert 'different columns' in str(e.value)
+
+        db = pathlib.Path(temp_dir) / 'pairwise.db'
+        with verticall.database.ResultsDatabase(db, verticall.pairwise.get_table_header()) as d:
+            d.write('a\tb\t' + '\t'.join(['0'] * 9) + '\tprimary\n')
+        assert verticall.pairwise.load_existing_pairs(db, True) == {('a', 'b')}
+        with pytest.raises(SystemExit) as e:
+            verticall.pairwise.load_existing_pairs(db, False)
+        assert 'not a TSV file' in str(e.value)
+
+
+def test_save_pair_results():
+    Args = collections.namedtuple('Args', ['verbose'])
+    results = [(['a vs b:', '    no alignments found'], [], {'assembly_a': 'a'}),
+               (['b vs a:', '    no alignments found'], ['line_1\n', 'line_2\n'],
+                {'assembly_a': 'b'})]
+    table_file, instrument_file = io.StringIO(), io.StringIO()
+    empty, multi = verticall.pairwise.save_pair_results(results, Args(verbose=False), table_file,
+                                                        instrument_file)
+    assert empty and multi
+    assert table_file.getvalue() == 'line_1\nline_2\n'
+    assert instrument_file.getvalue() == '{"assembly_a":"a"}\n{"assembly_a":"b"}\n'
+
+    table_file = io.StringIO()
+    empty, multi = verticall.pairwise.save_pair_results(results[1:], Args(verbose=False),
+                                                        table_file, None)
+    assert not empty and multi
+    assert table_file.getvalue() == 'line_1\nline_2\n'
+
+
 def test_find_assemblies_1():
     assembly_dir = pathlib.Path('test/test_pairwise/assemblies')
     assemblies = verticall.pairwise.find_assemblies(assembly_dir)
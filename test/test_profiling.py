@@ -0,0 +1,82 @@
+"""
+This module contains some tests for Verticall. To run them, execute `pytest` from the root
+Verticall directory.
+
+Copyright 2022 Ryan Wick (rrwick@gmail.com)
+https://github.com/rrwick/Verticall
+
+This file is part of Verticall. Verticall is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by the Free Software Foundation,
+either version 3 of the License, or (at your option) any later version. Verticall is distributed
+in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+details. You should have received a copy of the GNU General Public License along with Verticall.
+If not, see <https://www.gnu.org/licenses/>.
+"""
+
+
+from multiprocessing import Pool
+import pathlib
+import pstats
+import tempfile
+
+import verticall.profiling
+
+
+def busy_function(n):
+    return sum(i * i for i in range(n))
+
+
+def get_function_names(prof_file):
+    return {name for _, _, name in pstats.Stats(str(prof_file)).stats}
+
+
+def test_profile_run_off():
+    with verticall.profiling.profile_run(None, 10) as worker_dir:
+        assert worker_dir is None
+
+
+def test_profile_run_main_only():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        prof_file = pathlib.Path(temp_dir) / 'out.prof'
+        with verticall.profiling.profile_run(prof_file, 10):
+            busy_function(1000)
+        assert 'busy_function' in get_function_names(prof_file)
+        summary = verticall.profiling.get_summary_filename(prof_file).read_text()
+        assert '0 worker processes' in summary
+        assert 'Top 10 functions by cumulative time' in summary
+        assert 'Top 10 functions by internal time' in summary
+    assert verticall.profiling.main_profiler is None
+
+
+def test_profile_run_workers():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        prof_file = pathlib.Path(temp_dir) / 'out.prof'
+        with verticall.profiling.profile_run(prof_file, 5) as worker_dir:
+            with Pool(processes=2, initializer=verticall.profiling.init_profiled_worker,
+                      initargs=(worker_dir,)) as pool:
+                assert pool.map(busy_function, [1000] * 4) == [busy_function(1000)] * 4
+                pool.close()
+                pool.join()
+        names = get_function_names(prof_file)
+        assert 'busy_function' in names  # only called in the workers
+        assert 'map' in names            # only called in the main process
+        summary = verticall.profiling.get_summary_filename(prof_file).read_text()
+        assert '2 worker processes' in summary
+
+
+def test_profile_run_exception():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        prof_file = pathlib.Path(temp_dir) / 'out.prof'
+        try:
+            with verticall.profiling.profile_run(prof_file, 10):
+                raise ValueError
+        except ValueError:
+            pass
+        assert not prof_file.exists()
+    assert verticall.profiling.main_profiler is None
+
+
+def test_get_summary_filename():
+    assert verticall.profiling.get_summary_filename(pathlib.Path('a/b.prof')) == \
+        pathlib.Path('a/b.prof.txt')
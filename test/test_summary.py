@@ -14,9 +14,16 @@ details. You should have received a copy of the GNU General Public License along
 If not, see <https://www.gnu.org/licenses/>.
 """
 
+import collections
+import numpy as np
 import pathlib
+import pytest
+import random
+import shutil
+import tempfile
 
 import verticall.summary
+import verticall.tsv
 
 
 def test_get_contig_lengths():
@@ -24,3 +31,256 @@ def test_get_contig_lengths():
     contig_lengths, sample_name = verticall.summary.get_contig_lengths(filename)
     assert sample_name == 'test'
     assert contig_lengths == {'A': 20, 'B': 20, 'C': 12}
+
+
+def get_naive_summary(rows, contig_lengths, output_all):
+    """
+    A simple per-base version of summarise_data to check against.
+    """
+    counts = {name: [[0, 0, 0] for _ in range(length)] for name, length in contig_lengths.items()}
+    for row in rows:
+        for i, region_str in enumerate(row):
+            for region in region_str.split(',') if region_str else []:
+                name, start, end = verticall.tsv.split_region_str(region)
+                for j in range(start, end):
+                    counts[name][j][i] += 1
+    summarised_data = []
+    for name, length in contig_lengths.items():
+        c = counts[name]
+        for i in range(length):
+            if i == 0 or i == length-1 or output_all or c[i-1] != c[i] or c[i+1] != c[i]:
+                summarised_data.append((name, i, c[i][0], c[i][1], c[i][2]))
+    return summarised_data
+
+
+def get_random_rows(contig_lengths, row_count):
+    rows = []
+    for _ in range(row_count):
+        row = []
+        for _ in range(3):
+            regions = []
+            for name, length in contig_lengths.items():
+                for _ in range(random.randint(0, 3)):
+                    start = random.randint(0, length - 1)
+                    end = random.randint(start + 1, length)
+                    regions.append(f'{name}:{start}-{end}')
+            row.append(','.join(regions))
+        rows.append(tuple(row))
+    return rows
+
+
+def test_summarise_data_1():
+    contig_lengths = {'A': 10, 'B': 1}
+    coverage = verticall.summary.RegionCoverage(contig_lengths)
+    coverage.add('A:0-5', 'A:5-10', 'B:0-1')
+    coverage.add('A:2-5', '', '')
+    assert verticall.summary.summarise_data(coverage, False) == \
+        [('A', 0, 1, 0, 0), ('A', 1, 1, 0, 0), ('A', 2, 2, 0, 0), ('A', 4, 2, 0, 0),
+         ('A', 5, 0, 1, 0), ('A', 9, 0, 1, 0), ('B', 0, 0, 0, 1)]
+
+
+def test_summarise_data_2():
+    contig_lengths = {'A': 5}
+    coverage = verticall.summary.RegionCoverage(contig_lengths)
+    assert verticall.summary.summarise_data(coverage, False) == \
+        [('A', 0, 0, 0, 0), ('A', 4, 0, 0, 0)]
+    assert verticall.summary.summarise_data(coverage, True) == \
+        [('A', i, 0, 0, 0) for i in range(5)]
+
+
+def test_summarise_data_random():
+    random.seed(0)
+    for _ in range(50):
+        contig_lengths = {f'c_{i}': random.randint(1, 50) for i in range(random.randint(1, 3))}
+        rows = get_random_rows(contig_lengths, random.randint(0, 10))
+        coverage = verticall.summary.RegionCoverage(contig_lengths)
+        for row in rows:
+            coverage.add(*row)
+        for output_all in [False, True]:
+            assert verticall.summary.summarise_data(coverage, output_all) == \
+                get_naive_summary(rows, contig_lengths, output_all)
+
+
+def test_region_coverage_compact():
+    random.seed(1)
+    contig_lengths = {'A': 100, 'B': 30}
+    rows = get_random_rows(contig_lengths, 20)
+    coverage = verticall.summary.RegionCoverage(contig_lengths)
+    for i, row in enumerate(rows):
+        coverage.add(*row)
+        if i % 3 == 0:
+            coverage.compact()
+    assert verticall.summary.summarise_data(coverage, False) == \
+        get_naive_summary(rows, contig_lengths, False)
+
+
+def test_region_coverage_bad_contig():
+    coverage = verticall.summary.RegionCoverage({'A': 10})
+    with pytest.raises(SystemExit) as e:
+        coverage.add('B:0-5', '', '')
+    assert 'not found' in str(e.value)
+
+
+def test_load_data():
+    in_tsv = pathlib.Path('test/test_mask/pairwise.tsv')
+    contig_lengths = {'1': 30}
+    coverage = verticall.summary.RegionCoverage(contig_lengths)
+    verticall.summary.load_data(in_tsv, {'ref': coverage})
+    rows = [line.rstrip('\n').split('\t')[4:] for line in open(in_tsv)
+            if line.startswith('ref\t')]
+    assert len(rows) == 6
+    assert verticall.summary.summarise_data(coverage, False) == \
+        get_naive_summary(rows, contig_lengths, False)
+
+
+def get_summary_args(in_file, assembly=None, assembly_dir=None, out_dir=None,
+                     summary_format='table'):
+    Args = collections.namedtuple('Args', ['in_file', 'assembly', 'assembly_dir', 'out_dir',
+                                           'all', 'plot', 'format', 'bin_size'])
+    return Args(in_file=in_file, assembly=assembly, assembly_dir=assembly_dir, out_dir=out_dir,
+                all=False, plot=False, format=summary_format, bin_size=7)
+
+
+def test_summary_batch(capsys):
+    in_tsv = pathlib.Path('test/test_mask/pairwise.tsv')
+    with tempfile.TemporaryDirectory() as temp_dir:
+        temp_dir = pathlib.Path(temp_dir)
+        assembly_dir = temp_dir / 'assemblies'
+        assembly_dir.mkdir()
+        for sample_name in ['ref', 'not_ref', 'other']:
+            with open(assembly_dir / f'{sample_name}.fasta', 'wt') as f:
+                f.write('>1\n' + 'A' * 30 + '\n')
+        out_dir = temp_dir / 'out'
+        verticall.summary.summary(get_summary_args(in_tsv, assembly_dir=assembly_dir,
+                                                   out_dir=out_dir))
+        assert sorted(p.name for p in out_dir.iterdir()) == ['not_ref.tsv', 'other.tsv',
+                                                             'ref.tsv']
+        for sample_name in ['ref', 'not_ref', 'other']:
+            capsys.readouterr()
+            verticall.summary.summary(get_summary_args(
+                in_tsv, assembly=assembly_dir / f'{sample_name}.fasta'))
+            single_output = capsys.readouterr().out
+            assert (out_dir / f'{sample_name}.tsv').read_text() == single_output
+        assert (out_dir / 'other.tsv').read_text() == \
+            'contig position vertical horizontal unaligned\n1\t0\t0\t0\t0\n1\t29\t0\t0\t0\n'
+
+
+def get_naive_depths(rows, contig_lengths):
+    depths = {name: np.zeros((3, length), dtype=int) for name, length in contig_lengths.items()}
+    for row in rows:
+        for i, region_str in enumerate(row):
+            for region in region_str.split(',') if region_str else []:
+                name, start, end = verticall.tsv.split_region_str(region)
+                depths[name][i, start:end] += 1
+    return depths
+
+
+def test_bedgraph_data():
+    contig_lengths = {'A': 10, 'B': 1}
+    coverage = verticall.summary.RegionCoverage(contig_lengths)
+    coverage.add('A:0-5', 'A:5-10', 'B:0-1')
+    coverage.add('A:2-5', '', '')
+    assert verticall.summary.bedgraph_data(coverage) == \
+        [('A', 0, 2, 1, 0, 0), ('A', 2, 5, 2, 0, 0), ('A', 5, 10, 0, 1, 0), ('B', 0, 1, 0, 0, 1)]
+
+
+def test_bin_data_1():
+    contig_lengths = {'A': 10}
+    coverage = verticall.summary.RegionCoverage(contig_lengths)
+    coverage.add('A:0-5', 'A:5-10', '')
+    coverage.add('A:2-5', '', '')
+    bins = verticall.summary.bin_data(coverage, 4)
+    assert [b[:3] for b in bins] == [('A', 0, 4), ('A', 4, 8), ('A', 8, 10)]
+    assert bins[0][3:] == pytest.approx((1.5, 0.0, 0.0))
+    assert bins[1][3:] == pytest.approx((0.5, 0.75, 0.0))
+    assert bins[2][3:] == pytest.approx((0.0, 1.0, 0.0))
+
+
+def test_bin_data_random():
+    random.seed(2)
+    for _ in range(50):
+        contig_lengths = {f'c_{i}': random.randint(1, 50) for i in range(random.randint(1, 3))}
+        rows = get_random_rows(contig_lengths, random.randint(0, 10))
+        coverage = verticall.summary.RegionCoverage(contig_lengths)
+        for row in rows:
+            coverage.add(*row)
+        depths = get_naive_depths(rows, contig_lengths)
+        bin_size = random.randint(1, 20)
+        for name, start, end, vertical, horizontal, unaligned in \
+                verticall.summary.bin_data(coverage, bin_size):
+            means = depths[name][:, start:end].mean(axis=1)
+            assert (vertical, horizontal, unaligned) == pytest.approx(tuple(means))
+        for name, start, end, vertical, horizontal, unaligned in \
+                verticall.summary.bedgraph_data(coverage):
+            assert (depths[name][:, start:end] == [[vertical], [horizontal], [unaligned]]).all()
+
+
+def test_summary_formats(capsys):
+    in_tsv = pathlib.Path('test/test_mask/pairwise.tsv')
+    with tempfile.TemporaryDirectory() as temp_dir:
+        assembly = pathlib.Path(temp_dir) / 'ref.fasta'
+        with open(assembly, 'wt') as f:
+            f.write('>1\n' + 'A' * 30 + '\n')
+        capsys.readouterr()
+        verticall.summary.summary(get_summary_args(in_tsv, assembly=assembly,
+                                                   summary_format='bedgraph'))
+        lines = capsys.readouterr().out.splitlines()
+        assert lines[0] == '1\t0\t10\t4\t2\t0'
+        assert lines[-1].startswith('1\t')
+        assert lines[-1].split('\t')[2] == '30'
+        verticall.summary.summary(get_summary_args(in_tsv, assembly=assembly,
+                                                   summary_format='bins'))
+        lines = capsys.readouterr().out.splitlines()
+        assert lines[0] == 'contig\tstart\tend\tvertical\thorizontal\tunaligned'
+        assert lines[1] == '1\t0\t7\t4.000\t2.000\t0.000'
+        assert len(lines) == 6
+
+
+def test_load_data_indexed():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        in_tsv = pathlib.Path(temp_dir) / 'pairwise.tsv'
+        shutil.copyfile('test/test_mask/pairwise.tsv', in_tsv)
+        verticall.tsv.build_tsv_index(in_tsv)
+        for sample_name in ['ref', 'not_ref']:
+            contig_lengths = {'1': 30}
+            coverage = verticall.summary.RegionCoverage(contig_lengths)
+            verticall.summary.load_data(in_tsv, {sample_name: coverage})
+            rows = [line.rstrip('\n').split('\t')[4:] for line in open(in_tsv)
+                    if line.startswith(sample_name + '\t')]
+            assert verticall.summary.summarise_data(coverage, False) == \
+                get_naive_summary(rows, contig_lengths, False)
+
+
+def test_load_data_store():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        in_tsv = pathlib.Path(temp_dir) / 'pairwise.tsv'
+        shutil.copyfile('test/test_mask/pairwise.tsv', in_tsv)
+        verticall.tsv.build_results_store(in_tsv)
+        for sample_name in ['ref', 'not_ref']:
+            contig_lengths = {'1': 30}
+            coverage = verticall.summary.RegionCoverage(contig_lengths)
+            verticall.summary.load_data(in_tsv, {sample_name: coverage})
+            rows = [line.rstrip('\n').split('\t')[4:] for line in open(in_tsv)
+                    if line.startswith(sample_name + '\t')]
+            assert verticall.summary.summarise_data(coverage, False) == \
+                get_naive_summary(rows, contig_lengths, False)
+
+
+def test_add_region_arrays():
+    # Adding regions in bulk should give the same depths as adding them one row at a time.
+    random.seed(0)
+    contig_lengths = {'A': 100, 'B': 50}
+    rows = get_random_rows(contig_lengths, 50)
+    one_at_a_time = verticall.summary.RegionCoverage(contig_lengths)
+    for row in rows:
+        one_at_a_time.add(*row)
+    lines = ['a\tb\t' + '\t'.join(row) + '\n' for row in rows]
+    header_parts = ['assembly_a', 'assembly_b'] + verticall.tsv.A_REGION_COLUMNS
+    results = verticall.tsv.parse_results_lines(lines, header_parts, [], True, 'test')
+    in_bulk = verticall.summary.RegionCoverage(contig_lengths)
+    in_bulk.add_region_arrays(results.regions)
+    assert verticall.summary.summarise_data(in_bulk, True) == \
+        verticall.summary.summarise_data(one_at_a_time, True)
+    with pytest.raises(SystemExit) as e:
+        verticall.summary.RegionCoverage({'A': 100}).add_region_arrays(results.regions)
+    assert 'not found' in str(e.value)
@@ -0,0 +1,159 @@
+"""
+This module contains some tests for Verticall. To run them, execute `pytest` from the root
+Verticall directory.
+
+Copyright 2022 Ryan Wick (rrwick@gmail.com)
+https://github.com/rrwick/Verticall
+
+This file is part of Verticall. Verticall is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by the Free Software Foundation,
+either version 3 of the License, or (at your option) any later version. Verticall is distributed
+in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+details. You should have received a copy of the GNU General Public License along with Verticall.
+If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import itertools
+import numpy as np
+import pytest
+import re
+
+import verticall.tree
+
+
+def get_tip_distances(newick):
+    """
+    Parses a Newick string (with branch lengths) and returns the path length between each pair of
+    tips.
+    """
+    tokens = re.findall(r'[(),;]|[^(),;:]*:[-\d.e]+', newick.strip())
+    edges, stack, tips, next_node, last_node = {}, [], {}, 0, None
+    for token in tokens:
+        if token == '(':
+            stack.append(next_node)
+            next_node += 1
+        elif token == ')':
+            last_node = stack.pop()
+        elif token in ',;':
+            continue
+        elif token.startswith(':'):
+            edges[last_node] = (stack[-1], float(token[1:]))
+        else:
+            name, length = token.split(':')
+            tips[name] = next_node
+            edges[next_node] = (stack[-1], float(length))
+            next_node += 1
+
+    def get_path(node):
+        path = {node: 0.0}
+        total = 0.0
+        while node in edges:
+            node, length = edges[node]
+            total += length
+            path[node] = total
+        return path
+
+    distances = {}
+    for a, b in itertools.combinations(tips, 2):
+        path_a, path_b = get_path(tips[a]), get_path(tips[b])
+        distances[(a, b)] = min(path_a[n] + path_b[n] for n in path_a if n in path_b)
+    return distances
+
+
+def get_additive_matrix():
+    # The example from the Wikipedia page on neighbour joining, where the tree is exactly additive.
+    names = ['a', 'b', 'c', 'd', 'e']
+    distances = np.array([[0.0, 5.0, 9.0, 9.0, 8.0],
+                          [5.0, 0.0, 10.0, 10.0, 9.0],
+                          [9.0, 10.0, 0.0, 8.0, 7.0],
+                          [9.0, 10.0, 8.0, 0.0, 3.0],
+                          [8.0, 9.0, 7.0, 3.0, 0.0]])
+    return names, distances
+
+
+@pytest.mark.parametrize('method', ['nj', 'bionj'])
+def test_build_tree_additive(method):
+    names, distances = get_additive_matrix()
+    newick = verticall.tree.build_tree(names, distances, method)
+    assert newick.endswith(';')
+    assert '(a:2.000000000,b:3.000000000)' in newick
+    tip_distances = get_tip_distances(newick)
+    for (a, b), d in tip_distances.items():
+        assert d == pytest.approx(distances[names.index(a), names.index(b)])
+
+
+@pytest.mark.parametrize('method', ['nj', 'bionj'])
+def test_build_tree_random_additive(method):
+    # Distances taken from a random tree are additive, so both methods should recover them.
+    rng = np.random.default_rng(0)
+    for tip_count in [4, 5, 10, 20]:
+        names = [f's{i}' for i in range(tip_count)]
+        newick = names[0]
+        for name in names[1:]:
+            newick = f'({newick}:{rng.uniform(0.1, 1.0)},{name}:{rng.uniform(0.1, 1.0)})'
+        tree_distances = get_tip_distances(newick + ';')
+        distances = np.zeros((tip_count, tip_count))
+        for (a, b), d in tree_distances.items():
+            distances[names.index(a), names.index(b)] = d
+            distances[names.index(b), names.index(a)] = d
+        result = get_tip_distances(verticall.tree.build_tree(names, distances, method))
+        for (a, b), d in result.items():
+            assert d == pytest.approx(distances[names.index(a), names.index(b)], abs=1e-6)
+
+
+def test_build_tree_small():
+    assert verticall.tree.build_tree(['a'], np.zeros((1, 1))) == 'a;'
+    assert verticall.tree.build_tree(['a', 'b'], np.array([[0.0, 0.2], [0.2, 0.0]])) == \
+        '(a:0.100000000,b:0.100000000);'
+    distances = np.array([[0.0, 0.3, 0.4], [0.3, 0.0, 0.5], [0.4, 0.5, 0.0]])
+    assert verticall.tree.build_tree(['a', 'b', 'c'], distances) == \
+        '(a:0.100000000,b:0.200000000,c:0.300000000);'
+
+
+def test_get_newick_label():
+    assert verticall.tree.get_newick_label('sample_1') == 'sample_1'
+    assert verticall.tree.get_newick_label('sample 1') == "'sample 1'"
+    assert verticall.tree.get_newick_label('a(1)') == "'a(1)'"
+    assert verticall.tree.get_newick_label('a,b:c;') == "'a,b:c;'"
+    assert verticall.tree.get_newick_label("Sanger's") == "'Sanger''s'"
+    assert verticall.tree.get_newick_label('a\tb') == "'a\tb'"
+
+
+@pytest.mark.parametrize('method', ['nj', 'bionj'])
+def test_build_tree_special_names(method):
+    # Names which need quoting still give a tree with the right tips and distances.
+    assert verticall.tree.build_tree(['a b', "c'd"], np.array([[0.0, 0.2], [0.2, 0.0]])) == \
+        "('a b':0.100000000,'c''d':0.100000000);"
+    _, distances = get_additive_matrix()
+    names = ['a b', 'c(1)', 'd,e', 'f:g;', "Sanger's"]
+    newick = verticall.tree.build_tree(names, distances, method)
+    plain_names = ['a', 'b', 'c', 'd', 'e']
+    for name, plain_name in zip(names, plain_names):
+        label = verticall.tree.get_newick_label(name)
+        assert newick.count(label) == 1
+        newick = newick.replace(label, plain_name)
+    for (a, b), d in get_tip_distances(newick).items():
+        assert d == pytest.approx(distances[plain_names.index(a), plain_names.index(b)])
+
+
+def test_build_tree_asymmetrical():
+    # Asymmetrical matrices are averaged before building the tree.
+    distances = np.array([[0.0, 0.2, 0.4], [0.4, 0.0, 0.5], [0.4, 0.5, 0.0]])
+    assert verticall.tree.build_tree(['a', 'b', 'c'], distances) == \
+        '(a:0.100000000,b:0.200000000,c:0.300000000);'
+
+
+def test_build_tree_missing():
+    distances = np.array([[0.0, np.nan], [0.2, 0.0]])
+    with pytest.raises(SystemExit) as e:
+        verticall.tree.build_tree(['a', 'b'], distances)
+    assert 'missing distances' in str(e.value)
+
+
+def test_get_closest_pair():
+    names, distances = get_additive_matrix()
+    i, j, branch_i, branch_j = verticall.tree.get_closest_pair(distances)
+    assert (i, j) == (0, 1)
+    assert branch_i == pytest.approx(2.0)
+    assert branch_j == pytest.approx(3.0)
@@ -14,7 +14,11 @@ details. You should have received a copy of the GNU General Public License along
 If not, see <https://www.gnu.org/licenses/>.
 """
 
+import numpy as np
+import pathlib
 import pytest
+import shutil
+import tempfile
 
 import verticall.tsv
 
@@ -87,3 +91,263 @@ def test_check_header_for_assembly_a_regions():
     with pytest.raises(SystemExit) as e:
         verticall.tsv.check_header_for_assembly_a_regions(header_parts, 'filename')
     assert 'no column named' in str(e.value)
+
+
+def test_parse_regions_1():
+    regions = verticall.tsv.parse_regions('contig_1:0-10,contig_1:20-30,contig_2:0-50')
+    assert list(regions) == ['contig_1', 'contig_2']
+    assert regions['contig_1'].tolist() == [[0, 10], [20, 30]]
+    assert regions['contig_2'].tolist() == [[0, 50]]
+
+
+def test_parse_regions_2():
+    assert verticall.tsv.parse_regions('') == {}
+    regions = verticall.tsv.parse_regions('1:0-10,11:3-5,1:20-21')
+    assert list(regions) == ['1', '11']
+    assert regions['1'].tolist() == [[0, 10], [20, 21]]
+    assert regions['11'].tolist() == [[3, 5]]
+    regions = verticall.tsv.parse_regions('NODE-1:0-10,NODE-2:5-6')  # names can have dashes
+    assert regions['NODE-1'].tolist() == [[0, 10]]
+    assert regions['NODE-2'].tolist() == [[5, 6]]
+
+
+def test_parse_regions_3():
+    for bad_region_str in ['contig_1:abc-def', 'contig_1:0-10,', ',contig_1:0-10',
+                           'contig_1:0-10;contig_2:0-10', 'contig_1', '1:0,1:1-2-3',
+                           'a:b:0-10', ':0-10', 'contig_1:0-', 'contig_1:0-10,,contig_1:20-30']:
+        with pytest.raises(SystemExit) as e:
+            verticall.tsv.parse_regions(bad_region_str)
+        assert 'not correctly formatted' in str(e.value)
+
+
+def test_split_leading_columns():
+    line = 'a\tb\t0.1\t0.2\tc_1:0-100,c_1:200-300\n'
+    assert verticall.tsv.split_leading_columns(line, 2) == ['a', 'b']
+    assert verticall.tsv.split_leading_columns(line, 3) == ['a', 'b', '0.1']
+    assert verticall.tsv.split_leading_columns(line, 4) == ['a', 'b', '0.1', '0.2']
+    assert verticall.tsv.split_leading_columns(line, 5) == ['a', 'b', '0.1', '0.2',
+                                                            'c_1:0-100,c_1:200-300']
+    assert verticall.tsv.split_leading_columns(line, 9) == ['a', 'b', '0.1', '0.2',
+                                                            'c_1:0-100,c_1:200-300']
+
+
+def test_tsv_index_1():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        tsv = pathlib.Path(temp_dir) / 'pairwise.tsv'
+        shutil.copyfile('test/test_mask/pairwise.tsv', tsv)
+        assert verticall.tsv.load_tsv_index(tsv) is None
+        verticall.tsv.build_tsv_index(tsv)
+        assert verticall.tsv.get_index_filename(tsv).is_file()
+        index = verticall.tsv.load_tsv_index(tsv)
+        assert sorted(index) == ['not_ref', 'ref']
+        assert [(b, level) for b, level, _, _ in index['ref']] == \
+            [('1', 'primary'), ('2', 'primary'), ('3', 'primary'),
+             ('4', 'primary'), ('4', 'secondary'), ('4', 'secondary')]
+        with open(tsv, 'rb') as f:
+            data = f.read()
+        for rows in index.values():
+            for b, _, offset, length in rows:
+                line = data[offset:offset+length].decode()
+                assert line.endswith('\n')
+                assert line.split('\t')[1] == b
+        assert verticall.tsv.get_indexed_assembly_a_names(tsv) == ['not_ref', 'ref']
+
+
+def test_tsv_index_2():
+    # Lines from the index should match those from a full scan.
+    with tempfile.TemporaryDirectory() as temp_dir:
+        tsv = pathlib.Path(temp_dir) / 'pairwise.tsv'
+        shutil.copyfile('test/test_mask/pairwise.tsv', tsv)
+        scanned = list(verticall.tsv.iterate_tsv_lines(tsv, {'ref'}))
+        verticall.tsv.build_tsv_index(tsv)
+        assert list(verticall.tsv.iterate_tsv_lines(tsv, {'ref'})) == scanned
+        assert len(scanned) == 7
+        assert all(line.startswith('ref\t') for line in scanned[1:])
+        assert list(verticall.tsv.iterate_tsv_lines(tsv, {'not_ref', 'ref'})) == \
+            list(verticall.tsv.iterate_tsv_lines(tsv))
+        assert len(list(verticall.tsv.iterate_tsv_lines(tsv, {'missing'}))) == 1
+
+
+def test_tsv_index_3():
+    # Changing the TSV makes the index out of date.
+    with tempfile.TemporaryDirectory() as temp_dir:
+        tsv = pathlib.Path(temp_dir) / 'pairwise.tsv'
+        shutil.copyfile('test/test_mask/pairwise.tsv', tsv)
+        verticall.tsv.build_tsv_index(tsv)
+        with open(tsv, 'at') as f:
+            f.write('ref\t5\tprimary\t0.05\t1:0-30\t\t\n')
+        assert verticall.tsv.load_tsv_index(tsv) is None
+        assert len(list(verticall.tsv.iterate_tsv_lines(tsv, {'ref'}))) == 8
+
+
+def test_tsv_index_4():
+    # A headerless TSV (e.g. a later --part) can be indexed if the header is given.
+    with tempfile.TemporaryDirectory() as temp_dir:
+        tsv = pathlib.Path(temp_dir) / 'pairwise.tsv'
+        with open('test/test_mask/pairwise.tsv', 'rt') as f:
+            header = f.readline()
+            body = f.read()
+        with open(tsv, 'wt') as f:
+            f.write(body)
+        with pytest.raises(SystemExit):
+            verticall.tsv.build_tsv_index(tsv)
+        verticall.tsv.build_tsv_index(tsv, header)
+        index = verticall.tsv.load_tsv_index(tsv)
+        assert index['ref'][0][2] == 0
+        with pytest.raises(SystemExit) as e:
+            verticall.tsv.build_tsv_index(pathlib.Path('test/test_matrix/pairwise.tsv.gz'))
+        assert 'compressed' in str(e.value)
+
+
+def test_tsv_index_5():
+    # An index which was current before rows were appended is updated with only the new rows.
+    with tempfile.TemporaryDirectory() as temp_dir:
+        tsv = pathlib.Path(temp_dir) / 'pairwise.tsv'
+        shutil.copyfile('test/test_mask/pairwise.tsv', tsv)
+        verticall.tsv.build_tsv_index(tsv)
+        assert verticall.tsv.is_tsv_index_current(tsv)
+        old_size = tsv.stat().st_size
+
+        # Mark an existing entry, so we can tell whether it was rescanned.
+        index_filename = verticall.tsv.get_index_filename(tsv)
+        index_text = index_filename.read_text()
+        index_filename.write_text(index_text.replace('\tprimary\t', '\tmarked\t', 1))
+
+        new_lines = ['ref\t5\tprimary\t0.05\t1:0-30\t\t\n', 'new\t1\tprimary\t0.05\t1:0-30\t\t\n']
+        with open(tsv, 'at') as f:
+            f.writelines(new_lines)
+        assert not verticall.tsv.is_tsv_index_current(tsv)
+        verticall.tsv.build_tsv_index(tsv, old_size=old_size)
+        assert verticall.tsv.is_tsv_index_current(tsv)
+        index = verticall.tsv.load_tsv_index(tsv)
+        assert index['ref'][0][1] == 'marked'
+        assert [b for b, _, _, _ in index['ref']] == ['1', '2', '3', '4', '4', '4', '5']
+        assert index['new'] == [('1', 'primary', old_size + len(new_lines[0]),
+                                 len(new_lines[1]))]
+        assert len(list(verticall.tsv.iterate_tsv_lines(tsv, {'ref'}))) == 8
+
+        # If the index doesn't match the old size, it is rebuilt from scratch.
+        verticall.tsv.build_tsv_index(tsv, old_size=old_size + 1)
+        assert verticall.tsv.load_tsv_index(tsv)['ref'][0][1] == 'primary'
+
+
+def test_get_value_from_line_parts():
+    parts = ['a', 'b', '0.0002', '', '0.0001', 'not_a_num', '12.5%', 'undef']
+    assert verticall.tsv.get_value_from_line_parts(parts, 2) == pytest.approx(0.0002)
+    assert verticall.tsv.get_value_from_line_parts(parts, 3) is None
+    assert verticall.tsv.get_value_from_line_parts(parts, 4) == pytest.approx(0.0001)
+    assert verticall.tsv.get_value_from_line_parts(parts, 6) == pytest.approx(12.5)
+    assert verticall.tsv.get_value_from_line_parts(parts, 7) is None
+    with pytest.raises(SystemExit) as e:
+        verticall.tsv.get_value_from_line_parts(parts, 5)
+    assert 'could not convert' in str(e.value)
+    with pytest.raises(SystemExit) as e:
+        verticall.tsv.get_value_from_line_parts(parts, 8)
+    assert 'column' in str(e.value)
+
+
+def get_all_results(tsv, columns, assembly_a_names=None):
+    rows = []
+    for results in verticall.tsv.iterate_results(tsv, columns, assembly_a_names, regions=True):
+        for i in range(len(results)):
+            regions = tuple({name: r.tolist() for name, r in sorted(by_contig.items())}
+                            for by_contig in results.get_regions(i))
+            values = [None if np.isnan(v) else v for v in results.values[i].tolist()]
+            rows.append((results.get_names(i), values, regions))
+    return rows
+
+
+def test_iterate_results():
+    tsv = pathlib.Path('test/test_mask/pairwise.tsv')
+    rows = get_all_results(tsv, ['mean_vertical_distance'])
+    assert len(rows) == 7
+    assert rows[0] == (('ref', '1'), [0.01],
+                       ({'1': [[0, 10], [20, 30]]}, {'1': [[10, 20]]}, {}))
+    assert [names for names, _, _ in get_all_results(tsv, [], {'not_ref'})] == [('not_ref', '5')]
+
+
+def test_results_store_1():
+    # Results from the store should match those from the TSV.
+    with tempfile.TemporaryDirectory() as temp_dir:
+        tsv = pathlib.Path(temp_dir) / 'pairwise.tsv'
+        shutil.copyfile('test/test_mask/pairwise.tsv', tsv)
+        from_tsv = get_all_results(tsv, ['mean_vertical_distance'])
+        assert not verticall.tsv.is_results_store_current(tsv)
+        verticall.tsv.build_results_store(tsv)
+        assert verticall.tsv.is_results_store_current(tsv)
+        assert get_all_results(tsv, ['mean_vertical_distance']) == from_tsv
+        assert get_all_results(tsv, [], {'ref'}) == \
+            [(names, [], regions) for names, _, regions in from_tsv if names[0] == 'ref']
+        with pytest.raises(SystemExit) as e:
+            get_all_results(tsv, ['not_a_column'])
+        assert 'no column named' in str(e.value)
+
+
+def test_results_store_2():
+    # Appending to the TSV makes the store out of date, and updating it adds a new chunk.
+    with tempfile.TemporaryDirectory() as temp_dir:
+        tsv = pathlib.Path(temp_dir) / 'pairwise.tsv'
+        shutil.copyfile('test/test_mask/pairwise.tsv', tsv)
+        verticall.tsv.build_results_store(tsv)
+        with open(tsv, 'at') as f:
+            f.write('ref\t5\tprimary\t0.05\t1:0-30\t\t\n')
+        assert not verticall.tsv.is_results_store_current(tsv)
+        from_tsv = get_all_results(tsv, ['mean_vertical_distance'])
+        assert len(from_tsv) == 8
+        verticall.tsv.build_results_store(tsv)
+        assert verticall.tsv.is_results_store_current(tsv)
+        store_dir = verticall.tsv.get_results_store_dirname(tsv)
+        assert len(verticall.tsv.load_results_store_manifest(store_dir)) == 2
+        assert get_all_results(tsv, ['mean_vertical_distance']) == from_tsv
+
+
+def test_results_store_3():
+    # Rewriting the TSV makes the store rebuild from scratch.
+    with tempfile.TemporaryDirectory() as temp_dir:
+        tsv = pathlib.Path(temp_dir) / 'pairwise.tsv'
+        with open('test/test_mask/pairwise.tsv', 'rt') as f:
+            header = f.readline()
+            body = f.readlines()
+        with open(tsv, 'wt') as f:
+            f.write(header + ''.join(body))
+        verticall.tsv.build_results_store(tsv)
+        with open(tsv, 'wt') as f:
+            f.write(header + ''.join(body[::-1]) + body[0])
+        verticall.tsv.build_results_store(tsv)
+        store_dir = verticall.tsv.get_results_store_dirname(tsv)
+        assert len(verticall.tsv.load_results_store_manifest(store_dir)) == 1
+        assert [n for n, _, _ in get_all_results(tsv, [])][0] == ('not_ref', '5')
+
+
+def test_results_store_4():
+    # A headerless TSV (e.g. a later --part) needs the header to be given.
+    with tempfile.TemporaryDirectory() as temp_dir:
+        tsv = pathlib.Path(temp_dir) / 'pairwise.tsv'
+        with open('test/test_mask/pairwise.tsv', 'rt') as f:
+            header = f.readline()
+            body = f.read()
+        with open(tsv, 'wt') as f:
+            f.write(body)
+        with pytest.raises(SystemExit):
+            verticall.tsv.build_results_store(tsv)
+        verticall.tsv.build_results_store(tsv, header)
+        assert len(get_all_results(tsv, ['mean_vertical_distance'])) == 7
+        with pytest.raises(SystemExit) as e:
+            verticall.tsv.build_results_store(pathlib.Path('test/test_matrix/pairwise.tsv.gz'))
+        assert 'compressed' in str(e.value)
+
+
+def test_get_result_pairs():
+    # The pairs should be the same whether they come from a scan, an index or a results store.
+    with tempfile.TemporaryDirectory() as temp_dir:
+        tsv = pathlib.Path(temp_dir) / 'pairwise.tsv'
+        shutil.copyfile('test/test_mask/pairwise.tsv', tsv)
+        scanned = verticall.tsv.get_result_pairs(tsv)
+        assert scanned == {('ref', '1'), ('ref', '2'), ('ref', '3'), ('ref', '4'),
+                           ('not_ref', '5')}
+        verticall.tsv.build_results_store(tsv)
+        assert verticall.tsv.get_result_pairs(tsv) == scanned
+        verticall.tsv.build_tsv_index(tsv)
+        assert verticall.tsv.get_result_pairs(tsv) == scanned
+        assert verticall.tsv.get_result_pairs(pathlib.Path('test/test_matrix/pairwise.tsv.gz')) \
+            == verticall.tsv.get_result_pairs(pathlib.Path('test/test_matrix/pairwise.tsv'))
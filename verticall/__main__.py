@@ -17,38 +17,41 @@ import pathlib
 import sys
 
 from .help_formatter import MyParser, MyHelpFormatter
-from .misc import check_python_version, get_ascii_art, get_default_thread_count
+from .misc import check_python_version, get_ascii_art, get_default_thread_count, \
+    check_hex_colour, DISTANCE_TYPES
 from .log import bold
-from .mask import mask
-from .matrix import matrix
-from .pairwise import pairwise
-from .repair import repair
-from .summary import summary
 from .version import __version__
-from .view import view, check_hex_colour
 
 
 def main():
     check_python_version()
     args = parse_args(sys.argv[1:])
 
+    # Each subcommand's module is only imported when it runs, so commands which don't plot (e.g.
+    # many short pairwise --part jobs) don't pay for importing matplotlib, pandas and plotnine.
     if args.subparser_name == 'pairwise':
         check_pairwise_args(args)
+        from .pairwise import pairwise
         pairwise(args)
     elif args.subparser_name == 'view':
         check_view_args(args)
+        from .view import view
         view(args)
     elif args.subparser_name == 'matrix':
         check_matrix_args(args)
+        from .matrix import matrix
         matrix(args)
     elif args.subparser_name == 'mask':
         check_mask_args(args)
+        from .mask import mask
         mask(args)
     elif args.subparser_name == 'summary':
         check_summary_args(args)
+        from .summary import summary
         summary(args)
     elif args.subparser_name == 'repair':
         check_repair_args(args)
+        from .repair import repair
         repair(args)
 
 
@@ -96,7 +99,7 @@ def pairwise_subparser(subparsers):
     required_args.add_argument('-i', '--in_dir', type=pathlib.Path, required=True,
                                help='Directory containing assemblies in FASTA format')
     required_args.add_argument('-o', '--out_file', type=pathlib.Path, required=True,
-                               help='Filename of TSV output')
+                               help='Filename of TSV output (or database with --database)')
 
     reference_args = group.add_argument_group('Reference-based analysis')
     reference_args.add_argument('-r', '--reference', type=pathlib.Path,
@@ -117,6 +120,32 @@ def pairwise_subparser(subparsers):
                                   help='Do not carry out the assembly check for duplicate contig '
                                        'names and ambiguous bases (default: perform the assembly '
                                        'check)')
+    performance_args.add_argument('--tsv_index', action='store_true',
+                                  help='Also save a byte-offset index of the output TSV (with an '
+                                       '.idx extension) so later commands can go straight to the '
+                                       'rows they need (default: no index)')
+    performance_args.add_argument('--store', action='store_true',
+                                  help='Also save a columnar binary copy of the results (in a '
+                                       '.store directory) which matrix, mask and summary will '
+                                       'read instead of the TSV (default: no store)')
+    performance_args.add_argument('--database', action='store_true',
+                                  help='Write results to an SQLite database (at the -o path) '
+                                       'instead of a TSV, which parallel --part runs can share '
+                                       'and later commands can query by sample (default: TSV)')
+    performance_args.add_argument('--incremental', action='store_true',
+                                  help='Only analyse assembly pairs without results in the '
+                                       'existing output file, appending to it instead of '
+                                       'overwriting it (default: analyse all pairs)')
+    performance_args.add_argument('--instrument', type=pathlib.Path,
+                                  help='Save the time taken by each stage, window and alignment '
+                                       'counts and worker memory for each assembly pair to this '
+                                       'file (one JSON record per line)')
+    performance_args.add_argument('--profile', type=pathlib.Path,
+                                  help='Profile the main process and all worker processes with '
+                                       'cProfile, saving the merged profile to this file (plus '
+                                       'a text summary with a .txt extension added)')
+    performance_args.add_argument('--profile_top', type=int, default=30,
+                                  help='Number of functions to include in the --profile summary')
 
     other_args = group.add_argument_group('Other')
     other_args.add_argument('-h', '--help', action='help', default=argparse.SUPPRESS,
@@ -217,16 +246,16 @@ def matrix_subparser(subparsers):
 
     required_args = group.add_argument_group('Required arguments')
     required_args.add_argument('-i', '--in_file', type=pathlib.Path, required=True,
-                               help='Filename of TSV created by vertical pairwise')
+                               help='Filename of TSV (or database) created by vertical pairwise')
     required_args.add_argument('-o', '--out_file', type=pathlib.Path, required=True,
-                               help='Filename of PHYLIP matrix output')
+                               help='Filename of PHYLIP matrix output (can contain '
+                                    '"{distance_type}" and "{correction}" which will be filled in '
+                                    'for each output matrix)')
 
     settings_args = group.add_argument_group('Settings')
     settings_args.add_argument('--distance_type', type=str, default='median_vertical_window',
-                               choices=['mean', 'mean_window', 'median_window', 'peak_window',
-                                        'mean_vertical_window', 'median_vertical_window',
-                                        'mean_vertical'],
-                               help='Which distance to use in matrix')
+                               help='Which distance to use in matrix (comma-delimited for more '
+                                    'than one, choose from: ' + ', '.join(DISTANCE_TYPES) + ')')
     settings_args.add_argument('--asymmetrical', action='store_true',
                                help='Do not average pairs to make symmetrical matrices (default: '
                                     'make matrices symmetrical)')
@@ -242,6 +271,19 @@ def matrix_subparser(subparsers):
     settings_args.add_argument('--exclude_names', type=str,
                                help='Samples names to exclude from matrix (comma-delimited, '
                                     'default: do not exclude any samples)')
+    settings_args.add_argument('--out_format', type=str, default='square',
+                               choices=['square', 'lower', 'npy'],
+                               help='Matrix output format: square PHYLIP, lower-triangular '
+                                    'PHYLIP or binary NumPy array (with a .names.txt file of '
+                                    'sample names)')
+
+    tree_args = group.add_argument_group('Tree')
+    tree_args.add_argument('--tree', type=pathlib.Path,
+                           help='Filename of Newick tree built from the matrix (can contain '
+                                '"{distance_type}" and "{correction}" like --out_file, default: '
+                                'do not build a tree)')
+    tree_args.add_argument('--tree_method', type=str, default='bionj', choices=['nj', 'bionj'],
+                           help='Tree-building method: neighbour joining or BioNJ')
 
     other_args = group.add_argument_group('Other')
     other_args.add_argument('-h', '--help', action='help', default=argparse.SUPPRESS,
@@ -257,7 +299,7 @@ def mask_subparser(subparsers):
 
     required_args = group.add_argument_group('Required arguments')
     required_args.add_argument('-i', '--in_tsv', type=pathlib.Path, required=True,
-                               help='Filename of TSV created by vertical pairwise')
+                               help='Filename of TSV (or database) created by vertical pairwise')
     required_args.add_argument('-a', '--in_alignment', type=pathlib.Path, required=True,
                                help='Filename of whole-genome pseudo-alignment to be masked')
     required_args.add_argument('-o', '--out_alignment', type=pathlib.Path, required=True,
@@ -290,6 +332,15 @@ def mask_subparser(subparsers):
                                     'alignment (default: include the reference sequence in the '
                                     'output alignment)')
 
+    performance_args = group.add_argument_group('Performance')
+    performance_args.add_argument('-t', '--threads', type=int, default=get_default_thread_count(),
+                                  help='CPU threads for parallel masking (not used with '
+                                       '--streaming)')
+    performance_args.add_argument('--streaming', action='store_true',
+                                  help='Mask one sequence at a time via a temporary file to reduce '
+                                       'memory usage (default: load the whole pseudo-alignment '
+                                       'into memory)')
+
     other_args = group.add_argument_group('Other')
     other_args.add_argument('-h', '--help', action='help', default=argparse.SUPPRESS,
                             help='Show this help message and exit')
@@ -298,14 +349,21 @@ def mask_subparser(subparsers):
 
 
 def summary_subparser(subparsers):
-    group = subparsers.add_parser('summary', description='summarise regions for one assembly',
+    group = subparsers.add_parser('summary', description='summarise regions for assemblies',
                                   formatter_class=MyHelpFormatter, add_help=False)
 
     required_args = group.add_argument_group('Required arguments')
     required_args.add_argument('-i', '--in_file', type=pathlib.Path, required=True,
-                               help='Filename of TSV created by vertical pairwise')
-    required_args.add_argument('-a', '--assembly', type=pathlib.Path, required=True,
-                               help='Filename of assembly to be summarised')
+                               help='Filename of TSV (or database) created by vertical pairwise')
+    required_args.add_argument('-a', '--assembly', type=pathlib.Path,
+                               help='Filename of assembly to be summarised (or use '
+                                    '--assembly_dir)')
+
+    batch_args = group.add_argument_group('Batch mode (instead of --assembly)')
+    batch_args.add_argument('--assembly_dir', type=pathlib.Path,
+                            help='Directory of assemblies to be summarised')
+    batch_args.add_argument('--out_dir', type=pathlib.Path,
+                            help='Directory where one summary file per assembly will be saved')
 
     settings_args = group.add_argument_group('Settings')
     settings_args.add_argument('--all', action='store_true',
@@ -313,6 +371,13 @@ def summary_subparser(subparsers):
                                     'redundant adjacent lines)')
     settings_args.add_argument('--plot', action='store_true',
                                help='Instead of outputting a table, display an interactive plot')
+    settings_args.add_argument('--format', type=str, default='table',
+                               choices=['table', 'bins', 'bedgraph'],
+                               help='Output format: change points, mean depth in fixed-width '
+                                    'bins or runs of constant depth (bedGraph-style with three '
+                                    'value columns)')
+    settings_args.add_argument('--bin_size', type=int, default=1000,
+                               help='Bin width in bp (for --format bins)')
 
     colour_args = group.add_argument_group('Colours')
     colour_settings(colour_args, 'unaligned')
@@ -344,6 +409,14 @@ def repair_subparser(subparsers):
 
 def check_pairwise_args(args):
     check_pairwise_and_view_args(args)
+    if args.database and (args.tsv_index or args.store):
+        sys.exit('Error: --tsv_index and --store cannot be used with --database')
+    if args.instrument is not None and args.instrument.resolve() == args.out_file.resolve():
+        sys.exit('Error: --instrument cannot be the same file as --out_file')
+    if args.profile is not None and args.profile.resolve() == args.out_file.resolve():
+        sys.exit('Error: --profile cannot be the same file as --out_file')
+    if args.profile_top < 1:
+        sys.exit('Error: --profile_top must be a positive integer')
 
 
 def check_view_args(args):
@@ -373,10 +446,30 @@ def check_pairwise_and_view_args(args):
 
 
 def check_matrix_args(args):
-    pass
+    args.distance_type = args.distance_type.split(',')
+    for distance_type in args.distance_type:
+        if distance_type not in DISTANCE_TYPES:
+            sys.exit(f'Error: {distance_type} is not a valid --distance_type (choose from: '
+                     + ', '.join(DISTANCE_TYPES) + ')')
+    if len(set(args.distance_type)) != len(args.distance_type):
+        sys.exit('Error: --distance_type cannot contain duplicates')
+    if len(args.distance_type) > 1 and '{distance_type}' not in str(args.out_file):
+        sys.exit('Error: --out_file must contain "{distance_type}" when more than one '
+                 '--distance_type is used')
+    if args.no_jukes_cantor and '{correction}' in str(args.out_file):
+        sys.exit('Error: --no_jukes_cantor cannot be used when --out_file contains '
+                 '"{correction}"')
+    if args.tree is not None:
+        for placeholder in ['{distance_type}', '{correction}']:
+            if placeholder in str(args.out_file) and placeholder not in str(args.tree):
+                sys.exit(f'Error: --tree must contain "{placeholder}" when --out_file does')
+    if args.out_format == 'lower' and args.asymmetrical:
+        sys.exit('Error: --asymmetrical cannot be used with a lower-triangular --out_format')
 
 
 def check_mask_args(args):
+    if args.threads < 1:
+        sys.exit('Error: --threads must be a positive integer')
     if args.h_char.upper() == 'NONE':
         args.h_char = None
     if args.u_char.upper() == 'NONE':
@@ -388,7 +481,21 @@ def check_mask_args(args):
 
 
 def check_summary_args(args):
-    pass
+    if (args.assembly is None) == (args.assembly_dir is None):
+        sys.exit('Error: either --assembly or --assembly_dir (but not both) must be used')
+    if args.assembly_dir is not None:
+        if args.out_dir is None:
+            sys.exit('Error: --out_dir must be used with --assembly_dir')
+        if args.plot:
+            sys.exit('Error: --plot cannot be used with --assembly_dir')
+    elif args.out_dir is not None:
+        sys.exit('Error: --out_dir can only be used with --assembly_dir')
+    if args.bin_size < 1:
+        sys.exit('Error: --bin_size must be a positive integer')
+    if args.all and args.format != 'table':
+        sys.exit('Error: --all can only be used with --format table')
+    if args.plot and args.format == 'bedgraph':
+        sys.exit('Error: --plot cannot be used with --format bedgraph')
 
 
 def check_repair_args(args):
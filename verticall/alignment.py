@@ -17,6 +17,7 @@ import re
 import subprocess
 import sys
 
+from .instrument import time_stage
 from .intrange import IntRange
 from .log import log, section_header, explanation
 from .misc import get_fasta_size, get_n50, get_window_count, get_window_coverage, \
@@ -57,7 +58,7 @@ def index_exists(directory, sample_name, verbose):
     return exists
 
 
-def align_sample_pair(args, assembly_filename_a, sample_name_b):
+def align_sample_pair(args, assembly_filename_a, sample_name_b, stats=None):
     log_text = []
     sequence_index = args.in_dir / (sample_name_b + '.mmi')
     command = ['minimap2', '-c', '-t', '1', '--eqx']
@@ -65,12 +66,17 @@ def align_sample_pair(args, assembly_filename_a, sample_name_b):
     command += [str(sequence_index.resolve()), str(assembly_filename_a.resolve())]
     if args.verbose:
         log_text.append('  ' + ' '.join(str(x) for x in command))
-    p = subprocess.run(command, capture_output=True, text=True)
+    with time_stage(stats, 'alignment'):
+        p = subprocess.run(command, capture_output=True, text=True)
 
     ignore_indels = True if args.ignore_indels else False
-    alignments = [Alignment(line, ignore_indels) for line in p.stdout.splitlines()
-                  if not line.startswith('@')]
-    alignments = cull_redundant_alignments(alignments, args.allowed_overlap)
+    with time_stage(stats, 'paf_parsing'):
+        alignments = [Alignment(line, ignore_indels) for line in p.stdout.splitlines()
+                      if not line.startswith('@')]
+    if stats is not None:
+        stats.count('raw_alignments', len(alignments))
+    with time_stage(stats, 'culling'):
+        alignments = cull_redundant_alignments(alignments, args.allowed_overlap)
 
     n50_alignment_length = get_n50(len(a.expanded_cigar) for a in alignments)
     aligned_frac = get_query_coverage(alignments, assembly_filename_a)
@@ -110,10 +116,8 @@ def get_query_coverage(alignments, assembly_filename):
     assembly_size = get_fasta_size(assembly_filename)
     ranges_by_contig = {}
     for a in alignments:
-        if a.query_name not in ranges_by_contig:
-            ranges_by_contig[a.query_name] = IntRange()
-        ranges_by_contig[a.query_name].add_range(a.query_start, a.query_end)
-    aligned_bases = sum(r.total_length() for r in ranges_by_contig.values())
+        ranges_by_contig.setdefault(a.query_name, []).append((a.query_start, a.query_end))
+    aligned_bases = sum(IntRange(r).total_length() for r in ranges_by_contig.values())
     assert aligned_bases <= assembly_size
     return aligned_bases / assembly_size
 
@@ -331,16 +335,12 @@ class Alignment(object):
         return self.get_blocks(3, include_ambiguous)  # 3 means ambiguous
 
     def get_blocks(self, classification, include_ambiguous=False):
-        blocks = IntRange()
         if include_ambiguous:
             classifications = self.window_class_with_amb
         else:
             classifications = self.window_classifications
-        for i, c in enumerate(classifications):
-            start, end = self.windows_no_overlap[i]
-            if c == classification:
-                blocks.add_range(start, end)
-        return blocks.ranges
+        return IntRange([self.windows_no_overlap[i] for i, c in enumerate(classifications)
+                         if c == classification]).ranges
 
 
 def get_expanded_cigar(cigar):
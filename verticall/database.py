@@ -0,0 +1,147 @@
+"""
+This module contains code for storing pairwise results in an SQLite database (instead of a TSV
+file). Each row's full TSV line is stored along with its assembly names and result level, so the
+rest of Verticall can read a database exactly like a TSV file, but per-sample queries are indexed
+lookups instead of full scans.
+
+Copyright 2022 Ryan Wick (rrwick@gmail.com)
+https://github.com/rrwick/Verticall
+
+This file is part of Verticall. Verticall is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by the Free Software Foundation,
+either version 3 of the License, or (at your option) any later version. Verticall is distributed
+in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+details. You should have received a copy of the GNU General Public License along with Verticall.
+If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import sqlite3
+import sys
+
+
+SQLITE_MAGIC = b'SQLite format 3\x00'
+
+# Parallel --part runs may write to the same database, so writers wait for each other's locks.
+BUSY_TIMEOUT_SECONDS = 600
+
+
+def is_results_database(filename):
+    try:
+        with open(filename, 'rb') as f:
+            return f.read(len(SQLITE_MAGIC)) == SQLITE_MAGIC
+    except OSError:
+        return False
+
+
+def connect(filename):
+    try:
+        connection = sqlite3.connect(str(filename), timeout=BUSY_TIMEOUT_SECONDS)
+        connection.execute('PRAGMA journal_mode=WAL')
+    except sqlite3.DatabaseError as e:
+        sys.exit(f'Error: could not open {filename} as an SQLite database ({e})')
+    return connection
+
+
+class ResultsDatabase(object):
+    """
+    This class writes pairwise results to an SQLite database. It has the same write/flush methods
+    as a TSV file object, so pairwise can write to either. Lines are buffered until flush, when all
+    existing rows for the buffered assembly pairs are replaced, so rerunning pairs (e.g. a repeated
+    --part) doesn't duplicate their results.
+    """
+    def __init__(self, filename, header):
+        self.connection = connect(filename)
+        self.header_parts = header.rstrip('\n').split('\t')
+        self.level_column = self.header_parts.index('result_level')
+        self.buffer = []
+        with self.connection:
+            self.connection.execute('CREATE TABLE IF NOT EXISTS header (line TEXT NOT NULL)')
+            self.connection.execute('CREATE TABLE IF NOT EXISTS results ('
+                                    'id INTEGER PRIMARY KEY, '
+                                    'assembly_a TEXT NOT NULL, '
+                                    'assembly_b TEXT NOT NULL, '
+                                    'result_level TEXT NOT NULL, '
+                                    'line TEXT NOT NULL)')
+            self.connection.execute('CREATE INDEX IF NOT EXISTS results_pair '
+                                    'ON results (assembly_a, assembly_b)')
+            self.connection.execute('INSERT INTO header SELECT ? '
+                                    'WHERE NOT EXISTS (SELECT 1 FROM header)', (header,))
+            existing = self.connection.execute('SELECT line FROM header').fetchone()[0]
+        if existing != header:
+            sys.exit(f'Error: {filename} has results with different columns')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def write(self, line):
+        parts = line.split('\t', self.level_column + 1)
+        self.buffer.append((parts[0], parts[1], parts[self.level_column], line))
+
+    def flush(self):
+        if not self.buffer:
+            return
+        with self.connection:
+            pairs = sorted(set((a, b) for a, b, _, _ in self.buffer))
+            self.connection.executemany('DELETE FROM results '
+                                        'WHERE assembly_a = ? AND assembly_b = ?', pairs)
+            self.connection.executemany('INSERT INTO results '
+                                        '(assembly_a, assembly_b, result_level, line) '
+                                        'VALUES (?, ?, ?, ?)', self.buffer)
+        self.buffer = []
+
+    def close(self):
+        self.flush()
+        self.connection.close()
+
+
+def get_database_assembly_a_names(filename):
+    """
+    Returns the sorted distinct assembly_a names in the database (an indexed lookup).
+    """
+    connection = connect(filename)
+    try:
+        rows = connection.execute('SELECT DISTINCT assembly_a FROM results ORDER BY assembly_a')
+        return [r[0] for r in rows]
+    finally:
+        connection.close()
+
+
+def get_database_pairs(filename):
+    """
+    Returns the set of (assembly_a, assembly_b) pairs with results in the database (read from the
+    pair index).
+    """
+    connection = connect(filename)
+    try:
+        return set(connection.execute('SELECT DISTINCT assembly_a, assembly_b FROM results'))
+    finally:
+        connection.close()
+
+
+def iterate_database_lines(filename, assembly_a_names=None):
+    """
+    Yields the results as TSV lines (header first, then rows in insertion order). If
+    assembly_a_names is given, only rows with one of those assembly_a names are yielded.
+    """
+    connection = connect(filename)
+    try:
+        header = connection.execute('SELECT line FROM header').fetchone()
+        if header is None:
+            return
+        yield header[0]
+        if assembly_a_names is None:
+            rows = connection.execute('SELECT line FROM results ORDER BY id')
+        else:  # a temporary table avoids SQLite's limit on the number of query parameters
+            connection.execute('CREATE TEMP TABLE names (name TEXT PRIMARY KEY)')
+            connection.executemany('INSERT OR IGNORE INTO names VALUES (?)',
+                                   ((n,) for n in assembly_a_names))
+            rows = connection.execute('SELECT line FROM results WHERE assembly_a IN '
+                                      '(SELECT name FROM names) ORDER BY id')
+        for row in rows:
+            yield row[0]
+    finally:
+        connection.close()
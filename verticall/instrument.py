@@ -0,0 +1,83 @@
+"""
+This module contains code for Verticall pairwise's --instrument option, which saves one JSON record
+per assembly pair with the time spent in each stage of the analysis, some counts and the memory
+used by the process that analysed the pair.
+
+Copyright 2022 Ryan Wick (rrwick@gmail.com)
+https://github.com/rrwick/Verticall
+
+This file is part of Verticall. Verticall is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by the Free Software Foundation,
+either version 3 of the License, or (at your option) any later version. Verticall is distributed
+in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+details. You should have received a copy of the GNU General Public License along with Verticall.
+If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import contextlib
+import json
+import os
+import sys
+import time
+
+
+# The stages of a pairwise comparison, in the order they happen. Painting happens once per result
+# (primary and secondary), and its time is the total over all results.
+STAGES = ['alignment', 'paf_parsing', 'culling', 'windows', 'smoothing', 'peak_calling',
+          'painting']
+
+
+class PairStats(object):
+    """
+    This class collects the stage timings and counts for one assembly pair. Stages are timed with
+    the stage context manager, and the finished record is a JSON-serialisable dictionary.
+    """
+    def __init__(self, name_a, name_b):
+        self.start_time = time.perf_counter()
+        self.record = {'assembly_a': name_a, 'assembly_b': name_b, 'seconds': {}, 'counts': {}}
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        assert name in STAGES
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = self.record['seconds']
+            seconds[name] = seconds.get(name, 0.0) + time.perf_counter() - start_time
+
+    def count(self, name, value):
+        self.record['counts'][name] = value
+
+    def finish(self):
+        self.record['seconds'] = {s: round(self.record['seconds'].get(s, 0.0), 6) for s in STAGES}
+        self.record['seconds']['total'] = round(time.perf_counter() - self.start_time, 6)
+        self.record['pid'] = os.getpid()
+        self.record['max_rss_kb'] = get_max_rss_kb()
+        return self.record
+
+
+def time_stage(stats, name):
+    """
+    Returns a context manager which times the stage if stats were given and does nothing if not.
+    """
+    return contextlib.nullcontext() if stats is None else stats.stage(name)
+
+
+def get_max_rss_kb():
+    """
+    Returns the peak resident set size of this process so far, in kB. Since pool workers are
+    reused, this is the worker's peak over all pairs it has analysed up to now. Returns None on
+    platforms without the resource module (e.g. Windows).
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss // 1024 if sys.platform == 'darwin' else max_rss  # macOS reports bytes
+
+
+def format_record(record):
+    return json.dumps(record, separators=(',', ':')) + '\n'
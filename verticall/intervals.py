@@ -0,0 +1,193 @@
+"""
+This module contains a NumPy-backed interval set, used for the vertical/horizontal/unaligned
+region lists in pairwise (painting), mask and summary.
+
+Copyright 2022 Ryan Wick (rrwick@gmail.com)
+https://github.com/rrwick/Verticall
+
+This file is part of Verticall. Verticall is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by the Free Software Foundation,
+either version 3 of the License, or (at your option) any later version. Verticall is distributed
+in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+details. You should have received a copy of the GNU General Public License along with Verticall.
+If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import numpy as np
+
+
+class IntervalSet(object):
+    """
+    This class holds a set of integer positions as sorted, non-overlapping intervals (with
+    exclusive ends, like Python ranges). Overlapping or touching intervals are merged when the set
+    is made, and all operations are done on the start/end arrays without per-interval loops.
+    """
+    def __init__(self, starts=None, ends=None):
+        starts = np.empty(0, dtype=np.int64) if starts is None else np.asarray(starts, np.int64)
+        ends = np.empty(0, dtype=np.int64) if ends is None else np.asarray(ends, np.int64)
+        self.starts, self.ends = merge_intervals(starts, ends)
+
+    @classmethod
+    def from_array(cls, regions):
+        """
+        Makes an interval set from an N×2 array (or list of tuples) of start/end positions.
+        """
+        regions = np.asarray(regions, dtype=np.int64).reshape(-1, 2)
+        return cls(regions[:, 0], regions[:, 1])
+
+    @classmethod
+    def from_mask(cls, mask):
+        """
+        Makes an interval set from the runs of True in a boolean array (one value per position).
+        """
+        changes = np.flatnonzero(np.diff(np.concatenate([[False], mask, [False]]).astype(np.int8)))
+        return cls(changes[0::2], changes[1::2])
+
+    def __len__(self):
+        return len(self.starts)
+
+    def __iter__(self):
+        return zip(self.starts.tolist(), self.ends.tolist())
+
+    def __eq__(self, other):
+        return np.array_equal(self.starts, other.starts) and np.array_equal(self.ends, other.ends)
+
+    def __repr__(self):
+        return str(self.to_list())
+
+    def to_array(self):
+        return np.stack([self.starts, self.ends], axis=1)
+
+    def to_list(self):
+        return list(self)
+
+    def total_length(self):
+        return int(np.sum(self.ends - self.starts))
+
+    def union(self, *others):
+        sets = (self,) + others
+        return IntervalSet(np.concatenate([s.starts for s in sets]),
+                           np.concatenate([s.ends for s in sets]))
+
+    def intersection(self, other):
+        return combine(self, other, np.logical_and)
+
+    def difference(self, other):
+        return combine(self, other, lambda a, b: a & ~b)
+
+    def complement(self, length):
+        """
+        Returns the positions in 0 to length (exclusive) which are not in this set.
+        """
+        return IntervalSet([0], [length]).difference(self)
+
+    def contains(self, positions):
+        """
+        Returns a boolean array saying which of the given positions are in this set.
+        """
+        return get_coverage(self, np.asarray(positions, dtype=np.int64)) > 0
+
+
+def merge_intervals(starts, ends):
+    """
+    Sorts intervals and merges overlapping or touching ones, returning new start/end arrays. Empty
+    (or backwards) intervals are dropped.
+    """
+    keep = ends > starts
+    starts, ends = starts[keep], ends[keep]
+    if len(starts) == 0:
+        return starts, ends
+    order = np.argsort(starts, kind='stable')
+    starts, ends = starts[order], np.maximum.accumulate(ends[order])
+    new_group = np.ones(len(starts), dtype=bool)
+    new_group[1:] = starts[1:] > ends[:-1]
+    group_ends = np.append(np.flatnonzero(new_group)[1:] - 1, len(starts) - 1)
+    return starts[new_group], ends[group_ends]
+
+
+def get_coverage(interval_set, positions):
+    """
+    Returns how many of the set's intervals cover each position (0 or 1, since they don't overlap).
+    """
+    return np.searchsorted(interval_set.starts, positions, side='right') - \
+        np.searchsorted(interval_set.ends, positions, side='right')
+
+
+def combine(a, b, operation):
+    """
+    Applies a boolean operation to two interval sets: the positions are divided into segments
+    between all start/end positions, the operation is applied to each segment's membership of a
+    and b, and the resulting segments are merged back into intervals.
+    """
+    breakpoints = np.unique(np.concatenate([a.starts, a.ends, b.starts, b.ends]))
+    if len(breakpoints) < 2:
+        return IntervalSet()
+    segment_starts, segment_ends = breakpoints[:-1], breakpoints[1:]
+    keep = operation(get_coverage(a, segment_starts) > 0, get_coverage(b, segment_starts) > 0)
+    return IntervalSet(segment_starts[keep], segment_ends[keep])
+
+
+def get_breakpoints(regions):
+    """
+    Returns (positions, deltas) arrays for an N×2 region array or an interval set: +1 at each start
+    and -1 at each end, like a difference array.
+    """
+    if isinstance(regions, IntervalSet):
+        regions = regions.to_array()
+    deltas = np.repeat(np.array([[1, -1]], dtype=np.int64), len(regions), axis=0)
+    return regions.reshape(-1), deltas.reshape(-1)
+
+
+def merge_breakpoints(breakpoint_list):
+    """
+    Combines a list of (positions, deltas) array pairs into one pair with sorted unique positions,
+    leaving out any positions where the deltas cancel out.
+    """
+    if not breakpoint_list:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    positions = np.concatenate([p for p, _ in breakpoint_list])
+    deltas = np.concatenate([d for _, d in breakpoint_list])
+    positions, inverse = np.unique(positions, return_inverse=True)
+    deltas = np.bincount(inverse, weights=deltas, minlength=len(positions)).astype(np.int64)
+    non_zero = deltas != 0
+    return positions[non_zero], deltas[non_zero]
+
+
+def get_depth_runs(interval_sets, length):
+    """
+    Returns the coverage depth of many interval sets over 0 to length (exclusive), as arrays of
+    run starts, run ends and depths. Adjacent runs always have different depths.
+    """
+    starts, ends, depths = get_layered_depth_runs([[get_breakpoints(s) for s in interval_sets]],
+                                                  length)
+    return starts, ends, depths[0]
+
+
+def get_layered_depth_runs(breakpoint_lists, length):
+    """
+    Returns the coverage depths of several layers over 0 to length (exclusive), where each layer is
+    a list of (positions, deltas) breakpoint array pairs. The result is arrays of run starts and run
+    ends, plus a K×N array of depths (one row per layer). Adjacent runs always differ in the depth
+    of at least one layer.
+    """
+    merged = [merge_breakpoints(b) for b in breakpoint_lists]
+    all_positions = np.concatenate([[0]] + [positions for positions, _ in merged])
+    all_positions = np.unique(all_positions[all_positions < length]).astype(np.int64)
+    depths = np.empty((len(merged), len(all_positions)), dtype=np.int64)
+    for i, (positions, deltas) in enumerate(merged):
+        cumulative = np.concatenate([[0], np.cumsum(deltas)])
+        depths[i] = cumulative[np.searchsorted(positions, all_positions, side='right')]
+    changed = np.ones(len(all_positions), dtype=bool)
+    changed[1:] = np.any(depths[:, 1:] != depths[:, :-1], axis=0)
+    starts = all_positions[changed]
+    return starts, np.append(starts[1:], length), depths[:, changed]
+
+
+def format_interval_sets(interval_sets):
+    """
+    Formats a dictionary of contig name to interval set as a comma-delimited region string (e.g.
+    "contig_1:0-10,contig_1:20-30,contig_2:0-50"), as used in Verticall pairwise's output.
+    """
+    return ','.join(','.join(f'{name}:{start}-{end}' for start, end in interval_set)
+                    for name, interval_set in interval_sets.items() if len(interval_set) > 0)
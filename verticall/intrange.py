@@ -12,67 +12,77 @@ If not, see <https://www.gnu.org/licenses/>.
 """
 
 
+import bisect
+
+
 class IntRange(object):
     """
-    This class contains one or more integer ranges. Overlapping ranges will be merged together.
-    It stores its ranges in a Python-like fashion where the last value in each range is
+    This class contains one or more integer ranges. Overlapping (or touching) ranges will be merged
+    together. It stores its ranges in a Python-like fashion where the last value in each range is
     exclusive.
+
+    The ranges are kept as two sorted lists (starts and ends) with no overlaps, so a single range
+    can be added with a binary search and one slice assignment. When many ranges are known up front,
+    pass them to the constructor (or add_ranges), which sorts them once.
     """
     def __init__(self, ranges=None):
-        if not ranges:
-            ranges = []
-        self.ranges = []
-        self.add_ranges(ranges)
-        self.simplify()
+        self.starts, self.ends = [], []
+        if ranges:
+            self.add_ranges(ranges)
 
     def __repr__(self):
         return str(self.ranges)
 
+    @property
+    def ranges(self):
+        return list(zip(self.starts, self.ends))
+
     def add_range(self, start, end):
         """Adds a single range."""
-        self.add_ranges([(start, end)])
+        if start > end:
+            start, end = end, start
+        elif start == end:
+            return
+        i = bisect.bisect_left(self.ends, start)    # first range which ends at or after start
+        j = bisect.bisect_right(self.starts, end)   # first range which starts after end
+        if i < j:
+            start = min(start, self.starts[i])
+            end = max(end, self.ends[j - 1])
+        self.starts[i:j] = [start]
+        self.ends[i:j] = [end]
 
     def add_ranges(self, ranges):
         """Adds multiple ranges (list of tuples)."""
-        self.ranges += ranges
-        self.simplify()
+        self.starts, self.ends = merge_ranges(list(zip(self.starts, self.ends)) + list(ranges))
 
     def total_length(self):
         """Returns the number of integers in the ranges."""
-        return sum([x[1] - x[0] for x in self.ranges])
+        return sum(self.ends) - sum(self.starts)
 
     def simplify(self):
-        """Collapses overlapping ranges together."""
-        fixed_ranges = []
-        for int_range in self.ranges:
-            if int_range[0] > int_range[1]:
-                fixed_ranges.append((int_range[1], int_range[0]))
-            elif int_range[0] < int_range[1]:
-                fixed_ranges.append(int_range)
-        starts_ends = [(x[0], 1) for x in fixed_ranges]
-        starts_ends += [(x[1], -1) for x in fixed_ranges]
-        starts_ends.sort(key=lambda z: z[0])
-        current_sum = 0
-        cumulative_sum = []
-        for start_end in starts_ends:
-            current_sum += start_end[1]
-            cumulative_sum.append((start_end[0], current_sum))
-        prev_depth = 0
-        start = 0
-        combined = []
-        for pos, depth in cumulative_sum:
-            if prev_depth == 0:
-                start = pos
-            elif depth == 0:
-                combined.append((start, pos))
-            prev_depth = depth
-        self.ranges = combined
+        """Collapses overlapping ranges together (they are always kept simplified)."""
+        self.starts, self.ends = merge_ranges(self.ranges)
 
     def overlaps(self, other):
         """Returns True if the other IntRange overlaps with this IntRange."""
-        for other_range in other.ranges:
-            other_start, other_end = other_range
-            for this_start, this_end in self.ranges:
-                if (this_start <= other_start < this_end) or (this_start < other_end <= this_end):
-                    return True
+        for other_start, other_end in zip(other.starts, other.ends):
+            i = bisect.bisect_right(self.ends, other_start)  # first range which ends after start
+            if i < len(self.starts) and self.starts[i] < other_end:
+                return True
         return False
+
+
+def merge_ranges(ranges):
+    """
+    Sorts ranges (flipping any which are backwards and dropping any which are empty) and merges
+    overlapping or touching ones, returning lists of starts and ends.
+    """
+    fixed_ranges = sorted((min(s, e), max(s, e)) for s, e in ranges if s != e)
+    starts, ends = [], []
+    for start, end in fixed_ranges:
+        if ends and start <= ends[-1]:
+            ends[-1] = max(ends[-1], end)
+        else:
+            starts.append(start)
+            ends.append(end)
+    return starts, ends
@@ -13,24 +13,34 @@ details. You should have received a copy of the GNU General Public License along
 If not, see <https://www.gnu.org/licenses/>.
 """
 
+import ctypes
+from multiprocessing import Pool
+from multiprocessing.sharedctypes import RawArray
+import numpy as np
 import svgwrite
 import sys
+import tempfile
 
+from .intervals import IntervalSet
 from .log import log, section_header, explanation, warning
 from .misc import iterate_fasta, list_differences
-from .tsv import get_column_index, check_header_for_assembly_a_regions, get_start_end
+from .tsv import iterate_results, get_indexed_assembly_a_names
 
 
 def mask(args):
     welcome_message(args)
     data, ref_name, ref_length, sample_names = load_regions(args.in_tsv, args.reference, args.multi)
-    sequences, sample_names = load_pseudo_alignment(args.in_alignment, ref_name, sample_names)
-    masked_sequences = mask_sequences(data, sequences, ref_name, ref_length, sample_names,
-                                      args.h_char, args.u_char, args.image, args.vertical_colour,
-                                      args.horizontal_colour, args.unaligned_colour)
-    masked_sequences = finalise(masked_sequences, ref_name, args.exclude_reference,
-                                args.exclude_invariant)
-    save_to_file(masked_sequences, args.out_alignment)
+    if args.streaming:
+        mask_streaming(args, data, ref_name, ref_length, sample_names)
+    else:
+        sequences, sample_names = load_pseudo_alignment(args.in_alignment, ref_name, sample_names)
+        masked_sequences = mask_sequences(data, sequences, ref_name, ref_length, sample_names,
+                                          args.h_char, args.u_char, args.image,
+                                          args.vertical_colour, args.horizontal_colour,
+                                          args.unaligned_colour, args.threads)
+        masked_sequences = finalise(masked_sequences, ref_name, args.exclude_reference,
+                                    args.exclude_invariant)
+        save_to_file(masked_sequences, args.out_alignment)
     finished_message()
 
 
@@ -51,130 +61,112 @@ def finished_message():
 
 
 def load_regions(filename, ref_name, multi):
+    """
+    Loads the reference-to-assembly regions from the TSV file (or its results store) in a single
+    pass. This pass also determines the reference name (if not given) and finds samples with
+    multiple results (for --multi exclude), discarding their regions.
+    """
     section_header('Loading input data')
     log(f'{filename}:')
-    ref_name = check_tsv_file(filename, ref_name)
-    data, distances, sample_names = {}, {}, set()
-    v_col, h_col, u_col = None, None, None
-    loaded_count = 0
-    excluded_samples = get_multi_result_samples(filename, ref_name) if multi == 'exclude' else set()
-    with open(filename, 'rt') as pairwise_file:
-        for i, line in enumerate(pairwise_file):
-            parts = line.strip('\n').split('\t')
-            if i == 0:
-                v_col = get_column_index(parts, 'assembly_a_vertical_regions', filename)
-                h_col = get_column_index(parts, 'assembly_a_horizontal_regions', filename)
-                u_col = get_column_index(parts, 'assembly_a_unaligned_regions', filename)
-                d_col = get_column_index(parts, 'mean_vertical_distance', filename)
-                continue
-            if parts[0] != ref_name:
+    auto_ref_name = ref_name is None
+    if auto_ref_name:  # an up-to-date TSV index can give the reference name without a full scan
+        indexed_names = get_indexed_assembly_a_names(filename)
+        if indexed_names is not None:
+            if len(indexed_names) != 1:
+                quit_with_auto_ref_name_error()
+            ref_name = indexed_names[0]
+    data, distances, multi_result_samples = {}, {}, set()
+    for results in iterate_results(filename, ['mean_vertical_distance'],
+                                   None if ref_name is None else {ref_name}, regions=True):
+        block_distances = results.get_column('mean_vertical_distance')
+        for row in range(len(results)):
+            assembly_a, assembly_name = results.get_names(row)
+            if ref_name is None:
+                ref_name = assembly_a
+            if assembly_a != ref_name:
+                if auto_ref_name:
+                    quit_with_auto_ref_name_error()
                 continue
-            assembly_name = parts[1]
-            if assembly_name in excluded_samples:
+            if assembly_name in data:  # seen this assembly already
+                multi_result_samples.add(assembly_name)
+            if multi == 'exclude' and assembly_name in multi_result_samples:
+                data.pop(assembly_name, None)
                 continue
-            distance = float(parts[d_col])
-            regions = load_regions_one_assembly(parts, v_col, h_col, u_col)
+            distance = block_distances[row]
             if assembly_name not in data:  # first time we've seen this assembly
                 distances[assembly_name] = distance
-                data[assembly_name] = regions
-                loaded_count += 1
-                sample_names.add(assembly_name)
-            else:  # seen this assembly already
-                if multi == 'first':
-                    pass
-                elif multi == 'low':
-                    if distance < distances[assembly_name]:
-                        distances[assembly_name] = distance
-                        data[assembly_name] = regions
-                elif multi == 'high':
-                    if distance > distances[assembly_name]:
-                        distances[assembly_name] = distance
-                        data[assembly_name] = regions
-                else:
-                    assert False
+                data[assembly_name] = load_regions_one_assembly(results.get_regions(row))
+            elif multi == 'first':
+                pass
+            elif multi == 'low':
+                if distance < distances[assembly_name]:
+                    distances[assembly_name] = distance
+                    data[assembly_name] = load_regions_one_assembly(results.get_regions(row))
+            elif multi == 'high':
+                if distance > distances[assembly_name]:
+                    distances[assembly_name] = distance
+                    data[assembly_name] = load_regions_one_assembly(results.get_regions(row))
+            else:
+                assert False
+    if ref_name is None:
+        quit_with_auto_ref_name_error()
+    if auto_ref_name:
+        log(f'  Automatically determined reference name: {ref_name}')
+    if multi == 'exclude' and multi_result_samples:
+        multi_result_samples_str = ', '.join(sorted(multi_result_samples))
+        warning(f'The following samples will be excluded due to secondary results: '
+                f'{multi_result_samples_str}')
     if len(data) == 0:
         sys.exit(f'Error: no reference-to-assembly pairwise comparisons found in {filename} - is '
                  f'the provided reference name correct?')
-    log(f'  {loaded_count} reference-to-assembly pairwise comparisons')
+    log(f'  {len(data)} reference-to-assembly pairwise comparisons')
     ref_length = get_ref_length(data)
     log()
-    return data, ref_name, ref_length, sorted(sample_names)
-
-
-def get_multi_result_samples(filename, ref_name):
-    samples, multi_result_samples = set(), set()
-    with open(filename, 'rt') as f:
-        for i, line in enumerate(f):
-            if i == 0:  # header line
-                continue
-            parts = line.strip('\n').split('\t')
-            assembly_a, assembly_b = parts[0], parts[1]
-            if assembly_a != ref_name:
-                continue
-            if assembly_b in samples:
-                multi_result_samples.add(assembly_b)
-            else:
-                samples.add(assembly_b)
-    if multi_result_samples:
-        multi_result_samples_str = ', '.join(sorted(multi_result_samples))
-        warning(f'The following samples will be excluded due to secondary results: '
-                f'{multi_result_samples_str}')
-    return multi_result_samples
-
-
-def check_tsv_file(filename, ref_name):
-    a_sample_names = set()
-    with open(filename, 'rt') as f:
-        for i, line in enumerate(f):
-            parts = line.strip('\n').split('\t')
-            if i == 0:  # header line
-                check_header_for_assembly_a_regions(parts, filename)
-            else:
-                a_sample_names.add(parts[0])
-    if ref_name is None:  # user didn't specify a reference name
-        if len(a_sample_names) == 1:
-            ref_name = list(a_sample_names)[0]
-            log(f'  Automatically determined reference name: {ref_name}')
-        else:
-            sys.exit('Error: could not automatically determine the reference name, please '
-                     'specify one using the --reference option.')
-    return ref_name
+    return data, ref_name, ref_length, sorted(data)
 
 
-def load_regions_one_assembly(parts, v_col, h_col, u_col):
-    contig_names = set()
+def quit_with_auto_ref_name_error():
+    sys.exit('Error: could not automatically determine the reference name, please specify one '
+             'using the --reference option.')
 
-    vertical_regions = parts[v_col].split(',') if parts[v_col] else []
-    contig_names |= {r.split(':')[0] for r in vertical_regions}
-    vertical_regions = [get_start_end(r) for r in vertical_regions]
 
-    horizontal_regions = parts[h_col].split(',') if parts[h_col] else []
-    contig_names |= {r.split(':')[0] for r in horizontal_regions}
-    horizontal_regions = [get_start_end(r) for r in horizontal_regions]
-
-    unaligned_regions = parts[u_col].split(',') if parts[u_col] else []
-    contig_names |= {r.split(':')[0] for r in unaligned_regions}
-    unaligned_regions = [get_start_end(r) for r in unaligned_regions]
+def load_regions_one_assembly(regions):
+    """
+    Takes one row's vertical, horizontal and unaligned regions (as dictionaries of contig name to
+    regions) and returns them as N×2 arrays of start/end positions.
+    """
+    vertical_regions, horizontal_regions, unaligned_regions = regions
 
+    contig_names = set(vertical_regions) | set(horizontal_regions) | set(unaligned_regions)
     if len(contig_names) > 1:
         contig_names_str = ', '.join(sorted(contig_names))
         sys.exit(f'Error: reference genome has more than one contig name ({contig_names_str})')
 
-    # Double check that the data makes sense - the entire reference sequence should be covered once.
-    all_regions = sorted(vertical_regions + horizontal_regions + unaligned_regions)
-    for i, r in enumerate(all_regions):
-        start, end = r
-        if i > 0:
-            prev_start, prev_end = all_regions[i-1]
-            assert start == prev_end
+    def get_raw_regions(regions_by_contig):
+        for regions in regions_by_contig.values():
+            return np.asarray(regions, dtype=np.int64).reshape(-1, 2)
+        return np.empty((0, 2), dtype=np.int64)
+    raw_regions = [get_raw_regions(r)
+                   for r in (vertical_regions, horizontal_regions, unaligned_regions)]
+    vertical, horizontal, unaligned = [IntervalSet.from_array(r) for r in raw_regions]
 
+    # Double check that the data makes sense - the entire reference sequence should be covered once.
+    # The lengths are totalled before the regions are merged, so overlapping regions in the same
+    # classification are caught too.
+    all_regions = vertical.union(horizontal, unaligned)
+    assert len(all_regions) <= 1 and (len(all_regions) == 0 or all_regions.starts[0] == 0)
+    assert all_regions.total_length() == sum(int(np.sum(r[:, 1] - r[:, 0])) for r in raw_regions)
+
+    vertical_regions = vertical.to_array()
+    horizontal_regions = horizontal.to_array()
+    unaligned_regions = unaligned.to_array()
     return vertical_regions, horizontal_regions, unaligned_regions
 
 
 def get_ref_length(data):
     ref_lengths = set()
-    for vertical_regions, horizontal_regions, unaligned_regions in data.values():
-        ref_length = max(r[1] for r in vertical_regions + horizontal_regions + unaligned_regions)
+    for regions in data.values():
+        ref_length = max(int(r[:, 1].max()) for r in regions if len(r) > 0)
         ref_lengths.add(ref_length)
     if len(ref_lengths) > 1:
         sys.exit('Error: multiple inconsistent reference sequence lengths')
@@ -191,8 +183,36 @@ def load_pseudo_alignment(filename, ref_name, tsv_sample_names):
         sequence_names.add(name)
         sequence_lengths.add(len(seq))
         alignment[name] = seq
+    in_both = check_pseudo_alignment(filename, ref_name, tsv_sample_names, sequence_names,
+                                     sequence_lengths)
+    return alignment, in_both
 
-    if len(alignment) == 0:
+
+def scan_pseudo_alignment(filename, ref_name, tsv_sample_names):
+    """
+    Does the same checks as load_pseudo_alignment, but only the reference sequence is kept in
+    memory. Returns the reference sequence, the sample names and the pseudo-alignment length.
+    """
+    ref_seq = None
+    log(f'{filename}:')
+    sequence_names, sequence_lengths = set(), set()
+    for name, seq in iterate_fasta(filename, preserve_case=True):
+        sequence_names.add(name)
+        sequence_lengths.add(len(seq))
+        if name == ref_name:
+            ref_seq = seq
+    in_both = check_pseudo_alignment(filename, ref_name, tsv_sample_names, sequence_names,
+                                     sequence_lengths)
+    return ref_seq, in_both, list(sequence_lengths)[0]
+
+
+def check_pseudo_alignment(filename, ref_name, tsv_sample_names, sequence_names,
+                           sequence_lengths):
+    """
+    Checks the pseudo-alignment's sequence names and lengths, returning the sample names which
+    are in both the TSV and pseudo-alignment files.
+    """
+    if len(sequence_names) == 0:
         sys.exit(f'Error: no sequences could be loaded from {filename}')
     log(f'  {len(sequence_names)} sequences loaded')
 
@@ -204,9 +224,8 @@ def load_pseudo_alignment(filename, ref_name, tsv_sample_names):
 
     if ref_name not in sequence_names:
         sys.exit(f'Error: could not find reference sequence ({ref_name}) in {filename}')
-    sequence_names.discard(ref_name)
+    sequence_names = sorted(sequence_names - {ref_name})
 
-    sequence_names = sorted(sequence_names)
     in_both, in_tsv_not_alignment, in_alignment_not_tsv = list_differences(tsv_sample_names,
                                                                            sequence_names)
     if len(in_both) == 0:
@@ -216,12 +235,16 @@ def load_pseudo_alignment(filename, ref_name, tsv_sample_names):
     else:
         log(f'{len(in_both)} sample names are common to both tsv and pseudo-alignment files')
     log()
-
-    return alignment, in_both
+    return in_both
 
 
 def mask_sequences(data, sequences, ref_name, ref_length, sample_names, h_char, u_char,
-                   image_filename, v_colour, h_colour, u_colour):
+                   image_filename, v_colour, h_colour, u_colour, threads=1):
+    """
+    Returns a dictionary of sequence name to masked sequence. The masked sequences are strings
+    when using one thread, but when using more, they are uint8 arrays and the samples are removed
+    from the sequences dictionary (see mask_sequences_in_parallel).
+    """
     section_header('Masking sequences')
     ref_seq = sequences[ref_name]
     ref_pos_to_align_pos = get_alignment_positions(ref_seq, ref_length)
@@ -233,13 +256,32 @@ def mask_sequences(data, sequences, ref_name, ref_length, sample_names, h_char,
     else:
         image = None
 
-    y_pos = 12
-    for sample_name in sample_names:
-        log(f'{sample_name.rjust(longest_sample_name_len)}:', end=' ')
-        masked_sequences[sample_name] = \
-            mask_one_sequence(data, sequences, sample_name, h_char, u_char, ref_pos_to_align_pos,
-                              ref_length, image, v_colour, h_colour, u_colour, y_pos)
-        y_pos += 12
+    # If only using a single thread, mask the sequences in a simple loop (easier for debugging).
+    if threads == 1:
+        y_pos = 12
+        for sample_name in sample_names:
+            log(f'{sample_name.rjust(longest_sample_name_len)}:', end=' ')
+            masked_sequences[sample_name] = \
+                mask_one_sequence(data, sequences, sample_name, h_char, u_char,
+                                  ref_pos_to_align_pos, ref_length, image, v_colour, h_colour,
+                                  u_colour, y_pos)
+            y_pos += 12
+
+    # If using multiple threads, the masking is done in a process pool but the image drawing and
+    # logging are still done here.
+    else:
+        y_pos = 12
+        parallel_results = mask_sequences_in_parallel(data, sequences, sample_names, h_char,
+                                                      u_char, ref_pos_to_align_pos, threads)
+        for sample_name, masked_seq, h_masked, u_masked in parallel_results:
+            log(f'{sample_name.rjust(longest_sample_name_len)}:', end=' ')
+            _, horizontal_regions, unaligned_regions = data[sample_name]
+            draw_sample(image, sample_name, horizontal_regions, unaligned_regions, h_char,
+                        u_char, ref_pos_to_align_pos, ref_length, v_colour, h_colour, u_colour,
+                        y_pos)
+            log(get_mask_log_message(ref_length, h_masked, u_masked, h_char, u_char))
+            masked_sequences[sample_name] = masked_seq
+            y_pos += 12
 
     if image_filename is not None:
         image.save()
@@ -250,61 +292,147 @@ def mask_sequences(data, sequences, ref_name, ref_length, sample_names, h_char,
 def mask_one_sequence(data, sequences, sample_name, h_char, u_char, ref_pos_to_align_pos,
                       ref_length, image, v_colour, h_colour, u_colour, y_pos):
     _, horizontal_regions, unaligned_regions = data[sample_name]
-    sample_seq = [b for b in sequences[sample_name]]
-    unmasked, h_masked, u_masked = ref_length, 0, 0
-    if image is not None:
-        image.add(image.text(sample_name, insert=(97, y_pos+4), style='text-anchor:end',
-                             font_size='12px'))
-        image.add(image.line((100, y_pos), (500, y_pos), stroke=v_colour, stroke_width=9))
+    sample_seq = np.frombuffer(sequences[sample_name].encode(), dtype=np.uint8).copy()
+    h_masked, u_masked = mask_sample_seq(sample_seq, horizontal_regions, unaligned_regions,
+                                         h_char, u_char, ref_pos_to_align_pos)
+    draw_sample(image, sample_name, horizontal_regions, unaligned_regions, h_char, u_char,
+                ref_pos_to_align_pos, ref_length, v_colour, h_colour, u_colour, y_pos)
+    log(get_mask_log_message(ref_length, h_masked, u_masked, h_char, u_char))
+    return sample_seq.tobytes().decode()
+
+
+def mask_sample_seq(sample_seq, horizontal_regions, unaligned_regions, h_char, u_char,
+                    ref_pos_to_align_pos):
+    """
+    Masks the sample sequence (a uint8 array) in-place, using one slice assignment per region.
+    Returns the number of reference bases masked as horizontal and unaligned.
+    """
+    h_masked, u_masked = 0, 0
     if h_char is not None:
-        for start, end in horizontal_regions:
-            unmasked -= (end - start)
-            h_masked += (end - start)
-            start, end = ref_pos_to_align_pos[start], ref_pos_to_align_pos[end]
-            for i in range(start, end):
-                sample_seq[i] = h_char
-            if image is not None:
-                image.add(image.line((100 + 400 * start / ref_length, y_pos),
-                                     (100 + 400 * end / ref_length, y_pos),
-                                     stroke=h_colour, stroke_width=9))
+        h_byte = ord(h_char)
+        for start, end in ref_pos_to_align_pos[horizontal_regions]:
+            sample_seq[start:end] = h_byte
+        h_masked = int(np.sum(horizontal_regions[:, 1] - horizontal_regions[:, 0]))
     if u_char is not None:
-        for start, end in unaligned_regions:
-            unmasked -= (end - start)
-            u_masked += (end - start)
-            start, end = ref_pos_to_align_pos[start], ref_pos_to_align_pos[end]
-            for i in range(start, end):
-                sample_seq[i] = u_char
-            if image is not None:
-                image.add(image.line((100 + 400 * start / ref_length, y_pos),
-                                     (100 + 400 * end / ref_length, y_pos),
-                                     stroke=u_colour, stroke_width=9))
+        u_byte = ord(u_char)
+        for start, end in ref_pos_to_align_pos[unaligned_regions]:
+            sample_seq[start:end] = u_byte
+        u_masked = int(np.sum(unaligned_regions[:, 1] - unaligned_regions[:, 0]))
+    return h_masked, u_masked
+
+
+def draw_sample(image, sample_name, horizontal_regions, unaligned_regions, h_char, u_char,
+                ref_pos_to_align_pos, ref_length, v_colour, h_colour, u_colour, y_pos):
+    if image is None:
+        return
+    image.add(image.text(sample_name, insert=(97, y_pos+4), style='text-anchor:end',
+                         font_size='12px'))
+    image.add(image.line((100, y_pos), (500, y_pos), stroke=v_colour, stroke_width=9))
+    for mask_char, regions, colour in ((h_char, horizontal_regions, h_colour),
+                                       (u_char, unaligned_regions, u_colour)):
+        if mask_char is None:
+            continue
+        for start, end in ref_pos_to_align_pos[regions]:
+            image.add(image.line((100 + 400 * start / ref_length, y_pos),
+                                 (100 + 400 * end / ref_length, y_pos),
+                                 stroke=colour, stroke_width=9))
+
+
+def get_mask_log_message(ref_length, h_masked, u_masked, h_char, u_char):
+    unmasked = ref_length - h_masked - u_masked
     log_message = f'{100.0 * unmasked/ref_length:6.2f}% unmasked'
     if h_char is not None:
         log_message += f', {100.0 * h_masked/ref_length:5.2f}% "{h_char}"'
     if u_char is not None:
         log_message += f', {100.0 * u_masked/ref_length:5.2f}% "{u_char}"'
-    log(log_message)
-    return ''.join(sample_seq)
+    return log_message
+
+
+def mask_sequences_in_parallel(data, sequences, sample_names, h_char, u_char,
+                               ref_pos_to_align_pos, threads):
+    """
+    Masks the samples using a process pool. The sequences, regions and reference-to-alignment
+    coordinate map are put in shared memory, and each worker masks its samples in-place in their
+    slots of the shared sequence buffer, only returning the masked counts.
+
+    To avoid holding the alignment more than once, each sample's sequence is removed from the
+    sequences dictionary as it is copied to shared memory, and the masked sequences are yielded as
+    uint8 array views of the shared buffer (decoded when saved, see get_seq_str).
+
+    Yields (sample name, masked sequence, horizontal masked count, unaligned masked count) tuples
+    in sample order.
+    """
+    alignment_length = len(sequences[sample_names[0]])
+    seq_buffer = RawArray(ctypes.c_uint8, max(1, len(sample_names) * alignment_length))
+    seq_matrix = get_shared_matrix(seq_buffer, np.uint8, alignment_length)
+    for i, sample_name in enumerate(sample_names):
+        seq_matrix[i] = np.frombuffer(sequences.pop(sample_name).encode(), dtype=np.uint8)
+
+    # The regions for all samples are stacked into one array, and each task gets its slot in the
+    # sequence buffer and the indices of its horizontal and unaligned regions.
+    all_regions, tasks, region_count = [], [], 0
+    for i, sample_name in enumerate(sample_names):
+        _, horizontal_regions, unaligned_regions = data[sample_name]
+        all_regions += [horizontal_regions, unaligned_regions]
+        h_end = region_count + len(horizontal_regions)
+        u_end = h_end + len(unaligned_regions)
+        tasks.append((i, region_count, h_end, u_end))
+        region_count = u_end
+    region_buffer = RawArray(ctypes.c_int64, 2 * max(1, region_count))
+    get_shared_matrix(region_buffer, np.int64, 2)[:region_count] = np.concatenate(all_regions)
+    map_buffer = RawArray(ctypes.c_int64, len(ref_pos_to_align_pos))
+    np.frombuffer(map_buffer, dtype=np.int64)[:] = ref_pos_to_align_pos
+
+    init_args = (seq_buffer, region_buffer, map_buffer, alignment_length, h_char, u_char)
+    with Pool(processes=threads, initializer=init_mask_worker, initargs=init_args) as pool:
+        for i, h_masked, u_masked in pool.imap(mask_one_sequence_in_worker, tasks):
+            yield sample_names[i], seq_matrix[i], h_masked, u_masked
+
+
+def get_shared_matrix(buffer, dtype, row_length):
+    return np.frombuffer(buffer, dtype=dtype).reshape(-1, row_length)
+
+
+mask_worker_data = {}
+
+
+def init_mask_worker(seq_buffer, region_buffer, map_buffer, alignment_length, h_char, u_char):
+    """
+    Stores NumPy views of the shared memory for use in mask_one_sequence_in_worker.
+    """
+    mask_worker_data['seq_matrix'] = get_shared_matrix(seq_buffer, np.uint8, alignment_length)
+    mask_worker_data['regions'] = get_shared_matrix(region_buffer, np.int64, 2)
+    mask_worker_data['ref_pos_to_align_pos'] = np.frombuffer(map_buffer, dtype=np.int64)
+    mask_worker_data['h_char'] = h_char
+    mask_worker_data['u_char'] = u_char
+
+
+def mask_one_sequence_in_worker(task):
+    i, h_start, h_end, u_end = task
+    regions = mask_worker_data['regions']
+    h_masked, u_masked = mask_sample_seq(mask_worker_data['seq_matrix'][i],
+                                         regions[h_start:h_end], regions[h_end:u_end],
+                                         mask_worker_data['h_char'], mask_worker_data['u_char'],
+                                         mask_worker_data['ref_pos_to_align_pos'])
+    return i, h_masked, u_masked
 
 
 def get_alignment_positions(aligned_ref_seq, ref_length):
     """
-    Returns a dictionary that translates reference positions to alignment positions. If the
-    alignment contains no insertions in the reference sequence, these two sets of positions will be
-    the same, but if there are insertions in the reference sequence, then the alignment positions
-    can be bigger than the reference positions.
-    """
-    positions = {}
-    ref_pos = 0
-    for alignment_pos, base in enumerate(aligned_ref_seq):
-        positions[ref_pos] = alignment_pos
-        if base != '-':
-            ref_pos += 1
-    positions[ref_pos] = len(aligned_ref_seq)
-    if ref_pos != ref_length:
+    Returns an array that translates reference positions to alignment positions. If the alignment
+    contains no insertions in the reference sequence, these two sets of positions will be the
+    same, but if there are insertions in the reference sequence, then the alignment positions can
+    be bigger than the reference positions.
+
+    The array has one more element than the reference length, so the end of a region can be
+    translated too.
+    """
+    gaps = np.frombuffer(aligned_ref_seq.encode(), dtype=np.uint8) == ord('-')
+    positions = np.flatnonzero(~gaps)
+    if len(positions) != ref_length:
         sys.exit('Error: length of reference sequence in alignment does not match length of '
                  'reference sequence in TSV file - have regions been masked with dashes?')
-    return positions
+    return np.append(positions, len(aligned_ref_seq)).astype(np.int64)
 
 
 def finalise(masked_sequences, ref_name, exclude_reference, exclude_invariant):
@@ -326,41 +454,147 @@ def save_to_file(masked_sequences, filename):
             if len(seq) == 0:
                 warning(f'excluded {name} due to empty sequence')
             else:
-                f.write(f'>{name}\n{seq}\n')
+                f.write(f'>{name}\n{get_seq_str(seq)}\n')
+    log()
+
+
+def mask_streaming(args, data, ref_name, ref_length, sample_names):
+    """
+    This is a low-memory alternative to masking the whole pseudo-alignment in memory. It makes two
+    passes: the first masks one sequence at a time, storing the results in a temporary file and
+    recording which bases occur in each alignment column. The second pass writes the final
+    alignment from the temporary file, dropping invariant columns if required.
+    """
+    ref_seq, sample_names, alignment_length = \
+        scan_pseudo_alignment(args.in_alignment, ref_name, sample_names)
+    output_names = ([] if args.exclude_reference else [ref_name]) + sample_names
+
+    # The temporary file goes next to the output file, because the default temporary directory is
+    # sometimes in RAM.
+    temp_dir = args.out_alignment.resolve().parent
+    with tempfile.TemporaryFile(dir=temp_dir) as temp_file:
+        record_indices, column_bits = \
+            mask_to_temp_file(args, data, ref_seq, ref_length, sample_names, output_names,
+                              alignment_length, temp_file)
+        columns_to_keep = finalise_columns(column_bits, args.exclude_invariant)
+        save_from_temp_file(temp_file, record_indices, output_names, alignment_length,
+                            columns_to_keep, args.out_alignment)
+
+
+def mask_to_temp_file(args, data, ref_seq, ref_length, sample_names, output_names,
+                      alignment_length, temp_file):
+    """
+    Masks each sequence as it is read from the pseudo-alignment and writes it to the temporary
+    file, one fixed-length record per sequence. Returns the record index for each sequence name
+    and the A/C/G/T bits for each alignment column (over the sequences which will be output).
+    """
+    section_header('Masking sequences')
+    ref_pos_to_align_pos = get_alignment_positions(ref_seq, ref_length)
+    longest_sample_name_len = max(len(s) for s in sample_names)
+    y_positions = {s: 12 * (i+1) for i, s in enumerate(sample_names)}
+    sample_names, output_names = set(sample_names), set(output_names)
+
+    if args.image is not None:
+        image = svgwrite.Drawing(args.image, profile='full')
+    else:
+        image = None
+
+    record_indices = {}
+    column_bits = np.zeros(alignment_length, dtype=np.uint8)
+    for name, seq in iterate_fasta(args.in_alignment, preserve_case=True):
+        if name in sample_names:
+            log(f'{name.rjust(longest_sample_name_len)}:', end=' ')
+            seq = mask_one_sequence(data, {name: seq}, name, args.h_char, args.u_char,
+                                    ref_pos_to_align_pos, ref_length, image, args.vertical_colour,
+                                    args.horizontal_colour, args.unaligned_colour,
+                                    y_positions[name])
+        if name not in output_names:
+            continue
+        seq = np.frombuffer(seq.encode(), dtype=np.uint8)
+        column_bits |= BASE_BITS[seq]
+        record_indices[name] = len(record_indices)
+        temp_file.write(seq.tobytes())
+
+    if image is not None:
+        image.save()
+    log()
+    return record_indices, column_bits
+
+
+def finalise_columns(column_bits, exclude_invariant):
+    """
+    The streaming equivalent of finalise: returns a boolean array of which alignment columns to
+    keep (or None to keep all of them).
+    """
+    section_header('Finalising sequences')
+    if exclude_invariant:
+        columns_to_keep = get_variant_columns(column_bits)
+        alignment_length = int(np.count_nonzero(columns_to_keep))
+    else:
+        columns_to_keep = None
+        alignment_length = len(column_bits)
+    log(f'Final pseudo-alignment length: {alignment_length}')
+    log()
+    return columns_to_keep
+
+
+def save_from_temp_file(temp_file, record_indices, output_names, alignment_length,
+                        columns_to_keep, filename):
+    log(f'Saving masked pseudo-alignment to {filename}')
+    with open(filename, 'wt') as f:
+        for name in output_names:
+            temp_file.seek(record_indices[name] * alignment_length)
+            seq = np.frombuffer(temp_file.read(alignment_length), dtype=np.uint8)
+            if columns_to_keep is not None:
+                seq = seq[columns_to_keep]
+            if len(seq) == 0:
+                warning(f'excluded {name} due to empty sequence')
+            else:
+                f.write(f'>{name}\n{seq.tobytes().decode()}\n')
     log()
 
 
 def drop_invariant_positions(sequences):
     """
     Returns an alignment where any columns that lack variation are removed.
+
+    The alignment is loaded into a 2D uint8 matrix (one row per sequence) so the A/C/G/T bits for
+    each column can be combined with vectorised operations.
     """
     alignment_length = get_alignment_length(sequences)
-    positions_to_remove = set()
-    a, c, g, t, n = 0, 0, 0, 0, 0
-    for i in range(alignment_length):
-        bases_at_pos = {seq[i] for seq in sequences.values()}
-        real_base_count = count_real_bases(bases_at_pos)
-        if real_base_count == 1:
-            positions_to_remove.add(i)
-            if 'A' in bases_at_pos or 'a' in bases_at_pos:
-                a += 1
-            elif 'C' in bases_at_pos or 'c' in bases_at_pos:
-                c += 1
-            elif 'G' in bases_at_pos or 'g' in bases_at_pos:
-                g += 1
-            elif 'T' in bases_at_pos or 't' in bases_at_pos:
-                t += 1
-            else:
-                assert False
-        elif real_base_count == 0:
-            positions_to_remove.add(i)
-            n += 1
-    assert a + c + g + t + n == len(positions_to_remove)
-    if not positions_to_remove:
+    matrix = np.empty((len(sequences), alignment_length), dtype=np.uint8)
+    column_bits = np.zeros(alignment_length, dtype=np.uint8)
+    for i, seq in enumerate(sequences.values()):
+        matrix[i] = get_seq_array(seq)
+        column_bits |= BASE_BITS[matrix[i]]
+    variant_columns = get_variant_columns(column_bits)
+    if np.all(variant_columns):
+        return sequences
+    matrix = matrix[:, variant_columns]
+    return {name: matrix[i].tobytes().decode() for i, name in enumerate(sequences)}
+
+
+def get_variant_columns(column_bits):
+    """
+    Takes the A/C/G/T bits for each alignment column (see BASE_BITS) and returns a boolean array
+    which is True for the columns with more than one real base. The invariant columns are logged,
+    grouped by their base.
+    """
+    base_counts = BIT_COUNTS[column_bits]
+    variant_columns = base_counts > 1
+    n = int(np.count_nonzero(base_counts == 0))
+    a, c, g, t = (int(np.count_nonzero(column_bits == b)) for b in (1, 2, 4, 8))
+    log_invariant_positions(a, c, g, t, n, len(column_bits))
+    return variant_columns
+
+
+def log_invariant_positions(a, c, g, t, n, alignment_length):
+    removed_count = a + c + g + t + n
+    if removed_count == 0:
         log(f'no invariant positions removed from pseudo-alignment')
     else:
-        percentage = 100.0 * len(positions_to_remove)/alignment_length
-        log(f'{len(positions_to_remove):,} invariant positions ({percentage:.3}%) removed from '
+        percentage = 100.0 * removed_count/alignment_length
+        log(f'{removed_count:,} invariant positions ({percentage:.3}%) removed from '
             f'pseudo-alignment:')
         log(f'  {a:9,} × A')
         log(f'  {c:9,} × C')
@@ -368,7 +602,20 @@ def drop_invariant_positions(sequences):
         log(f'  {t:9,} × T')
         log(f'  {n:9,} × other')
     log()
-    return drop_positions(sequences, positions_to_remove)
+
+
+def get_seq_array(seq):
+    """
+    Returns a sequence (a string or a uint8 array) as a uint8 array.
+    """
+    return np.frombuffer(seq.encode(), dtype=np.uint8) if isinstance(seq, str) else seq
+
+
+def get_seq_str(seq):
+    """
+    Returns a sequence (a string or a uint8 array) as a string.
+    """
+    return seq if isinstance(seq, str) else seq.tobytes().decode()
 
 
 def get_alignment_length(sequences):
@@ -377,24 +624,17 @@ def get_alignment_length(sequences):
     return list(alignment_lengths)[0]
 
 
-def drop_positions(sequences, positions_to_remove):
-    if len(positions_to_remove) == 0:
-        return sequences
-    new_sequences = {}
-    for name, seq in sequences.items():
-        new_seq = ''.join(b for i, b in enumerate(seq) if i not in positions_to_remove)
-        new_sequences[name] = new_seq
-    return new_sequences
-
-
-def count_real_bases(base_set):
-    count = 0
-    if 'A' in base_set or 'a' in base_set:
-        count += 1
-    if 'C' in base_set or 'c' in base_set:
-        count += 1
-    if 'G' in base_set or 'g' in base_set:
-        count += 1
-    if 'T' in base_set or 't' in base_set:
-        count += 1
-    return count
+def get_base_bits():
+    """
+    Returns a lookup table which converts a sequence character (as a uint8) to a bit flag for its
+    base: A=1, C=2, G=4, T=8 (case insensitive) and 0 for anything else (gaps, N, etc).
+    """
+    base_bits = np.zeros(256, dtype=np.uint8)
+    for i, base in enumerate('ACGT'):
+        base_bits[ord(base)] = 1 << i
+        base_bits[ord(base.lower())] = 1 << i
+    return base_bits
+
+
+BASE_BITS = get_base_bits()
+BIT_COUNTS = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
@@ -14,28 +14,43 @@ If not, see <https://www.gnu.org/licenses/>.
 """
 
 import collections
-import itertools
+import heapq
 import math
+import numpy as np
+import pathlib
 import sys
 
 from .log import log, section_header, explanation, warning
-from .misc import check_file_exists, get_open_func
-from .tsv import get_column_index
+from .misc import check_file_exists
+from .tree import save_tree
+from .tsv import iterate_results
 
 
 def matrix(args):
     welcome_message()
-    distances, sample_names = load_tsv_file(args.in_file, args.distance_type)
-    distances, sample_names = resolve_multi_distances(distances, sample_names, args.multi)
-    if args.include_names is not None:
-        sample_names = include_names(sample_names, args.include_names)
-    if args.exclude_names is not None:
-        sample_names = exclude_names(sample_names, args.exclude_names)
-    if not args.no_jukes_cantor:
-        jukes_cantor_correction(distances, sample_names)
-    if not args.asymmetrical:
-        make_symmetrical(distances, sample_names)
-    save_matrix(args.out_file, distances, sample_names)
+    pairs, all_sample_names = load_distances(args.in_file, args.distance_type)
+    a_indices, b_indices, all_distances = pairs
+    corrections = get_corrections(args.out_file, args.no_jukes_cantor)
+    for distance_type in args.distance_type:
+        distances, sample_names = \
+            resolve_multi_distances((a_indices, b_indices, all_distances[distance_type]),
+                                    all_sample_names, args.multi)
+        if args.include_names is not None:
+            sample_names = include_names(sample_names, args.include_names)
+        if args.exclude_names is not None:
+            sample_names = exclude_names(sample_names, args.exclude_names)
+        distances = distances.subset(sample_names)
+        for correction in corrections:
+            corrected = DistanceMatrix(sample_names, distances.values.copy())
+            if correction == 'jukes_cantor':
+                jukes_cantor_correction(corrected)
+            if not args.asymmetrical:
+                make_symmetrical(corrected)
+            save_matrix(get_out_filename(args.out_file, distance_type, correction), corrected,
+                        out_format=args.out_format)
+            if args.tree is not None:
+                save_tree(get_out_filename(args.tree, distance_type, correction), sample_names,
+                          corrected.values, args.tree_method)
     finished_message()
 
 
@@ -52,72 +67,186 @@ def finished_message():
                 'phylogeny from the distance matrix.')
 
 
+def get_corrections(out_file, no_jukes_cantor):
+    """
+    Returns the corrections to output: both if the output filename has a place for it, otherwise
+    just the one chosen by --no_jukes_cantor.
+    """
+    if '{correction}' in str(out_file):
+        return ['jukes_cantor', 'uncorrected']
+    elif no_jukes_cantor:
+        return ['uncorrected']
+    else:
+        return ['jukes_cantor']
+
+
+def get_out_filename(out_file, distance_type, correction):
+    """
+    Fills in the {distance_type} and {correction} parts of the output filename (if present).
+    """
+    out_file = str(out_file).replace('{distance_type}', distance_type)
+    out_file = out_file.replace('{correction}', correction)
+    return pathlib.Path(out_file)
+
+
+class DistanceMatrix(object):
+    """
+    This class holds a square distance matrix as an N×N NumPy array, where rows are assembly_a,
+    columns are assembly_b and missing distances are NaN. Distances can be accessed by name, e.g.
+    distances[('a', 'b')], which gives None for missing distances.
+    """
+    def __init__(self, sample_names, values=None):
+        self.sample_names = list(sample_names)
+        self.indices = {name: i for i, name in enumerate(self.sample_names)}
+        if values is None:
+            values = np.full((len(self.sample_names), len(self.sample_names)), np.nan)
+        assert values.shape == (len(self.sample_names), len(self.sample_names))
+        self.values = values
+
+    def __getitem__(self, pair):
+        a, b = pair
+        distance = self.values[self.indices[a], self.indices[b]]
+        return None if np.isnan(distance) else float(distance)
+
+    def __setitem__(self, pair, distance):
+        a, b = pair
+        self.values[self.indices[a], self.indices[b]] = np.nan if distance is None else distance
+
+    def __len__(self):
+        return len(self.sample_names)
+
+    def subset(self, sample_names):
+        """
+        Returns a new DistanceMatrix with only the given samples (in the given order).
+        """
+        indices = np.array([self.indices[name] for name in sample_names], dtype=np.int64)
+        return DistanceMatrix(sample_names, self.values[np.ix_(indices, indices)])
+
+    def get_missing(self):
+        """
+        Returns a boolean N×N array which is True for missing distances.
+        """
+        return np.isnan(self.values)
+
+
 def load_tsv_file(filename, distance_type):
+    """
+    Loads one type of distance from the TSV file, returning three parallel arrays (assembly_a
+    indices, assembly_b indices and distances) in file order, along with the sorted sample names
+    that the indices refer to. Missing distances are NaN, and a zero distance is added for each
+    sample to itself.
+    """
+    (a_indices, b_indices, distances), sample_names = load_distances(filename, [distance_type])
+    return (a_indices, b_indices, distances[distance_type]), sample_names
+
+
+def load_distances(filename, distance_types):
+    """
+    Loads one or more types of distance from the TSV file (or its results store) in a single pass.
+    This is the same as load_tsv_file, except that the distances are a dictionary of distance type
+    to array.
+    """
     check_file_exists(filename)
-    distances, sample_names = collections.defaultdict(list), set()
-    column_index = None
-    with get_open_func(filename)(filename, 'rt') as f:
-        for i, line in enumerate(f):
-            parts = line.strip('\n').split('\t')
-            if i == 0:  # header line
-                column_index = get_column_index(parts, distance_type + '_distance', filename)
-            else:
-                assembly_a, assembly_b = parts[0], parts[1]
-                distance = get_distance_from_line_parts(parts, column_index)
-                sample_names.add(assembly_a)
-                sample_names.add(assembly_b)
-                distances[(assembly_a, assembly_b)].append(distance)
-    sample_names = sorted(sample_names)
-    log(f'{len(distances)} distances loaded for {len(sample_names)} assemblies')
-    for sample_name in sample_names:
-        distances[(sample_name, sample_name)].append(0.0)
+    name_indices = {}
+    a_blocks, b_blocks, distance_blocks = [], [], []
+    columns = [t + '_distance' for t in distance_types]
+    for results in iterate_results(filename, columns):
+        block_indices = np.array([name_indices.setdefault(n, len(name_indices))
+                                  for n in results.sample_names], dtype=np.int64)
+        a_blocks.append(block_indices[results.a_indices])
+        b_blocks.append(block_indices[results.b_indices])
+        distance_blocks.append(results.values)
+    sample_names = sorted(name_indices)
+    a_indices, b_indices = sort_name_indices(name_indices, sample_names,
+                                             np.concatenate(a_blocks + [np.empty(0, np.int64)]),
+                                             np.concatenate(b_blocks + [np.empty(0, np.int64)]))
+    all_distances = np.concatenate(distance_blocks + [np.empty((0, len(columns)))])
+
+    pair_count = len(np.unique(a_indices * len(sample_names) + b_indices))
+    log(f'{pair_count} distances loaded for {len(sample_names)} assemblies')
+    self_indices = np.arange(len(sample_names), dtype=np.int64)
+    a_indices = np.concatenate([a_indices, self_indices])
+    b_indices = np.concatenate([b_indices, self_indices])
+    distances = {t: np.concatenate([all_distances[:, i], np.zeros(len(sample_names))])
+                 for i, t in enumerate(distance_types)}
     log()
-    return distances, sorted(sample_names)
+    return (a_indices, b_indices, distances), sample_names
 
 
-def resolve_multi_distances(distances, sample_names, multi):
+def sort_name_indices(name_indices, sample_names, a_indices, b_indices):
+    """
+    Converts sample indices from order of appearance (as given by name_indices) to the order of
+    the sorted sample names.
+    """
+    new_indices = np.empty(len(sample_names), dtype=np.int64)
+    new_indices[[name_indices[name] for name in sample_names]] = np.arange(len(sample_names))
+    return new_indices[a_indices], new_indices[b_indices]
+
+
+def resolve_multi_distances(pairs, sample_names, multi):
     section_header('Resolving multi-distance pairs')
     explanation('Some pairs may have more than one result in the TSV file, so this step reduces '
                 'each pair to a single distance using the logic chosen by the --multi option.')
 
-    multi_distance_pairs = set(p for p, d in distances.items() if len(d) > 1)
-    log(f'Multi-distance pairs: {len(multi_distance_pairs)} / {len(distances)}')
+    # Each pair is given a key which is its index in the flattened N×N matrix.
+    a_indices, b_indices, distances = pairs
+    keys = a_indices * len(sample_names) + b_indices
+    unique_keys, first_indices, counts = np.unique(keys, return_index=True, return_counts=True)
+    multi_distance_keys = unique_keys[counts > 1]
+    log(f'Multi-distance pairs: {len(multi_distance_keys)} / {len(unique_keys)}')
     log()
-    if len(multi_distance_pairs) == 0:
+
+    matrix = DistanceMatrix(sample_names)
+    flat_values = matrix.values.reshape(-1)  # a view, so changes go into the matrix
+    if len(multi_distance_keys) == 0:
         log('No resolution required')
-        distances = {p: d[0] for p, d in distances.items()}
+        flat_values[unique_keys] = distances[first_indices]
     elif multi == 'first':
         log('Resolving using TSV file order (keeping the first distance for each pair)')
-        distances = {p: d[0] for p, d in distances.items()}
+        flat_values[unique_keys] = distances[first_indices]
     elif multi == 'exclude':
         log('Resolving by excluding samples in multi-distance pairs')
-        distances, sample_names = exclude_multi_distances(distances, multi_distance_pairs)
+        flat_values[unique_keys] = distances[first_indices]
+        multi_distance_pairs = {(sample_names[k // len(sample_names)],
+                                 sample_names[k % len(sample_names)])
+                                for k in multi_distance_keys.tolist()}
+        matrix, sample_names = exclude_multi_distances(matrix, multi_distance_pairs)
     elif multi == 'low':
         log('Resolving to minimum (keeping the lowest distance for each pair)')
-        distances = {p: min(d) for p, d in distances.items()}
+        np.fmin.at(flat_values, keys, distances)
     elif multi == 'high':
         log('Resolving to maximum (keeping the highest distance for each pair)')
-        distances = {p: max(d) for p, d in distances.items()}
+        np.fmax.at(flat_values, keys, distances)
     else:
         assert False
     log()
-    return distances, sample_names
+    return matrix, sample_names
 
 
 def exclude_multi_distances(distances, multi_distance_pairs):
-    counts = collections.defaultdict(int)
-    for assembly_a, assembly_b in multi_distance_pairs:
+    """
+    Greedily excludes samples (most multi-result pairs first, ties broken by name) until no
+    multi-result pairs remain. Each sample has a set of its own pairs, so excluding a sample only
+    touches those pairs.
+    """
+    counts, sample_pairs = collections.defaultdict(int), collections.defaultdict(set)
+    for pair in multi_distance_pairs:
+        assembly_a, assembly_b = pair
         counts[assembly_a] += 1
         counts[assembly_b] += 1
-    counts = sorted(counts.items(), key=lambda x: (1.0/x[1], x[0]))
+        sample_pairs[assembly_a].add(pair)
+        sample_pairs[assembly_b].add(pair)
+    queue = [(-count, assembly) for assembly, count in counts.items()]
+    heapq.heapify(queue)
 
     excluded_samples, excluded_logs = set(), []
-    for assembly, count in counts:
+    remaining_pairs = set(multi_distance_pairs)
+    while queue:
+        count, assembly = heapq.heappop(queue)
         excluded_samples.add(assembly)
-        excluded_logs.append(f'  {assembly} (in {count} multi-result pairs)')
-        multi_distance_pairs = {p for p in multi_distance_pairs
-                                if p[0] != assembly and p[1] != assembly}
-        if len(multi_distance_pairs) == 0:
+        excluded_logs.append(f'  {assembly} (in {-count} multi-result pairs)')
+        remaining_pairs.difference_update(sample_pairs[assembly])
+        if len(remaining_pairs) == 0:
             break
 
     log()
@@ -125,31 +254,12 @@ def exclude_multi_distances(distances, multi_distance_pairs):
     for excluded_log in excluded_logs:
         log(excluded_log)
 
-    new_distances, new_sample_names = {}, set()
-    for pair, distance_list in distances.items():
-        assembly_a, assembly_b = pair
-        if assembly_a not in excluded_samples and assembly_b not in excluded_samples:
-            assert len(distance_list) == 1
-            new_distances[(assembly_a, assembly_b)] = distance_list[0]
-            new_sample_names.add(assembly_a)
-            new_sample_names.add(assembly_b)
+    new_sample_names = [s for s in distances.sample_names if s not in excluded_samples]
+    distances = distances.subset(new_sample_names)
+    distance_count = np.count_nonzero(~distances.get_missing())
     log()
-    log(f'{len(new_sample_names)} samples ({len(new_distances)} distances) remain')
-    return new_distances, sorted(new_sample_names)
-
-
-def get_distance_from_line_parts(parts, column_index):
-    try:
-        distance = parts[column_index]
-    except IndexError:
-        sys.exit(f'Error: column {column_index+1} missing from TSV file')
-    try:
-        if distance == '':
-            return None
-        else:
-            return float(distance)
-    except ValueError:
-        sys.exit(f'Error: could not convert {distance} to a number')
+    log(f'{len(new_sample_names)} samples ({distance_count} distances) remain')
+    return distances, new_sample_names
 
 
 def include_names(all_names, names_to_include):
@@ -175,49 +285,80 @@ def exclude_names(all_names, names_to_exclude):
     return sorted(filtered_names)
 
 
-def check_for_missing_distances(distances, sample_names):
+def check_for_missing_distances(distances):
     """
-    Fills in any missing distances in the matrix with None.
+    Returns True if any distances in the matrix are missing.
     """
-    for sample_a in sample_names:
-        for sample_b in sample_names:
-            if (sample_a, sample_b) not in distances:
-                distances[(sample_a, sample_b)] = None
+    return bool(np.any(distances.get_missing()))
 
 
-def save_matrix(filename, distances, sample_names, silent=False):
+def save_matrix(filename, distances, silent=False, out_format='square'):
     if not silent:
         section_header('Saving matrix to file')
         log(f'{filename.resolve()}')
-    missing_distances = False
-    with open(filename, 'wt') as f:
-        f.write(str(len(sample_names)))
-        f.write('\n')
-        for a in sample_names:
-            f.write(a)
-            for b in sample_names:
-                distance = distances[(a, b)] if (a, b) in distances else None
-                if distance is None:
-                    distance = ''
-                    missing_distances = True
-                else:
-                    distance = f'{distance:.9f}'
-                f.write(f'\t{distance}')
-            f.write('\n')
+    if out_format == 'npy':
+        save_npy_matrix(filename, distances)
+    else:
+        save_phylip_matrix(filename, distances, lower_triangle=(out_format == 'lower'))
     if not silent:
         log()
-        if missing_distances:
+        if check_for_missing_distances(distances):
             warning('one or more distances are missing resulting in an incomplete matrix')
 
 
-def jukes_cantor_correction(distances, sample_names):
+def save_phylip_matrix(filename, distances, lower_triangle=False):
+    """
+    Saves the matrix in PHYLIP format, either square or lower-triangular (each row only has the
+    distances to the samples before it). Each row is formatted in one go, except for rows with
+    missing distances which are left blank.
+    """
+    with open(filename, 'wt') as f:
+        f.write(f'{len(distances)}\n')
+        for i, (name, row) in enumerate(zip(distances.sample_names, distances.values)):
+            if lower_triangle:
+                row = row[:i]
+            f.write(name)
+            f.write(format_matrix_row(row))
+            f.write('\n')
+
+
+def format_matrix_row(row):
+    if not np.isnan(row).any():
+        return ('\t%.9f' * len(row)) % tuple(row.tolist())
+    return ''.join('\t' if math.isnan(d) else f'\t{d:.9f}' for d in row.tolist())
+
+
+def save_npy_matrix(filename, distances):
+    """
+    Saves the matrix as a binary NumPy array (missing distances are NaN), with the sample names
+    (one per line, in matrix order) in a sidecar file.
+    """
+    with open(filename, 'wb') as f:
+        np.save(f, distances.values)
+    with open(get_names_filename(filename), 'wt') as f:
+        for name in distances.sample_names:
+            f.write(f'{name}\n')
+
+
+def get_names_filename(filename):
+    """
+    Returns the filename of the sample names sidecar for a .npy matrix, e.g. matrix.npy ->
+    matrix.names.txt.
+    """
+    return filename.with_suffix('.names.txt')
+
+
+def jukes_cantor_correction(distances):
     """
-    Applies Jukes-Cantor correction in-place to the entire distance matrix.
+    Applies Jukes-Cantor correction in-place to the entire distance matrix. This is a vectorised
+    version of the jukes_cantor function.
     """
-    for a in sample_names:
-        for b in sample_names:
-            if (a, b) in distances:
-                distances[(a, b)] = jukes_cantor(distances[(a, b)])
+    d = distances.values
+    with np.errstate(invalid='ignore', divide='ignore'):
+        corrected = -0.75 * np.log(1.0 - 1.3333333333333 * d)
+    corrected[d == 0.0] = 0.0
+    corrected[d >= 0.75] = 25.0
+    distances.values[:] = corrected
 
 
 def jukes_cantor(d):
@@ -234,20 +375,12 @@ def jukes_cantor(d):
     return -0.75 * math.log(1.0 - 1.3333333333333 * d)
 
 
-def make_symmetrical(distances, sample_names):
+def make_symmetrical(distances):
     """
-    Makes the distance matrix symmetrical, changing it in-place.
+    Makes the distance matrix symmetrical, changing it in-place. Each pair is set to the mean of
+    its two distances, or to whichever one is present if the other is missing.
     """
-    for a, b in itertools.combinations(sample_names, 2):
-        d1 = distances[(a, b)] if (a, b) in distances else None
-        d2 = distances[(b, a)] if (b, a) in distances else None
-        if d1 is not None and d2 is not None:
-            mean_distance = (d1 + d2) / 2.0
-        elif d1 is None and d2 is None:
-            mean_distance = None
-        elif d1 is None:
-            mean_distance = d2
-        else:
-            mean_distance = d1
-        distances[(a, b)] = mean_distance
-        distances[(b, a)] = mean_distance
+    d = distances.values
+    d_t = d.T
+    symmetrical = np.where(np.isnan(d) | np.isnan(d_t), np.fmax(d, d_t), (d + d_t) / 2.0)
+    distances.values[:] = symmetrical
@@ -216,3 +216,21 @@ def get_difference_count(cigar):
     Returns the number of mismatches and indels in the CIGAR.
     """
     return cigar.count('X') + cigar.count('I') + cigar.count('D')
+
+
+# The types of distance in a pairwise TSV file which can be used by Verticall matrix.
+DISTANCE_TYPES = ['mean', 'mean_window', 'median_window', 'peak_window', 'mean_vertical_window',
+                  'median_vertical_window', 'mean_vertical']
+
+
+def check_hex_colour(colour):
+    if len(colour) != 7:
+        return False
+    if colour[0] != '#':
+        return False
+    colour = colour.lower()
+    good_chars = {'0', '1', '2', '3', '4', '5', '6', '7', '8', '9', 'a', 'b', 'c', 'd', 'e', 'f'}
+    for i in range(1, 7):
+        if colour[i] not in good_chars:
+            return False
+    return True
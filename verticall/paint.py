@@ -17,6 +17,7 @@ If not, see <https://www.gnu.org/licenses/>.
 import enum
 
 from .distance import get_vertical_horizontal_distributions, get_distance
+from .intervals import IntervalSet, format_interval_sets
 from .misc import iterate_fasta, get_difference_count
 
 
@@ -126,10 +127,8 @@ class PaintedAssembly(object):
         total, vertical, horizontal = 0, 0, 0
         for c in self.contigs.values():
             total += c.length
-            for start, end in c.get_vertical_blocks():
-                vertical += (end - start)
-            for start, end in c.get_horizontal_blocks():
-                horizontal += (end - start)
+            vertical += c.get_vertical_intervals().total_length()
+            horizontal += c.get_horizontal_intervals().total_length()
         unaligned = total - vertical - horizontal
         if total == 0:
             return 0.0, 0.0, 0.0
@@ -139,31 +138,27 @@ class PaintedAssembly(object):
         """
         Returns a string encoding the vertical, horizontal and unaligned regions of the assembly.
         """
-        vertical, horizontal, unaligned = [], [], []
-        for name, c in self.contigs.items():
-            for start, end in c.get_vertical_blocks():
-                vertical.append(f'{name}:{start}-{end}')
-            for start, end in c.get_horizontal_blocks():
-                horizontal.append(f'{name}:{start}-{end}')
-            for start, end in c.get_unaligned_blocks():
-                unaligned.append(f'{name}:{start}-{end}')
-        return ','.join(vertical), ','.join(horizontal), ','.join(unaligned)
+        return (format_interval_sets({n: c.get_vertical_intervals()
+                                      for n, c in self.contigs.items()}),
+                format_interval_sets({n: c.get_horizontal_intervals()
+                                      for n, c in self.contigs.items()}),
+                format_interval_sets({n: c.get_unaligned_intervals()
+                                      for n, c in self.contigs.items()}))
 
 
 class PaintedContig(object):
 
     def __init__(self, seq):
         self.length = len(seq)
-        self.paint = [0] * self.length  # 0 means unaligned
         self.alignment_points = []
-        self.vertical_blocks = None
-        self.horizontal_blocks = None
-        self.unaligned_blocks = None
+        self.vertical_ranges, self.horizontal_ranges = [], []
+        self.vertical_intervals = None
+        self.horizontal_intervals = None
+        self.unaligned_intervals = None
 
     def add_alignment(self, a, role):
         cigar_to_seq = a.cigar_to_query if role == AlignmentRole.QUERY else a.cigar_to_target
         points = []
-        vertical_ranges, horizontal_ranges = [], []
         for i, window in enumerate(a.windows_no_overlap):
             differences = a.window_differences[i]
             classification = a.window_classifications[i]
@@ -178,23 +173,16 @@ class PaintedContig(object):
             points.append((seq_centre, differences))
 
             if classification == 1:  # 1 means vertical
-                vertical_ranges.append((seq_start, seq_end))
+                self.vertical_ranges.append((seq_start, seq_end))
             elif classification == 2:  # 2 means vertical
-                horizontal_ranges.append((seq_start, seq_end))
+                self.horizontal_ranges.append((seq_start, seq_end))
             else:
                 assert False
 
-        # Both vertical (1) and horizontal (2) paint over unaligned (3), and vertical paints over
-        # horizontal. I.e. vertical takes precedence, then horizontal, then unaligned.
-        for start, end in horizontal_ranges:
-            for i in range(start, end):
-                if self.paint[i] != 1:  # 1 means vertical
-                    self.paint[i] = 2  # 2 means horizontal
-        for start, end in vertical_ranges:
-            for i in range(start, end):
-                self.paint[i] = 1  # 1 means vertical
-
         self.alignment_points.append(points)
+        self.vertical_intervals = None
+        self.horizontal_intervals = None
+        self.unaligned_intervals = None
 
     def get_max_differences(self):
         max_differences = 0
@@ -204,42 +192,41 @@ class PaintedContig(object):
                 max_differences = max(max_differences, max(differences))
         return max_differences
 
+    # Both vertical and horizontal paint over unaligned, and vertical paints over horizontal. I.e.
+    # vertical takes precedence, then horizontal, then unaligned.
+
+    def get_vertical_intervals(self):
+        if self.vertical_intervals is None:
+            self.vertical_intervals = IntervalSet.from_array(self.vertical_ranges)
+        return self.vertical_intervals
+
+    def get_horizontal_intervals(self):
+        if self.horizontal_intervals is None:
+            horizontal = IntervalSet.from_array(self.horizontal_ranges)
+            self.horizontal_intervals = horizontal.difference(self.get_vertical_intervals())
+        return self.horizontal_intervals
+
+    def get_unaligned_intervals(self):
+        if self.unaligned_intervals is None:
+            aligned = self.get_vertical_intervals().union(self.get_horizontal_intervals())
+            self.unaligned_intervals = aligned.complement(self.length)
+        return self.unaligned_intervals
+
     def get_vertical_blocks(self):
         """
         Returns a list of all ranges of the contig which have been painted as vertical.
         """
-        if self.vertical_blocks is None:
-            self.vertical_blocks = get_blocks(self.paint, 1)  # 1 means vertical
-        return self.vertical_blocks
+        return self.get_vertical_intervals().to_list()
 
     def get_horizontal_blocks(self):
         """
         Returns a list of all ranges of the contig which have been painted as horizontal.
         """
-        if self.horizontal_blocks is None:
-            self.horizontal_blocks = get_blocks(self.paint, 2)  # 2 means horizontal
-        return self.horizontal_blocks
+        return self.get_horizontal_intervals().to_list()
 
     def get_unaligned_blocks(self):
         """
         Returns a list of all ranges of the contig which have been painted as unaligned.
         """
-        if self.unaligned_blocks is None:
-            self.unaligned_blocks = get_blocks(self.paint, 0)  # 0 means unaligned
-        return self.unaligned_blocks
-
-
-def get_blocks(paint, classification):
-    blocks = []
-    start, end = None, None
-    for i, c in enumerate(paint):
-        if c == classification:
-            if start is None:
-                start = i
-            end = i + 1
-        elif start is not None:
-            blocks.append((start, end))
-            start, end = None, None
-    if start is not None:
-        blocks.append((start, end))
-    return blocks
+        return self.get_unaligned_intervals().to_list()
+
@@ -14,31 +14,85 @@ details. You should have received a copy of the GNU General Public License along
 If not, see <https://www.gnu.org/licenses/>.
 """
 
+import functools
 from multiprocessing import Pool
 import sys
 
 from .alignment import build_indices, align_sample_pair
+from .database import ResultsDatabase, is_results_database
 from .distance import get_distribution, smooth_distribution, get_peak_distance
+from .instrument import PairStats, time_stage, format_record
 from .log import log, section_header, explanation, warning
-from .misc import split_list, iterate_fasta, contains_ambiguous_bases, check_file_exists
+from .misc import split_list, iterate_fasta, contains_ambiguous_bases, check_file_exists, \
+    get_compression_type
 from .paint import paint_alignments, paint_assemblies
+from .profiling import profile_run, init_profiled_worker
+from .tsv import build_tsv_index, build_results_store, get_result_pairs, is_tsv_index_current, \
+    is_results_store_current
 
 
 def pairwise(args):
     welcome_message(args)
-    assemblies = find_assemblies(args.in_dir)
-    reference = find_reference(args.reference)
-    if not args.skip_check:
-        check_assemblies(assemblies, reference)
-    build_indices(args, assemblies)
-    if not args.index_only:
-        with open(args.out_file, 'wt') as table_file:
-            if parse_part(args.part)[0] == 0:  # only include the header in the first part
-                table_file.write(get_table_header())
-            process_all_pairs(args, assemblies, reference, table_file)
+    with profile_run(args.profile, args.profile_top) as worker_profile_dir:
+        assemblies = find_assemblies(args.in_dir)
+        reference = find_reference(args.reference)
+        if not args.skip_check:
+            check_assemblies(assemblies, reference)
+        build_indices(args, assemblies)
+        if not args.index_only:
+            existing_pairs, old_size, had_index, had_store = set(), None, False, False
+            if args.incremental and args.out_file.is_file():
+                existing_pairs = load_existing_pairs(args.out_file, args.database)
+                old_size = args.out_file.stat().st_size
+                had_index = is_tsv_index_current(args.out_file)
+                had_store = is_results_store_current(args.out_file)
+            if args.database:
+                with ResultsDatabase(args.out_file, get_table_header()) as table_file:
+                    process_all_pairs(args, assemblies, reference, table_file,
+                                      existing_pairs, worker_profile_dir)
+            else:
+                append = args.incremental and args.out_file.is_file() and \
+                    args.out_file.stat().st_size > 0
+                with open(args.out_file, 'at' if append else 'wt') as table_file:
+                    # Only include the header in the first part (and not when appending).
+                    if parse_part(args.part)[0] == 0 and not append:
+                        table_file.write(get_table_header())
+                    process_all_pairs(args, assemblies, reference, table_file,
+                                      existing_pairs, worker_profile_dir)
+            if args.tsv_index or had_index:
+                # An index which was current before appending only needs the new rows added.
+                build_tsv_index(args.out_file, get_table_header(),
+                                old_size if had_index else None)
+            if args.store or had_store:
+                build_results_store(args.out_file, get_table_header())
     finished_message(args.index_only)
 
 
+def load_existing_pairs(out_file, database):
+    """
+    For --incremental: returns the assembly pairs which already have results in the output file,
+    after checking that new results can be appended to it.
+    """
+    section_header('Loading existing results')
+    explanation('Because --incremental was used, Verticall pairwise will only analyse assembly '
+                'pairs which do not yet have results in the output file, appending their results '
+                'to it.')
+    if database != is_results_database(out_file):
+        file_type = 'a results database' if database else 'a TSV file'
+        sys.exit(f'Error: {out_file} is not {file_type}')
+    if not database:
+        if get_compression_type(out_file) != 'plain':
+            sys.exit(f'Error: cannot append to {out_file} because it is compressed')
+        with open(out_file, 'rt') as f:
+            first_line = f.readline()
+        if first_line.startswith('assembly_a\t') and first_line != get_table_header():
+            sys.exit(f'Error: {out_file} has results with different columns')
+    existing_pairs = get_result_pairs(out_file)
+    log(f'{len(existing_pairs):,} assembly pairs already have results in {out_file}')
+    log()
+    return existing_pairs
+
+
 def welcome_message(args):
     section_header('Starting Verticall pairwise')
     if args.reference is None:
@@ -160,40 +214,43 @@ def check_one_assembly(filename):
     return duplicate_contig_names, ambiguous_bases
 
 
-def process_all_pairs(args, assemblies, reference, table_file):
+def process_all_pairs(args, assemblies, reference, table_file, existing_pairs=None,
+                      worker_profile_dir=None):
     section_header('Processing pairwise combinations')
     explanation('For each assembly pair, Verticall pairwise aligns the assemblies, counts '
                 'differences in a sliding window, builds a distribution and categorises regions '
                 'of the alignments as either vertical or horizontal. This allows for the '
                 'calculation of a vertical-only genomic distance.')
-    arg_list = get_arg_list(args, assemblies, reference)
-    empty_results, multi_results = False, False
+    arg_list = get_arg_list(args, assemblies, reference, existing_pairs)
+    process = functools.partial(process_one_pair_with_stats,
+                                instrument=args.instrument is not None)
+    instrument_file = None
+    if args.instrument is not None:
+        instrument_file = open(args.instrument, 'at' if args.incremental else 'wt')
 
-    # If only using a single thread, do the alignment in a simple loop (easier for debugging).
-    if args.threads == 1:
-        for a in arg_list:
-            log_text, table_lines = process_one_pair(a)
-            if len(table_lines) == 0:
-                empty_results = True
-            if len(table_lines) > 1:
-                multi_results = True
-            log('\n'.join(prepare_log_text(log_text, args.verbose)))
-            for table_line in table_lines:
-                table_file.write(table_line)
-            table_file.flush()
-
-    # If using multiple threads, use a process pool to work in parallel.
-    else:
-        with Pool(processes=args.threads) as pool:
-            for log_text, table_lines in pool.imap(process_one_pair, arg_list):
-                if len(table_lines) == 0:
-                    empty_results = True
-                if len(table_lines) > 1:
-                    multi_results = True
-                log('\n'.join(prepare_log_text(log_text, args.verbose)))
-                for table_line in table_lines:
-                    table_file.write(table_line)
-                table_file.flush()
+    try:
+        # If only using a single thread, do the alignment in a simple loop (easier for debugging).
+        if args.threads == 1:
+            empty_results, multi_results = \
+                save_pair_results(map(process, arg_list), args, table_file, instrument_file)
+
+        # If using multiple threads, use a process pool to work in parallel. If profiling, each
+        # worker saves its profile when it exits, so the pool is closed and joined (not just
+        # terminated when the with block ends).
+        else:
+            initializer, initargs = None, ()
+            if worker_profile_dir is not None:
+                initializer, initargs = init_profiled_worker, (worker_profile_dir,)
+            with Pool(processes=args.threads, initializer=initializer,
+                      initargs=initargs) as pool:
+                empty_results, multi_results = \
+                    save_pair_results(pool.imap(process, arg_list), args, table_file,
+                                      instrument_file)
+                pool.close()
+                pool.join()
+    finally:
+        if instrument_file is not None:
+            instrument_file.close()
 
     if empty_results:
         warning('one or more assembly pairs failed to align sufficiently to produce results')
@@ -202,11 +259,35 @@ def process_all_pairs(args, assemblies, reference, table_file):
     log()
 
 
-def get_arg_list(args, assemblies, reference):
+def save_pair_results(results, args, table_file, instrument_file):
+    """
+    Logs and saves each pair's results (and instrumentation record, if any) as they arrive.
+    Returns whether any pair had no results and whether any had multiple results.
+    """
+    empty_results, multi_results = False, False
+    for log_text, table_lines, record in results:
+        if len(table_lines) == 0:
+            empty_results = True
+        if len(table_lines) > 1:
+            multi_results = True
+        log('\n'.join(prepare_log_text(log_text, args.verbose)))
+        for table_line in table_lines:
+            table_file.write(table_line)
+        table_file.flush()
+        if instrument_file is not None:
+            instrument_file.write(format_record(record))
+            instrument_file.flush()
+    return empty_results, multi_results
+
+
+def get_arg_list(args, assemblies, reference, existing_pairs=None):
     """
     This function produces a list of arguments for the process_one_pair function. If --part 1/1 was
     used (the default), this will include an entry for each pair of assemblies. If another value
-    for --part was used, this will include a subset of the pairs.
+    for --part was used, this will include a subset of the pairs. Pairs in existing_pairs (which
+    already have results) are then left out of that subset. The full list is divided into parts
+    first, so each part always covers the same pairs, no matter which pairs already have results
+    (e.g. when parts are run one after another on a shared --database).
     """
     arg_list = []
     if reference is None:
@@ -219,11 +300,12 @@ def get_arg_list(args, assemblies, reference):
         for assembly_name, assembly_filename in assemblies:
             if ref_name != assembly_name:
                 arg_list.append((args, ref_name, assembly_name, ref_filename, assembly_filename))
-
     part_num, part_total = parse_part(args.part)
     if part_total > 1:
         arg_list = split_list(arg_list, part_total)[part_num]
 
+    if existing_pairs:
+        arg_list = [a for a in arg_list if (a[1], a[2]) not in existing_pairs]
     return arg_list
 
 
@@ -271,7 +353,19 @@ def prepare_log_text(log_text, verbose):
     return [single_line]
 
 
-def process_one_pair(all_args, view=False, view_num=1):
+def process_one_pair_with_stats(all_args, instrument=False):
+    """
+    Runs process_one_pair for pairwise, also returning the pair's instrumentation record (or None
+    if not instrumenting).
+    """
+    if not instrument:
+        return process_one_pair(all_args) + (None,)
+    stats = PairStats(all_args[1], all_args[2])
+    log_text, table_lines = process_one_pair(all_args, stats=stats)
+    return log_text, table_lines, stats.finish()
+
+
+def process_one_pair(all_args, view=False, view_num=1, stats=None):
     """
     This is the main function for each pairwise comparison. It gets called once for each assembly
     pair and carries out all analysis on that pair.
@@ -283,19 +377,26 @@ def process_one_pair(all_args, view=False, view_num=1):
     * pairwise: returns a list of log text and a list of tsv table lines
     * view: returns the analysis data (alignments, mass distribution, painted assemblies, etc) to
             be plotted
+
+    If a PairStats object is given, the time taken by each stage and some counts are added to it.
     """
     args, name_a, name_b, filename_a, filename_b = all_args  # unpack the arguments
     all_log_text = [f'{name_a} vs {name_b}:']  # text logged to console will be stored in this list
 
     # Step 1: align the two assemblies to each other.
     alignments, n50_alignment_length, aligned_frac, mean_distance, log_text = \
-        align_sample_pair(args, filename_a, name_b)
+        align_sample_pair(args, filename_a, name_b, stats)
     all_log_text += log_text
 
     # Step 2: produce a distance distribution from sliding windows across the alignments.
-    masses, window_size, window_count, mean_window_distance, median_window_distance, log_text = \
-        get_distribution(args, alignments)
+    with time_stage(stats, 'windows'):
+        masses, window_size, window_count, mean_window_distance, median_window_distance, \
+            log_text = get_distribution(args, alignments)
     all_log_text += log_text
+    if stats is not None:
+        stats.count('alignments', len(alignments))
+        stats.count('window_size', window_size)
+        stats.count('windows', window_count)
 
     # If there are no sliding windows, then the two assemblies didn't sufficiently align to do any
     # further analysis.
@@ -305,9 +406,14 @@ def process_one_pair(all_args, view=False, view_num=1):
     # Step 3: smooth the distribution and find peaks with their corresponding thresholds. When
     #         there is a close call, this can return multiple results (a primary result and one or
     #         more secondary results).
-    smoothed_masses = smooth_distribution(masses, args.smoothing_factor)
-    mass_peaks, results, log_text = get_peak_distance(smoothed_masses, window_size, args.secondary)
+    with time_stage(stats, 'smoothing'):
+        smoothed_masses = smooth_distribution(masses, args.smoothing_factor)
+    with time_stage(stats, 'peak_calling'):
+        mass_peaks, results, log_text = get_peak_distance(smoothed_masses, window_size,
+                                                          args.secondary)
     all_log_text += log_text
+    if stats is not None:
+        stats.count('results', len(results))
     check_view_num(view, view_num, len(results))
 
     # Step 4: paint alignments and assemblies using the distance thresholds.
@@ -318,14 +424,15 @@ def process_one_pair(all_args, view=False, view_num=1):
 
         peak_mass, result_level, peak_distance, thresholds = result
 
-        vertical_masses, horizontal_masses, mean_vert_window_dist, median_vert_window_dist, \
-            mean_vert_dist, r_over_m, log_text = paint_alignments(alignments, thresholds,
-                                                                  window_size)
-        all_log_text += log_text
+        with time_stage(stats, 'painting'):
+            vertical_masses, horizontal_masses, mean_vert_window_dist, median_vert_window_dist, \
+                mean_vert_dist, r_over_m, log_text = paint_alignments(alignments, thresholds,
+                                                                      window_size)
+            all_log_text += log_text
 
-        painted_a, painted_b, log_text = \
-            paint_assemblies(name_a, name_b, filename_a, filename_b, alignments)
-        all_log_text += log_text
+            painted_a, painted_b, log_text = \
+                paint_assemblies(name_a, name_b, filename_a, filename_b, alignments)
+            all_log_text += log_text
 
         # If called by the view subcommand, we return the results instead of making a table line.
         if view:
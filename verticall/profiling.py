@@ -0,0 +1,102 @@
+"""
+This module contains code for Verticall pairwise's --profile option, which runs cProfile in the
+main process and in every pool worker, then merges them into one profile. Unlike profiling with
+--threads 1, this shows where time goes in a real parallel run, including the pool's overhead.
+
+Copyright 2022 Ryan Wick (rrwick@gmail.com)
+https://github.com/rrwick/Verticall
+
+This file is part of Verticall. Verticall is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by the Free Software Foundation,
+either version 3 of the License, or (at your option) any later version. Verticall is distributed
+in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+details. You should have received a copy of the GNU General Public License along with Verticall.
+If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import contextlib
+import cProfile
+from multiprocessing.util import Finalize
+import os
+import pathlib
+import pstats
+import tempfile
+
+from .log import log, section_header, explanation
+
+
+# The main process's profiler. Forked workers inherit it (still enabled), so they turn it off
+# before starting their own.
+main_profiler = None
+
+
+@contextlib.contextmanager
+def profile_run(out_file, top_n):
+    """
+    Profiles the code in the with block, yielding a directory for worker profiles (to be passed to
+    init_profiled_worker) or None if out_file is None. When the block finishes, the main and worker
+    profiles are merged and saved to out_file, with a text summary of the top_n functions.
+    """
+    global main_profiler
+    if out_file is None:
+        yield None
+        return
+    with tempfile.TemporaryDirectory() as worker_dir:
+        profiler = main_profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield pathlib.Path(worker_dir)
+        finally:
+            profiler.disable()
+            main_profiler = None
+        worker_files = sorted(pathlib.Path(worker_dir).glob('*.prof'))
+        save_profile(profiler, worker_files, out_file, top_n)
+
+
+def init_profiled_worker(worker_dir):
+    """
+    A pool initializer which profiles the worker process until it exits. The profile is saved by a
+    multiprocessing finaliser, which runs when the pool is closed and joined (but not if it is
+    terminated).
+    """
+    if main_profiler is not None:
+        main_profiler.disable()
+    profiler = cProfile.Profile()
+    profiler.enable()
+    Finalize(None, save_worker_profile, args=(profiler, worker_dir), exitpriority=10)
+
+
+def save_worker_profile(profiler, worker_dir):
+    profiler.disable()
+    profiler.dump_stats(str(pathlib.Path(worker_dir) / f'worker_{os.getpid()}.prof'))
+
+
+def save_profile(profiler, worker_files, out_file, top_n):
+    section_header('Saving profile')
+    explanation('Because --profile was used, Verticall pairwise now merges the profiles from the '
+                'main process and the worker processes into a single profile (which can be '
+                'viewed with tools like snakeviz) and a summary of the most time-consuming '
+                'functions.')
+    stats = pstats.Stats(profiler)
+    for worker_file in worker_files:
+        stats.add(str(worker_file))
+    stats.dump_stats(str(out_file))
+
+    summary_file = get_summary_filename(out_file)
+    with open(summary_file, 'wt') as f:
+        f.write(f'Merged profile of the main process and {len(worker_files)} worker '
+                f'process{"" if len(worker_files) == 1 else "es"}\n\n')
+        stats = pstats.Stats(str(out_file), stream=f)
+        stats.strip_dirs()
+        for sort_key, description in [('cumulative', 'cumulative time'),
+                                      ('tottime', 'internal time')]:
+            f.write(f'Top {top_n} functions by {description}:\n')
+            stats.sort_stats(sort_key).print_stats(top_n)
+    log(f'Profile: {out_file.resolve()}')
+    log(f'Summary: {summary_file.resolve()}')
+    log()
+
+
+def get_summary_filename(out_file):
+    return out_file.with_name(out_file.name + '.txt')
@@ -14,29 +14,84 @@ details. You should have received a copy of the GNU General Public License along
 If not, see <https://www.gnu.org/licenses/>.
 """
 
+import itertools
 import matplotlib.pyplot as plt
+import numpy as np
 import pandas as pd
 from plotnine import ggplot, aes, geom_area, geom_vline, labs, theme_bw, scale_x_continuous, \
     scale_y_continuous, scale_fill_manual, element_blank, theme
 import sys
 
-from .matrix import get_column_index
-from .misc import iterate_fasta, get_open_func
-from .tsv import split_region_str
+from .intervals import merge_breakpoints, get_layered_depth_runs
+from .log import log
+from .misc import iterate_fasta
+from .pairwise import find_assemblies
+from .tsv import parse_regions, iterate_results, get_region_arrays
 
 
 def summary(args):
+    if args.assembly_dir is not None:
+        summary_batch(args)
+        return
     contig_lengths, sample_name = get_contig_lengths(args.assembly)
-    data = load_data(args.in_file, sample_name)
-    summarised_data = summarise_data(data, contig_lengths, args.all)
+    coverage = RegionCoverage(contig_lengths)
+    load_data(args.in_file, {sample_name: coverage})
     if args.plot:
-        plot = summary_plot(sample_name, summarised_data, contig_lengths, args.vertical_colour,
+        if args.format == 'bins':
+            plot_data = [(contig, (start + end) // 2, vertical, horizontal, unaligned)
+                         for contig, start, end, vertical, horizontal, unaligned
+                         in bin_data(coverage, args.bin_size)]
+        else:
+            plot_data = summarise_data(coverage, args.all)
+        plot = summary_plot(sample_name, plot_data, contig_lengths, args.vertical_colour,
                             args.horizontal_colour, args.ambiguous_colour)
         plt.show()
     else:
-        print('contig', 'position', 'vertical', 'horizontal', 'unaligned')
-        for contig, position, vertical, horizontal, unaligned in summarised_data:
-            print(f'{contig}\t{position}\t{vertical}\t{horizontal}\t{unaligned}')
+        write_output(coverage, args, sys.stdout)
+
+
+def summary_batch(args):
+    """
+    Summarises every assembly in a directory using one pass over the TSV file, saving each
+    sample's summary to its own file in the output directory.
+    """
+    coverages = {}
+    for sample_name, filename in find_assemblies(args.assembly_dir):
+        contig_lengths, _ = get_contig_lengths(filename)
+        coverages[sample_name] = RegionCoverage(contig_lengths)
+    load_data(args.in_file, coverages)
+    args.out_dir.mkdir(parents=True, exist_ok=True)
+    extension = 'bedgraph' if args.format == 'bedgraph' else 'tsv'
+    for sample_name, coverage in coverages.items():
+        with open(args.out_dir / f'{sample_name}.{extension}', 'wt') as f:
+            write_output(coverage, args, f)
+    log(f'Saved {len(coverages):,} summaries to {args.out_dir.resolve()}')
+
+
+def write_output(coverage, args, f):
+    if args.format == 'bedgraph':
+        write_bedgraph(bedgraph_data(coverage), f)
+    elif args.format == 'bins':
+        write_bins(bin_data(coverage, args.bin_size), f)
+    else:
+        write_summary(summarise_data(coverage, args.all), f)
+
+
+def write_summary(summarised_data, f):
+    f.write('contig position vertical horizontal unaligned\n')
+    for contig, position, vertical, horizontal, unaligned in summarised_data:
+        f.write(f'{contig}\t{position}\t{vertical}\t{horizontal}\t{unaligned}\n')
+
+
+def write_bedgraph(runs, f):
+    for contig, start, end, vertical, horizontal, unaligned in runs:
+        f.write(f'{contig}\t{start}\t{end}\t{vertical}\t{horizontal}\t{unaligned}\n')
+
+
+def write_bins(bins, f):
+    f.write('contig\tstart\tend\tvertical\thorizontal\tunaligned\n')
+    for contig, start, end, vertical, horizontal, unaligned in bins:
+        f.write(f'{contig}\t{start}\t{end}\t{vertical:.3f}\t{horizontal:.3f}\t{unaligned:.3f}\n')
 
 
 def get_contig_lengths(assembly_filename):
@@ -62,61 +117,162 @@ def get_contig_lengths(assembly_filename):
     return contig_lengths, sample_name
 
 
-def load_data(filename, sample_name):
-    data = []
-    v_column, h_column, u_column = None, None, None
-    with get_open_func(filename)(filename, 'rt') as pairwise_file:
-        for i, line in enumerate(pairwise_file):
-            parts = line.strip('\n').split('\t')
-            if i == 0:
-                v_column = get_column_index(parts, 'assembly_a_vertical_regions', filename)
-                h_column = get_column_index(parts, 'assembly_a_horizontal_regions', filename)
-                u_column = get_column_index(parts, 'assembly_a_unaligned_regions', filename)
-            elif parts[0] == sample_name:
-                vertical_regions = parts[v_column].split(',') if parts[v_column] else []
-                horizontal_regions = parts[h_column].split(',') if parts[h_column] else []
-                unaligned_regions = parts[u_column].split(',') if parts[u_column] else []
-                data.append((vertical_regions, horizontal_regions, unaligned_regions))
-    return data
-
-
-def summarise_data(data, contig_lengths, output_all):
-    vertical_counts = {name: [0] * length for name, length in contig_lengths.items()}
-    horizontal_counts = {name: [0] * length for name, length in contig_lengths.items()}
-    unaligned_counts = {name: [0] * length for name, length in contig_lengths.items()}
-    for vertical_regions, horizontal_regions, unaligned_regions in data:
-        for region in vertical_regions:
-            name, start, end = split_region_str(region)
-            for i in range(start, end):
-                vertical_counts[name][i] += 1
-        for region in horizontal_regions:
-            name, start, end = split_region_str(region)
-            for i in range(start, end):
-                horizontal_counts[name][i] += 1
-        for region in unaligned_regions:
-            name, start, end = split_region_str(region)
-            for i in range(start, end):
-                unaligned_counts[name][i] += 1
+def load_data(filename, coverages):
+    """
+    Loads the assembly_a regions from the TSV file (or its results store), adding each block of
+    rows to the RegionCoverage object (in the coverages dictionary) for its sample. Rows for other
+    samples are skipped without being parsed (or not read at all if the TSV has an up-to-date
+    index).
+    """
+    for results in iterate_results(filename, [], set(coverages), regions=True):
+        # Rows are sorted by sample once, so each sample's rows are a contiguous slice.
+        order = np.argsort(results.a_indices, kind='stable')
+        a_indices, group_starts = np.unique(results.a_indices[order], return_index=True)
+        group_ends = np.append(group_starts[1:], len(order))
+        regions = results.regions.select(order)
+        for a_index, start, end in zip(a_indices.tolist(), group_starts.tolist(),
+                                       group_ends.tolist()):
+            coverages[results.sample_names[a_index]].add_region_arrays(
+                regions.select(slice(start, end)))
+
+
+class RegionCoverage(object):
+    """
+    This class accumulates vertical, horizontal and unaligned region depth for each contig of an
+    assembly. Instead of per-base counts, it stores each region as a +1 at its start and a -1 at
+    its end (like a difference array), so depth only needs to be worked out at the breakpoints.
+    """
+    def __init__(self, contig_lengths):
+        self.contig_lengths = contig_lengths
+
+        # For each contig and classification (vertical, horizontal, unaligned): a list of
+        # (positions, deltas) array pairs, which is periodically compacted into a single pair.
+        self.breakpoints = {name: ([], [], []) for name in contig_lengths}
+        self.uncompacted_count = 0
+
+    def add(self, vertical_regions, horizontal_regions, unaligned_regions):
+        """
+        Adds one TSV row's worth of regions (as comma-delimited region strings).
+        """
+        contig_indices, region_parts = {}, []
+        for i, region_str in enumerate((vertical_regions, horizontal_regions, unaligned_regions)):
+            for name, regions in parse_regions(region_str).items():
+                contig_index = contig_indices.setdefault(name, len(contig_indices))
+                region_parts.append((contig_index, i, regions))
+        region_count = sum(len(regions) for _, _, regions in region_parts)
+        self.add_region_arrays(get_region_arrays(contig_indices, [region_count], region_parts))
+
+    def add_region_arrays(self, regions):
+        """
+        Adds many rows' worth of regions at once (as a RegionArrays object). The regions are sorted
+        by contig and classification once, so each group is a contiguous slice.
+        """
+        keys = regions.contigs * 3 + regions.classes
+        order = np.argsort(keys, kind='stable')
+        group_keys, group_starts = np.unique(keys[order], return_index=True)
+        group_ends = np.append(group_starts[1:], len(order))
+        starts, ends = regions.starts[order], regions.ends[order]
+        for key, start, end in zip(group_keys.tolist(), group_starts.tolist(),
+                                   group_ends.tolist()):
+            name = regions.contig_names[key // 3]
+            if name not in self.breakpoints:
+                sys.exit(f'Error: contig {name} not found in assembly')
+            positions = np.concatenate([starts[start:end], ends[start:end]])
+            deltas = np.repeat(np.array([1, -1], dtype=np.int64), end - start)
+            self.breakpoints[name][key % 3].append((positions, deltas))
+            self.uncompacted_count += 1
+        if self.uncompacted_count >= 10000:
+            self.compact()
+
+    def compact(self):
+        """
+        Merges the stored breakpoints so there is only one entry per position.
+        """
+        for lists in self.breakpoints.values():
+            for breakpoint_list in lists:
+                if len(breakpoint_list) > 1:
+                    breakpoint_list[:] = [merge_breakpoints(breakpoint_list)]
+        self.uncompacted_count = 0
+
+    def get_runs(self, name):
+        """
+        Returns the runs of constant depth for the contig, as arrays of run start positions, run
+        end positions (exclusive) and a 3×N array of depths (vertical, horizontal, unaligned).
+        Adjacent runs always have different depths.
+        """
+        return get_layered_depth_runs(self.breakpoints[name], self.contig_lengths[name])
+
+
+def summarise_data(coverage, output_all):
+    """
+    Returns (contig, position, vertical, horizontal, unaligned) tuples for the first and last
+    position of each run of constant depth (or for every position if output_all is True).
+    """
     summarised_data = []
-    for name, length in contig_lengths.items():
-        for i in range(length):
-            vertical_count = vertical_counts[name][i]
-            horizontal_count = horizontal_counts[name][i]
-            unaligned_count = unaligned_counts[name][i]
-            if i == 0 or i == length-1 or output_all:
-                summarised_data.append((name, i, vertical_count, horizontal_count, unaligned_count))
-            else:
-                prev_counts = (vertical_counts[name][i-1], horizontal_counts[name][i-1],
-                               unaligned_counts[name][i-1])
-                this_counts = (vertical_count, horizontal_count, unaligned_count)
-                next_counts = (vertical_counts[name][i+1], horizontal_counts[name][i+1],
-                               unaligned_counts[name][i+1])
-                if prev_counts != this_counts or next_counts != this_counts:
-                    summarised_data.append((name, i, vertical_count, horizontal_count,
-                                            unaligned_count))
+    for name, length in coverage.contig_lengths.items():
+        if length == 0:
+            continue
+        starts, ends, depths = coverage.get_runs(name)
+        if output_all:
+            positions = np.arange(length)
+            depths = np.repeat(depths, ends - starts, axis=1)
+        else:
+            last_positions = ends - 1
+            positions = np.stack([starts, last_positions], axis=1).reshape(-1)
+            depths = np.repeat(depths, 2, axis=1)
+            keep = np.ones(len(positions), dtype=bool)
+            keep[1::2] = last_positions > starts  # single-base runs only need one line
+            positions, depths = positions[keep], depths[:, keep]
+        summarised_data += zip(itertools.repeat(name), positions.tolist(), *depths.tolist())
     return summarised_data
 
 
+def bedgraph_data(coverage):
+    """
+    Returns (contig, start, end, vertical, horizontal, unaligned) tuples for each run of constant
+    depth, with 0-based exclusive end positions as used in bedGraph files.
+    """
+    runs = []
+    for name, length in coverage.contig_lengths.items():
+        if length == 0:
+            continue
+        starts, ends, depths = coverage.get_runs(name)
+        runs += zip(itertools.repeat(name), starts.tolist(), ends.tolist(), *depths.tolist())
+    return runs
+
+
+def bin_data(coverage, bin_size):
+    """
+    Returns (contig, start, end, vertical, horizontal, unaligned) tuples for fixed-width bins
+    across each contig (the last bin of a contig may be shorter), where the depths are the mean
+    over the bin's positions.
+    """
+    bins = []
+    for name, length in coverage.contig_lengths.items():
+        if length == 0:
+            continue
+        starts, ends, depths = coverage.get_runs(name)
+        bin_starts = np.arange(0, length, bin_size)
+        bin_ends = np.minimum(bin_starts + bin_size, length)
+        areas = get_depth_area(starts, ends, depths, bin_ends) - \
+            get_depth_area(starts, ends, depths, bin_starts)
+        means = areas / (bin_ends - bin_starts)
+        bins += zip(itertools.repeat(name), bin_starts.tolist(), bin_ends.tolist(),
+                    *means.tolist())
+    return bins
+
+
+def get_depth_area(starts, ends, depths, positions):
+    """
+    Returns the total depth (for each of the three classifications) from the start of the contig
+    up to (but not including) each of the given positions.
+    """
+    run_areas = np.concatenate([np.zeros((3, 1), dtype=np.int64),
+                                np.cumsum(depths * (ends - starts), axis=1)], axis=1)
+    run_indices = np.searchsorted(starts, positions, side='right') - 1
+    return run_areas[:, run_indices] + depths[:, run_indices] * (positions - starts[run_indices])
+
+
 def summary_plot(sample_name, summarised_data, contig_lengths, vertical_colour, horizontal_colour,
                  ambiguous_colour):
     title = f'{sample_name} painting summary'
@@ -0,0 +1,131 @@
+"""
+This module contains code for building a neighbour-joining (or BioNJ) tree from a distance matrix.
+
+Copyright 2022 Ryan Wick (rrwick@gmail.com)
+https://github.com/rrwick/Verticall
+
+This file is part of Verticall. Verticall is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by the Free Software Foundation,
+either version 3 of the License, or (at your option) any later version. Verticall is distributed
+in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+details. You should have received a copy of the GNU General Public License along with Verticall.
+If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import numpy as np
+import sys
+
+from .log import log, section_header, explanation
+
+
+# Characters which can't be in an unquoted Newick label.
+NEWICK_SPECIAL_CHARACTERS = set("()[]',:;")
+
+
+def build_tree(sample_names, distances, method='bionj'):
+    """
+    Builds an unrooted tree from an N×N distance matrix using neighbour joining (Saitou and Nei
+    1987) or BioNJ (Gascuel 1997), returning it as a Newick string.
+
+    The active clusters are kept in the top-left m×m block of the matrix. When clusters i and j
+    are joined, the new cluster goes in slot i and the last active cluster is moved into slot j,
+    so each step is a handful of whole-row NumPy operations.
+    """
+    assert method in ('nj', 'bionj')
+    if np.isnan(distances).any():
+        sys.exit('Error: cannot build a tree from a matrix with missing distances')
+    d = (distances + distances.T) / 2.0
+    v = d.copy()  # BioNJ variance estimates
+    nodes = [get_newick_label(name) for name in sample_names]
+    m = len(nodes)
+    if m == 0:
+        sys.exit('Error: cannot build a tree with no samples')
+    if m == 1:
+        return f'{nodes[0]};'
+    if m == 2:
+        return f'({nodes[0]}:{d[0, 1] / 2.0:.9f},{nodes[1]}:{d[0, 1] / 2.0:.9f});'
+
+    while m > 3:
+        i, j, branch_i, branch_j = get_closest_pair(d[:m, :m])
+        if method == 'bionj':
+            new_distances, new_variances = get_bionj_distances(d[:m, :m], v[:m, :m], i, j,
+                                                               branch_i, branch_j)
+            v[i, :m], v[:m, i] = new_variances, new_variances
+            v[i, i] = 0.0
+        else:
+            new_distances = 0.5 * (d[i, :m] + d[j, :m] - d[i, j])
+        d[i, :m], d[:m, i] = new_distances, new_distances
+        d[i, i] = 0.0
+        nodes[i] = f'({nodes[i]}:{branch_i:.9f},{nodes[j]}:{branch_j:.9f})'
+
+        # Move the last active cluster into slot j.
+        last = m - 1
+        if j != last:
+            d[j, :m], d[:m, j] = d[last, :m], d[:m, last]
+            v[j, :m], v[:m, j] = v[last, :m], v[:m, last]
+            d[j, j], v[j, j] = 0.0, 0.0
+            nodes[j] = nodes[last]
+        nodes.pop()
+        m -= 1
+
+    # The last three clusters are joined at a single (unrooted) node.
+    branch_0 = (d[0, 1] + d[0, 2] - d[1, 2]) / 2.0
+    branch_1 = (d[0, 1] + d[1, 2] - d[0, 2]) / 2.0
+    branch_2 = (d[0, 2] + d[1, 2] - d[0, 1]) / 2.0
+    return f'({nodes[0]}:{branch_0:.9f},{nodes[1]}:{branch_1:.9f},{nodes[2]}:{branch_2:.9f});'
+
+
+def get_newick_label(name):
+    """
+    Returns a sample name as a Newick label. Names with characters which have a meaning in Newick
+    (e.g. spaces, parentheses, commas, colons or semicolons) are put in single quotes, with any
+    single quotes in the name doubled.
+    """
+    if any(c.isspace() or c in NEWICK_SPECIAL_CHARACTERS for c in name):
+        return "'" + name.replace("'", "''") + "'"
+    return name
+
+
+def get_closest_pair(d):
+    """
+    Finds the pair of clusters which minimises the Q criterion, returning their indices (i < j)
+    and the branch lengths from each to their new parent node.
+    """
+    m = d.shape[0]
+    row_sums = d.sum(axis=1)
+    q = (m - 2) * d - row_sums[:, np.newaxis] - row_sums[np.newaxis, :]
+    np.fill_diagonal(q, np.inf)
+    i, j = sorted(np.unravel_index(np.argmin(q), q.shape))
+    branch_i = 0.5 * d[i, j] + (row_sums[i] - row_sums[j]) / (2.0 * (m - 2))
+    branch_j = d[i, j] - branch_i
+    return i, j, branch_i, branch_j
+
+
+def get_bionj_distances(d, v, i, j, branch_i, branch_j):
+    """
+    Returns BioNJ's distances and variances from the new cluster (made by joining i and j) to all
+    clusters. Lambda is chosen to minimise the variance of the new distances.
+    """
+    m = d.shape[0]
+    if v[i, j] == 0.0:
+        lam = 0.5
+    else:
+        lam = 0.5 + (v[j, :].sum() - v[i, :].sum()) / (2.0 * (m - 2) * v[i, j])
+        lam = min(max(lam, 0.0), 1.0)
+    new_distances = lam * (d[i, :] - branch_i) + (1.0 - lam) * (d[j, :] - branch_j)
+    new_variances = lam * v[i, :] + (1.0 - lam) * v[j, :] - lam * (1.0 - lam) * v[i, j]
+    return new_distances, new_variances
+
+
+def save_tree(filename, sample_names, distances, method):
+    section_header('Building tree')
+    method_name = 'BioNJ' if method == 'bionj' else 'neighbour-joining'
+    explanation(f'Verticall is now building a {method_name} tree from the distance matrix. For '
+                f'a more thorough tree search, use FastME on the PHYLIP matrix instead.')
+    newick = build_tree(sample_names, distances, method)
+    with open(filename, 'wt') as f:
+        f.write(newick)
+        f.write('\n')
+    log(f'{filename.resolve()}')
+    log()
@@ -14,7 +14,14 @@ details. You should have received a copy of the GNU General Public License along
 If not, see <https://www.gnu.org/licenses/>.
 """
 
+import numpy as np
+import shutil
 import sys
+import zlib
+
+from .database import is_results_database, get_database_assembly_a_names, \
+    get_database_pairs, iterate_database_lines
+from .misc import get_compression_type, get_open_func
 
 
 def check_first_two_columns(header_parts, filename):
@@ -76,3 +83,565 @@ def get_start_end(region):
         return int(start_pos), int(end_pos)
     except ValueError:
         sys.exit(f'Error: data is not correctly formatted: {region}')
+
+
+def parse_regions(region_str):
+    """
+    Parses a whole comma-delimited region string in bulk: one split into regions, one partition of
+    each region into its contig name and range, and one conversion of all start/end positions to
+    integers. Regions are grouped by contig (keeping their order) using the runs of same-contig
+    regions, which is one run per contig in Verticall's output.
+    Input:  a region string, e.g. "contig_1:0-10,contig_1:20-30,contig_2:0-50"
+    Output: a dictionary of contig name to an N×2 array of start/end positions, e.g.
+            {contig_1: [[0, 10], [20, 30]], contig_2: [[0, 50]]}
+    """
+    if not region_str:
+        return {}
+    regions = region_str.split(',')
+    if region_str.count(':') != len(regions):
+        sys.exit(f'Error: data is not correctly formatted: {region_str[:100]}')
+    names, _, ranges = zip(*[r.partition(':') for r in regions])
+    ranges = ','.join(ranges)
+    if not is_range_list(ranges, len(regions)):
+        sys.exit(f'Error: data is not correctly formatted: {region_str[:100]}')
+    try:
+        positions = np.array(ranges.replace('-', ',').split(','), dtype=np.int64).reshape(-1, 2)
+    except ValueError:
+        sys.exit(f'Error: data is not correctly formatted: {region_str[:100]}')
+
+    runs, run_start = {}, 0
+    for i in range(1, len(names) + 1):
+        if i == len(names) or names[i] != names[run_start]:
+            if not names[run_start]:
+                sys.exit(f'Error: data is not correctly formatted: {region_str[:100]}')
+            runs.setdefault(names[run_start], []).append(positions[run_start:i])
+            run_start = i
+    return {name: arrays[0] if len(arrays) == 1 else np.concatenate(arrays)
+            for name, arrays in runs.items()}
+
+
+def is_range_list(ranges, count):
+    """
+    Checks that a comma-delimited list of ranges (e.g. "0-10,20-30") has count ranges, each with
+    exactly one dash, by looking at the order of its separators.
+    """
+    characters = np.frombuffer(ranges.encode(), dtype=np.uint8)
+    separators = characters[(characters == ord('-')) | (characters == ord(','))]
+    return len(separators) == 2 * count - 1 and \
+        bool(np.all(separators[0::2] == ord('-'))) and bool(np.all(separators[1::2] == ord(',')))
+
+
+def split_leading_columns(line, column_count):
+    """
+    Returns the first column_count tab-delimited columns of the line (or all columns if there are
+    fewer). The tab positions are found with str.find, so the rest of the line isn't copied.
+    """
+    end = -1
+    for _ in range(column_count):
+        end = line.find('\t', end + 1)
+        if end == -1:
+            return line.rstrip('\n').split('\t')
+    return line[:end].split('\t')
+
+
+def get_index_filename(filename):
+    """
+    Returns the filename of the byte-offset index for a pairwise TSV file, e.g. pairwise.tsv ->
+    pairwise.tsv.idx.
+    """
+    return filename.parent / (filename.name + '.idx')
+
+
+def build_tsv_index(filename, header=None, old_size=None):
+    """
+    Scans a (non-gzipped) pairwise TSV file and saves an index with the assembly_a, assembly_b,
+    result_level, byte offset and byte length of each row. If the file has no header line (e.g. a
+    later --part), the header must be given. The index records the TSV's size and modification
+    time, so a stale index can be detected.
+
+    If old_size is given and the existing index was made when the TSV was that size (e.g. before
+    pairwise --incremental appended to it), only the rows after old_size are scanned and their
+    entries are added to the existing index.
+    """
+    if is_results_database(filename):
+        sys.exit(f'Error: cannot index {filename} because it is a results database')
+    if get_compression_type(filename) != 'plain':
+        sys.exit(f'Error: cannot index {filename} because it is compressed')
+    index_filename = get_index_filename(filename)
+    appending = old_size is not None and get_indexed_size(index_filename) == old_size
+    level_column, entries, offset = None, [], old_size if appending else 0
+    with open(filename, 'rb') as f:
+        first_line = f.readline()
+        if first_line.decode().startswith('assembly_a\t'):
+            header = first_line.decode()
+            offset = max(offset, len(first_line))
+        f.seek(offset)
+        for line in f:
+            line_str = line.decode()
+            if level_column is None:
+                if header is None:
+                    sys.exit(f'Error: {filename} has no header')
+                level_column = get_column_index(header.rstrip('\n').split('\t'),
+                                                'result_level', filename)
+            parts = split_leading_columns(line_str, level_column + 1)
+            entries.append(f'{parts[0]}\t{parts[1]}\t{parts[level_column]}\t'
+                           f'{offset}\t{len(line)}\n')
+            offset += len(line)
+    stat = filename.stat()
+    temp_filename = index_filename.with_name(index_filename.name + '.tmp')
+    with open(temp_filename, 'wt') as f:
+        f.write(f'#tsv_index\t{stat.st_size}\t{stat.st_mtime_ns}\n')
+        if appending:
+            with open(index_filename, 'rt') as old_index:
+                old_index.readline()
+                shutil.copyfileobj(old_index, f)
+        f.writelines(entries)
+    temp_filename.replace(index_filename)
+
+
+def is_tsv_index_current(filename):
+    """
+    Returns whether the TSV file has an up-to-date index, only reading the index's first line.
+    """
+    index_filename = get_index_filename(filename)
+    if not index_filename.is_file() or not filename.is_file():
+        return False
+    stat = filename.stat()
+    with open(index_filename, 'rt') as f:
+        return f.readline() == f'#tsv_index\t{stat.st_size}\t{stat.st_mtime_ns}\n'
+
+
+def get_indexed_size(index_filename):
+    """
+    Returns the TSV size recorded in an index file, or None if there is no index.
+    """
+    if not index_filename.is_file():
+        return None
+    with open(index_filename, 'rt') as f:
+        parts = f.readline().rstrip('\n').split('\t')
+    if len(parts) != 3 or parts[0] != '#tsv_index':
+        return None
+    return int(parts[1])
+
+
+def load_tsv_index(filename):
+    """
+    Loads the index for a pairwise TSV file, returning a dictionary of assembly_a to a list of
+    (assembly_b, result_level, offset, length) tuples in file order. Returns None if there is no
+    index or if it is out of date.
+    """
+    index_filename = get_index_filename(filename)
+    if not index_filename.is_file() or not filename.is_file():
+        return None
+    stat = filename.stat()
+    index = {}
+    with open(index_filename, 'rt') as f:
+        if f.readline() != f'#tsv_index\t{stat.st_size}\t{stat.st_mtime_ns}\n':
+            return None
+        for line in f:
+            assembly_a, assembly_b, result_level, offset, length = line.rstrip('\n').split('\t')
+            index.setdefault(assembly_a, []).append((assembly_b, result_level,
+                                                     int(offset), int(length)))
+    return index
+
+
+def get_indexed_assembly_a_names(filename):
+    """
+    Returns the sorted assembly_a names in the TSV file's index (or results database), or None if
+    there is no up-to-date index.
+    """
+    if is_results_database(filename):
+        return get_database_assembly_a_names(filename)
+    index = load_tsv_index(filename)
+    return None if index is None else sorted(index)
+
+
+def get_result_pairs(filename):
+    """
+    Returns the set of (assembly_a, assembly_b) pairs with results in a pairwise TSV file (or
+    results database). This uses the database, an up-to-date index or an up-to-date results store
+    if possible, and only falls back to scanning the TSV's first two columns if not.
+    """
+    if is_results_database(filename):
+        return get_database_pairs(filename)
+    index = load_tsv_index(filename)
+    if index is not None:
+        return {(a, b) for a, rows in index.items() for b, _, _, _ in rows}
+    if is_results_store_current(filename):
+        pairs = set()
+        for results in iterate_results_store(filename, [], None, False):
+            names = results.sample_names
+            pairs.update(zip([names[i] for i in results.a_indices],
+                             [names[i] for i in results.b_indices]))
+        return pairs
+    pairs = set()
+    with get_open_func(filename)(filename, 'rt') as f:
+        for i, line in enumerate(f):
+            if i == 0 and line.startswith('assembly_a\t'):
+                continue
+            pairs.add(tuple(split_leading_columns(line, 2)[:2]))
+    return pairs
+
+
+def iterate_tsv_lines(filename, assembly_a_names=None):
+    """
+    Yields the lines of a pairwise TSV file (header first). If assembly_a_names is given, only rows
+    with one of those assembly_a names are yielded. When the TSV has an up-to-date index, the
+    reader seeks directly to those rows, otherwise the whole file is scanned. The filename can also
+    be a pairwise results database, in which case the lines come from there.
+    """
+    if is_results_database(filename):
+        yield from iterate_database_lines(filename, assembly_a_names)
+        return
+    index = None if assembly_a_names is None else load_tsv_index(filename)
+    if index is None:
+        with get_open_func(filename)(filename, 'rt') as f:
+            for i, line in enumerate(f):
+                if i == 0 or assembly_a_names is None or \
+                        line[:line.find('\t')] in assembly_a_names:
+                    yield line
+        return
+    offsets = sorted((offset, length) for name in assembly_a_names
+                     for _, _, offset, length in index.get(name, []))
+    with open(filename, 'rb') as f:
+        yield f.readline().decode()
+        for offset, length in offsets:
+            f.seek(offset)
+            yield f.read(length).decode()
+
+
+# The columns with assembly_a's vertical, horizontal and unaligned regions (in that order).
+A_REGION_COLUMNS = ['assembly_a_vertical_regions', 'assembly_a_horizontal_regions',
+                    'assembly_a_unaligned_regions']
+
+# Columns which aren't numbers (other than the region columns), so are left out of results stores.
+NON_NUMERIC_COLUMNS = {'assembly_a', 'assembly_b', 'result_level', 'mass_peaks'}
+
+# How many rows (or bytes of rows, whichever comes first) are loaded from a TSV file at once, and
+# saved in each results store chunk.
+RESULTS_BLOCK_SIZE = 100000
+RESULTS_BLOCK_BYTES = 2 ** 26
+
+
+def get_value_from_line_parts(parts, column_index):
+    """
+    Returns a numerical value from a TSV line's parts (with any trailing % removed), or None if the
+    value is empty or undefined.
+    """
+    try:
+        value = parts[column_index]
+    except IndexError:
+        sys.exit(f'Error: column {column_index+1} missing from TSV file')
+    if value == '' or value == 'undef':
+        return None
+    try:
+        return float(value.rstrip('%'))
+    except ValueError:
+        sys.exit(f'Error: could not convert {value} to a number')
+
+
+class PairwiseResults(object):
+    """
+    This class holds a block of pairwise results (rows in file order), loaded from either a TSV
+    file or a results store. Each sample name is stored once and rows refer to them by index.
+    Numerical columns are in a rows×columns float64 array (NaN for missing values) and assembly_a's
+    regions (if loaded) are in a RegionArrays object.
+    """
+    def __init__(self, sample_names, a_indices, b_indices, column_names, values, regions=None):
+        self.sample_names = list(sample_names)
+        self.a_indices = a_indices
+        self.b_indices = b_indices
+        self.column_names = list(column_names)
+        self.values = values
+        self.regions = regions
+
+    def __len__(self):
+        return len(self.a_indices)
+
+    def get_column(self, column_name):
+        return self.values[:, self.column_names.index(column_name)]
+
+    def get_names(self, row):
+        return self.sample_names[self.a_indices[row]], self.sample_names[self.b_indices[row]]
+
+    def get_regions(self, row):
+        """
+        Returns assembly_a's vertical, horizontal and unaligned regions for one row, each as a
+        dictionary of contig name to an N×2 array of start/end positions (like parse_regions).
+        """
+        return self.regions.get_row(row)
+
+    def select(self, rows, column_names):
+        """
+        Returns a new PairwiseResults with only the given rows and columns.
+        """
+        column_indices = [self.column_names.index(c) for c in column_names]
+        regions = None if self.regions is None else self.regions.select(rows)
+        return PairwiseResults(self.sample_names, self.a_indices[rows], self.b_indices[rows],
+                               column_names, self.values[rows][:, column_indices], regions)
+
+
+class RegionArrays(object):
+    """
+    This class holds assembly_a regions for many rows in flat arrays. The regions for row i are at
+    offsets[i]:offsets[i+1], and each region has a contig (an index into contig_names), a
+    classification (0 = vertical, 1 = horizontal, 2 = unaligned) and start/end positions.
+    """
+    def __init__(self, contig_names, offsets, contigs, classes, starts, ends):
+        self.contig_names = list(contig_names)
+        self.offsets = offsets
+        self.contigs = contigs
+        self.classes = classes
+        self.starts = starts
+        self.ends = ends
+
+    def get_row(self, row):
+        start, end = self.offsets[row], self.offsets[row + 1]
+        contigs, classes = self.contigs[start:end], self.classes[start:end]
+        starts, ends = self.starts[start:end], self.ends[start:end]
+        row_regions = ({}, {}, {})
+        for i in range(len(contigs)):
+            name = self.contig_names[contigs[i]]
+            if name not in row_regions[classes[i]]:
+                in_contig = (classes == classes[i]) & (contigs == contigs[i])
+                row_regions[classes[i]][name] = np.stack([starts[in_contig], ends[in_contig]],
+                                                         axis=1)
+        return row_regions
+
+    def select(self, rows):
+        rows = np.arange(len(self.offsets) - 1)[rows]
+        counts = self.offsets[rows + 1] - self.offsets[rows]
+        new_offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+        indices = np.repeat(self.offsets[rows] - new_offsets[:-1], counts) + \
+            np.arange(new_offsets[-1])
+        return RegionArrays(self.contig_names, new_offsets, self.contigs[indices],
+                            self.classes[indices], self.starts[indices], self.ends[indices])
+
+
+def parse_results_lines(lines, header_parts, column_names, regions, filename):
+    """
+    Parses pairwise TSV lines into a PairwiseResults object. Lines are only split as far as needed
+    for the requested columns (and the region columns if regions is True).
+    """
+    column_indices = [get_column_index(header_parts, c, filename) for c in column_names]
+    region_indices = [get_column_index(header_parts, c, filename) for c in A_REGION_COLUMNS] \
+        if regions else []
+    column_count = max(column_indices + region_indices + [1]) + 1
+    name_indices, contig_indices = {}, {}
+    a_indices = np.empty(len(lines), dtype=np.int64)
+    b_indices = np.empty(len(lines), dtype=np.int64)
+    values = np.empty((len(lines), len(column_names)))
+    region_counts, region_parts = np.zeros(len(lines), dtype=np.int64), []
+    for row, line in enumerate(lines):
+        parts = split_leading_columns(line, column_count)
+        a_indices[row] = name_indices.setdefault(parts[0], len(name_indices))
+        b_indices[row] = name_indices.setdefault(parts[1], len(name_indices))
+        for j, column_index in enumerate(column_indices):
+            value = get_value_from_line_parts(parts, column_index)
+            values[row, j] = np.nan if value is None else value
+        for classification, column_index in enumerate(region_indices):
+            if column_index >= len(parts):
+                sys.exit(f'Error: column {column_index+1} missing from TSV file')
+            for name, contig_regions in parse_regions(parts[column_index]).items():
+                contig_index = contig_indices.setdefault(name, len(contig_indices))
+                region_parts.append((contig_index, classification, contig_regions))
+                region_counts[row] += len(contig_regions)
+    region_arrays = None
+    if regions:
+        region_arrays = get_region_arrays(contig_indices, region_counts, region_parts)
+    return PairwiseResults(name_indices, a_indices, b_indices, column_names, values,
+                           region_arrays)
+
+
+def get_region_arrays(contig_indices, region_counts, region_parts):
+    offsets = np.concatenate([[0], np.cumsum(region_counts)]).astype(np.int64)
+    if not region_parts:
+        empty = np.empty(0, dtype=np.int64)
+        return RegionArrays(contig_indices, offsets, empty, empty.astype(np.uint8), empty, empty)
+    all_regions = np.concatenate([r for _, _, r in region_parts])
+    lengths = [len(r) for _, _, r in region_parts]
+    contigs = np.repeat([c for c, _, _ in region_parts], lengths).astype(np.int64)
+    classes = np.repeat([c for _, c, _ in region_parts], lengths).astype(np.uint8)
+    return RegionArrays(contig_indices, offsets, contigs, classes, all_regions[:, 0],
+                        all_regions[:, 1])
+
+
+def iterate_results(filename, column_names, assembly_a_names=None, regions=False):
+    """
+    Yields PairwiseResults blocks (in file order) with the requested numerical columns, and
+    assembly_a's regions if regions is True. If the TSV file has an up-to-date results store, the
+    results come from there, otherwise the TSV file is read (using its index if it has one). If
+    assembly_a_names is given, only rows with one of those assembly_a names are included.
+    """
+    if is_results_store_current(filename):
+        yield from iterate_results_store(filename, column_names, assembly_a_names, regions)
+        return
+    lines = iterate_tsv_lines(filename, assembly_a_names)
+    header = next(lines, '')
+    if not header:
+        return
+    header_parts = header.rstrip('\n').split('\t')
+    if regions:
+        check_header_for_assembly_a_regions(header_parts, filename)
+    block, block_bytes = [], 0
+    for line in lines:
+        block.append(line)
+        block_bytes += len(line)
+        if len(block) == RESULTS_BLOCK_SIZE or block_bytes >= RESULTS_BLOCK_BYTES:
+            yield parse_results_lines(block, header_parts, column_names, regions, filename)
+            block, block_bytes = [], 0
+    if block:
+        yield parse_results_lines(block, header_parts, column_names, regions, filename)
+
+
+def get_results_store_dirname(filename):
+    """
+    Returns the directory of the columnar results store for a pairwise TSV file, e.g.
+    pairwise.tsv -> pairwise.tsv.store.
+    """
+    return filename.parent / (filename.name + '.store')
+
+
+def load_results_store_manifest(store_dir):
+    """
+    Returns a list of (chunk filename, TSV end offset, TSV tail checksum) tuples for the store's
+    chunks. Each chunk holds the TSV rows from the previous chunk's end offset up to its own.
+    """
+    manifest = store_dir / 'manifest.tsv'
+    if not manifest.is_file():
+        return []
+    chunks = []
+    with open(manifest, 'rt') as f:
+        for line in f:
+            chunk_name, end_offset, tail_checksum = line.rstrip('\n').split('\t')
+            chunks.append((chunk_name, int(end_offset), int(tail_checksum)))
+    return chunks
+
+
+def get_tail_checksum(f, end_offset):
+    """
+    Returns a CRC32 of the (up to) 1 kB of the file which ends at the given offset. This is used to
+    check that the part of a TSV file already in a results store hasn't been rewritten.
+    """
+    start = max(0, end_offset - 1024)
+    f.seek(start)
+    return zlib.crc32(f.read(end_offset - start))
+
+
+def is_results_store_current(filename):
+    """
+    A results store is current if it covers the whole TSV file and was updated after the TSV file
+    was last modified.
+    """
+    store_dir = get_results_store_dirname(filename)
+    chunks = load_results_store_manifest(store_dir)
+    if not chunks or not filename.is_file():
+        return False
+    stat = filename.stat()
+    return chunks[-1][1] == stat.st_size and \
+        (store_dir / 'manifest.tsv').stat().st_mtime_ns >= stat.st_mtime_ns
+
+
+def build_results_store(filename, header=None):
+    """
+    Builds or updates the columnar results store for a (non-gzipped) pairwise TSV file. The store
+    is append-only: if the TSV has grown since the store was last updated, only the new rows are
+    parsed and saved in a new chunk. If the TSV has shrunk or its already-stored part has changed,
+    the store is rebuilt. If the file has no header line (e.g. a later --part), the header must be
+    given.
+    """
+    if is_results_database(filename):
+        sys.exit(f'Error: cannot make a results store for {filename} because it is a results '
+                 f'database')
+    if get_compression_type(filename) != 'plain':
+        sys.exit(f'Error: cannot make a results store for {filename} because it is compressed')
+    store_dir = get_results_store_dirname(filename)
+    store_dir.mkdir(exist_ok=True)
+    chunks = load_results_store_manifest(store_dir)
+    with open(filename, 'rb') as f:
+        if chunks and (chunks[-1][1] > filename.stat().st_size or
+                       get_tail_checksum(f, chunks[-1][1]) != chunks[-1][2]):
+            for chunk_name, _, _ in chunks:
+                (store_dir / chunk_name).unlink()
+            chunks = []
+        offset = chunks[-1][1] if chunks else 0
+        f.seek(0)
+        first_line = f.readline().decode()
+        if first_line.startswith('assembly_a\t'):
+            header = first_line
+            offset = max(offset, len(first_line.encode()))
+        elif header is None:
+            sys.exit(f'Error: {filename} has no header')
+        header_parts = header.rstrip('\n').split('\t')
+        column_names = [c for c in header_parts
+                        if c not in NON_NUMERIC_COLUMNS and not c.endswith('_regions')]
+        f.seek(offset)
+        new_chunks, block, block_start = [], [], offset
+        for line in f:
+            block.append(line.decode())
+            offset += len(line)
+            if len(block) == RESULTS_BLOCK_SIZE or offset - block_start >= RESULTS_BLOCK_BYTES:
+                new_chunks.append(save_results_store_chunk(store_dir, len(chunks) + len(new_chunks),
+                                                           offset, block, header_parts,
+                                                           column_names, filename))
+                block, block_start = [], offset
+        if block or not (chunks or new_chunks):
+            new_chunks.append(save_results_store_chunk(store_dir, len(chunks) + len(new_chunks),
+                                                       offset, block, header_parts, column_names,
+                                                       filename))
+        chunks += [(name, end, get_tail_checksum(f, end)) for name, end in new_chunks]
+    with open(store_dir / 'manifest.tsv', 'wt') as f:
+        for chunk_name, end_offset, tail_checksum in chunks:
+            f.write(f'{chunk_name}\t{end_offset}\t{tail_checksum}\n')
+
+
+def save_results_store_chunk(store_dir, chunk_number, end_offset, lines, header_parts,
+                             column_names, filename):
+    """
+    Saves one chunk of the results store. Regions are only included if the TSV has the
+    assembly_a region columns, and the TSV header is saved too so requests for missing columns fail
+    the same way as they would for the TSV.
+    """
+    has_regions = all(c in header_parts for c in A_REGION_COLUMNS)
+    results = parse_results_lines(lines, header_parts, column_names, has_regions, filename)
+    chunk_name = f'chunk_{chunk_number:06d}.npz'
+    arrays = {'header': np.array(header_parts, dtype=str),
+              'sample_names': np.array(results.sample_names, dtype=str),
+              'a_indices': results.a_indices, 'b_indices': results.b_indices,
+              'column_names': np.array(results.column_names, dtype=str),
+              'values': results.values}
+    if has_regions:
+        r = results.regions
+        arrays.update({'contig_names': np.array(r.contig_names, dtype=str),
+                       'region_offsets': r.offsets, 'region_contigs': r.contigs,
+                       'region_classes': r.classes, 'region_starts': r.starts,
+                       'region_ends': r.ends})
+    np.savez(store_dir / chunk_name, **arrays)
+    return chunk_name, end_offset
+
+
+def iterate_results_store(filename, column_names, assembly_a_names, regions):
+    store_dir = get_results_store_dirname(filename)
+    for chunk_name, _, _ in load_results_store_manifest(store_dir):
+        with np.load(store_dir / chunk_name, allow_pickle=False) as chunk:
+            header_parts = chunk['header'].tolist()
+            if regions:
+                check_header_for_assembly_a_regions(header_parts, filename)
+            for c in column_names:
+                get_column_index(header_parts, c, filename)
+            region_arrays = None
+            if regions:
+                region_arrays = RegionArrays(chunk['contig_names'].tolist(),
+                                             chunk['region_offsets'], chunk['region_contigs'],
+                                             chunk['region_classes'], chunk['region_starts'],
+                                             chunk['region_ends'])
+            results = PairwiseResults(chunk['sample_names'].tolist(), chunk['a_indices'],
+                                      chunk['b_indices'], chunk['column_names'].tolist(),
+                                      chunk['values'], region_arrays)
+        if assembly_a_names is None:
+            rows = np.arange(len(results))
+        else:
+            in_names = np.array([n in assembly_a_names for n in results.sample_names], dtype=bool)
+            rows = np.flatnonzero(in_names[results.a_indices])
+        if len(rows) > 0:
+            yield results.select(rows, column_names)